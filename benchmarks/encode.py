@@ -0,0 +1,54 @@
+"""Encode time and output size of every output preset and format.
+
+    python benchmarks/encode.py --size 4000x3000 --repeat 3
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageFilter  # noqa: E402
+
+from watermark_engine.encode import PRESETS, OutputOptions, encode  # noqa: E402
+
+
+def photo_like(size):
+    """Image with gradients and some grain, closer to a photo than flat noise"""
+    gradient = Image.linear_gradient("L").resize(size)
+    grain = Image.effect_noise(size, 24).filter(ImageFilter.GaussianBlur(1))
+    return Image.merge("RGB", (gradient, grain, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="4000x3000", help="image size WxH (default 12 MP)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--formats", default="jpeg,png,webp,avif")
+    args = parser.parse_args()
+    size = tuple(int(v) for v in args.size.lower().split("x"))
+    img = photo_like(size)
+    Image.init()
+
+    print(f"{size[0]}x{size[1]} ({size[0] * size[1] / 1e6:.1f} MP), best of {args.repeat}")
+    print(f"{'format':<8}{'preset':<10}{'ms':>10}{'KB':>10}")
+    for fmt in args.formats.upper().split(","):
+        if fmt not in Image.SAVE:
+            print(f"{fmt:<8}(encoder not available)")
+            continue
+        for preset in PRESETS:
+            options = OutputOptions.from_preset(preset)
+            best = None
+            for _ in range(args.repeat):
+                buf = BytesIO()
+                start = time.perf_counter()
+                encode(img, buf, fmt, options)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{fmt:<8}{preset:<10}{best * 1000:>10.1f}{buf.tell() / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
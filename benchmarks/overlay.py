@@ -0,0 +1,89 @@
+"""Full-frame overlay vs cropped watermark layer.
+
+Runs each path in a fresh interpreter so peak RSS is not shared:
+
+    python benchmarks/overlay.py --size 8660x5774 --repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from watermark_engine import WatermarkJob, render  # noqa: E402
+from watermark_engine.fonts import load_font  # noqa: E402
+from watermark_engine.render import MARGIN, font_size_for  # noqa: E402
+
+
+def render_full_frame(img, job):
+    """The pre-cropping render path, kept here as the reference"""
+    color = (255, 255, 255, job.opacity)
+    width, height = img.size
+    font = load_font(job.font_path, font_size_for(img.size, job.font_percent))[0]
+    txt_layer = Image.new("RGBA", img.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(txt_layer)
+    bbox = draw.textbbox((0, 0), job.text, font=font)
+    position = (width - (bbox[2] - bbox[0]) - MARGIN, height - (bbox[3] - bbox[1]) - MARGIN)
+    draw.text(position, job.text, font=font, fill=color)
+    img.alpha_composite(txt_layer)
+
+
+def peak_rss_mb():
+    """Peak RSS of this process in MB, None where the resource module is missing"""
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def run_one(mode, size, repeat, font_path):
+    job = WatermarkJob("@shinai_dev", font_path=font_path, font_percent=5, opacity=180, auto_color=False)
+    img = Image.new("RGBA", size, (90, 120, 150, 255))
+    # Warm the font cache so only the overlay work is measured
+    load_font(job.font_path, font_size_for(img.size, job.font_percent))
+    baseline = peak_rss_mb()
+    fn = render_full_frame if mode == "full" else render
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(img, job)
+    elapsed = (time.perf_counter() - start) / repeat
+    extra = f"{peak_rss_mb() - baseline:.1f}" if baseline is not None else "n/a"
+    print(f"{elapsed:.6f} {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="8660x5774", help="image size WxH (default ~50 MP)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--font", dest="font_path", help="TrueType font to draw with")
+    parser.add_argument("--mode", choices=("full", "cropped"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    size = tuple(int(v) for v in args.size.lower().split("x"))
+
+    if args.mode:
+        run_one(args.mode, size, args.repeat, args.font_path)
+        return
+
+    print(f"{size[0]}x{size[1]} ({size[0] * size[1] / 1e6:.1f} MP), {args.repeat} renders")
+    print(f"{'path':<10}{'ms/image':>12}{'extra peak RSS MB':>20}")
+    for mode in ("full", "cropped"):
+        cmd = [sys.executable, __file__, "--mode", mode, "--size", args.size, "--repeat", str(args.repeat)]
+        if args.font_path:
+            cmd += ["--font", args.font_path]
+        elapsed, rss = subprocess.check_output(cmd, text=True).split()
+        print(f"{mode:<10}{float(elapsed) * 1000:>12.2f}{rss:>20}")
+
+
+if __name__ == "__main__":
+    main()
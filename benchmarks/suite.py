@@ -0,0 +1,299 @@
+"""Stage by stage timings of the batch pipeline on a synthetic corpus.
+
+Generates a seeded corpus (JPEG and PNG, RGB/RGBA/L/P, light and dark
+backgrounds) once, then watermarks it in fresh interpreters through
+batch.process_image, reporting the stage timings it records for every
+image (read, decode, brightness, font, render, composite, encode, write):
+
+    python benchmarks/suite.py                      # quick profile, 1 and 4 MP
+    python benchmarks/suite.py --profile full       # 1 to 100 MP
+    python benchmarks/suite.py --save-baseline      # store the result to compare against
+
+When a baseline exists the run fails (exit code 1) if throughput, a stage
+or peak RSS got worse than the baseline by more than --tolerance. Peak
+RSS needs the resource module, it is reported as n/a on Windows.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import zlib
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from watermark_engine import WatermarkJob  # noqa: E402
+from watermark_engine.batch import process_image  # noqa: E402
+from watermark_engine.encode import OutputOptions  # noqa: E402
+from watermark_engine.metrics import STAGES  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Bump when the stages or what they cover change, baselines of another version are not compared
+TIMING_VERSION = 2
+
+# Bump when the generated images change so old corpora are rebuilt
+CORPUS_VERSION = 1
+
+PROFILES = {
+    "quick": (1, 4),
+    "full": (1, 12, 24, 50, 100),
+}
+
+# (format, mode) of the generated sources, JPEG cannot store alpha or palettes
+VARIANTS = (("JPEG", "RGB"), ("JPEG", "L"), ("PNG", "RGB"), ("PNG", "RGBA"), ("PNG", "P"))
+
+BACKGROUNDS = {"light": (150, 250), "dark": (10, 110)}
+
+# Stage changes smaller than this are noise whatever the tolerance
+NOISE_FLOOR = 0.005
+
+
+def size_for(megapixels):
+    """3:2 frame of about that many megapixels"""
+    width = int(math.sqrt(megapixels * 1e6 * 1.5))
+    return width, int(megapixels * 1e6 / width)
+
+
+def smooth_noise(size, rng):
+    """Seeded low frequency noise, Image.effect_noise cannot be seeded"""
+    small = (64, 48)
+    data = bytes(rng.getrandbits(8) for _ in range(small[0] * small[1]))
+    return Image.frombytes("L", small, data).resize(size, Image.BILINEAR)
+
+
+def make_image(megapixels, background, mode, seed):
+    rng = random.Random(seed)
+    size = size_for(megapixels)
+    low, high = BACKGROUNDS[background]
+    gradient = Image.linear_gradient("L").resize(size)
+    channels = []
+    mirrored = gradient.transpose(Image.FLIP_LEFT_RIGHT)
+    for i in range(3):
+        band = Image.blend(smooth_noise(size, rng), mirrored if i == 1 else gradient, 0.5)
+        channels.append(band.point(lambda v: low + v * (high - low) // 255))
+    if mode == "L":
+        return channels[0]
+    img = Image.merge("RGB", channels)
+    if mode == "RGBA":
+        alpha = gradient.transpose(Image.ROTATE_180).point(lambda v: 128 + v // 2)
+        img.putalpha(alpha)
+    elif mode == "P":
+        img = img.quantize(64)
+    return img
+
+
+def corpus_spec(profile):
+    spec = []
+    for megapixels in PROFILES[profile]:
+        for background in BACKGROUNDS:
+            for fmt, mode in VARIANTS:
+                ext = ".jpg" if fmt == "JPEG" else ".png"
+                spec.append({"name": f"{megapixels:03d}mp_{background}_{mode.lower()}{ext}",
+                             "megapixels": megapixels, "background": background, "format": fmt, "mode": mode})
+    return spec
+
+
+def build_corpus(folder, profile, seed):
+    """Generate the corpus unless folder already holds the same one"""
+    spec = corpus_spec(profile)
+    index_path = os.path.join(folder, "corpus.json")
+    expected = {"version": CORPUS_VERSION, "seed": seed, "images": spec}
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            if json.load(f) == expected and all(os.path.exists(os.path.join(folder, s["name"])) for s in spec):
+                return spec
+    except (OSError, ValueError):
+        pass
+    os.makedirs(folder, exist_ok=True)
+    for entry in spec:
+        print(f"generating {entry['name']}", file=sys.stderr)
+        img = make_image(entry["megapixels"], entry["background"], entry["mode"],
+                         seed ^ zlib.crc32(entry["name"].encode("utf-8")))
+        params = {"quality": 90} if entry["format"] == "JPEG" else {"compress_level": 3}
+        img.save(os.path.join(folder, entry["name"]), entry["format"], **params)
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(expected, f, indent=2)
+    return spec
+
+
+def peak_rss_mb():
+    """Peak RSS of this process in MB, None where the resource module is missing"""
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def time_image(folder, name, job, output, out_dir):
+    """Watermark one image the way a batch does, returning seconds per stage"""
+    result = process_image(folder, name, job, output, out_dir)
+    if not result.ok:
+        raise RuntimeError(f"{name}: {result.error}")
+    times = result.metrics["times"]
+    return {stage: times.get(stage, 0.0) for stage in STAGES}
+
+
+def run_corpus(folder, font_path, color_mode):
+    """One cold pass over the corpus, the body of each measuring subprocess"""
+    with open(os.path.join(folder, "corpus.json"), "r", encoding="utf-8") as f:
+        spec = json.load(f)["images"]
+    job = WatermarkJob("@shinai_dev", font_path=font_path, color_mode=color_mode)
+    output = OutputOptions()
+    images = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for entry in spec:
+            images[entry["name"]] = time_image(folder, entry["name"], job, output, out_dir)
+    print(json.dumps({"images": images, "peak_rss_mb": peak_rss_mb()}))
+
+
+def measure(folder, spec, args):
+    """Best of args.repeat cold passes, each in a fresh interpreter"""
+    best = {}
+    peak = None
+    for _ in range(args.repeat):
+        cmd = [sys.executable, os.path.abspath(__file__), "--run-corpus", folder, "--color-mode", args.color_mode]
+        if args.font_path:
+            cmd += ["--font", args.font_path]
+        run = json.loads(subprocess.run(cmd, check=True, capture_output=True, text=True).stdout)
+        for name, times in run["images"].items():
+            if name not in best:
+                best[name] = times
+            else:
+                best[name] = {stage: min(best[name][stage], times[stage]) for stage in STAGES}
+        if run["peak_rss_mb"] is not None:
+            peak = run["peak_rss_mb"] if peak is None else min(peak, run["peak_rss_mb"])
+
+    stage_seconds = {stage: sum(times[stage] for times in best.values()) for stage in STAGES}
+    total = sum(stage_seconds.values())
+    in_bytes = sum(os.path.getsize(os.path.join(folder, entry["name"])) for entry in spec)
+    pixels = sum(entry["megapixels"] for entry in spec)
+    return {
+        "images": len(spec),
+        "seconds": total,
+        "images_per_sec": len(spec) / total,
+        "mb_per_sec": in_bytes / 1e6 / total,
+        "mp_per_sec": pixels / total,
+        "peak_rss_mb": peak,
+        "stage_seconds": stage_seconds,
+        "per_image": best,
+    }
+
+
+def machine():
+    return {"platform": platform.platform(), "python": platform.python_version(), "pillow": PIL.__version__,
+            "cpus": os.cpu_count()}
+
+
+def print_report(result, spec):
+    total = result["seconds"]
+    peak = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "n/a"
+    print(f"{result['images']} images, {total:.2f} s: {result['images_per_sec']:.2f} images/s, "
+          f"{result['mb_per_sec']:.1f} MB/s, {result['mp_per_sec']:.1f} MP/s, peak RSS {peak}")
+    print(f"{'stage':<12}{'s':>10}{'share':>8}")
+    for stage, seconds in result["stage_seconds"].items():
+        print(f"{stage:<12}{seconds:>10.3f}{seconds / total:>8.0%}")
+    print()
+    print(f"{'image':<26}" + "".join(f"{stage:>11}" for stage in STAGES) + f"{'ms':>10}")
+    for entry in spec:
+        times = result["per_image"][entry["name"]]
+        print(f"{entry['name']:<26}" + "".join(f"{times[stage] * 1000:>11.1f}" for stage in STAGES)
+              + f"{sum(times.values()) * 1000:>10.1f}")
+
+
+def compare(result, baseline, tolerance):
+    """Return the regressions of result against a baseline as readable lines"""
+    failures = []
+    for key in ("images_per_sec", "mb_per_sec"):
+        if result[key] < baseline[key] * (1 - tolerance):
+            failures.append(f"{key}: {result[key]:.2f} < baseline {baseline[key]:.2f}")
+    # Peak RSS is not measured on Windows, the rest of the gate still applies
+    if None not in (result["peak_rss_mb"], baseline.get("peak_rss_mb")) \
+            and result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        failures.append(f"peak_rss_mb: {result['peak_rss_mb']:.0f} > baseline {baseline['peak_rss_mb']:.0f}")
+    for stage, seconds in result["stage_seconds"].items():
+        before = baseline["stage_seconds"].get(stage)
+        if before is not None and seconds > before * (1 + tolerance) and seconds - before > NOISE_FLOOR:
+            failures.append(f"{stage}: {seconds:.3f} s > baseline {before:.3f} s")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--corpus", help="corpus folder (default benchmarks/.corpus/<profile>)")
+    parser.add_argument("--repeat", type=int, default=3, help="cold passes, the best time of each stage is kept")
+    parser.add_argument("--font", dest="font_path", help="TrueType font to draw with (default: Pillow's)")
+    parser.add_argument("--color-mode", default="region", choices=("image", "region", "glyph"))
+    parser.add_argument("--baseline", default=os.path.join(HERE, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown before failing (0.15 = 15%%)")
+    parser.add_argument("--json", help="also write the full result to this file")
+    parser.add_argument("--run-corpus", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_corpus:
+        run_corpus(args.run_corpus, args.font_path, args.color_mode)
+        return 0
+
+    folder = args.corpus or os.path.join(HERE, ".corpus", args.profile)
+    spec = build_corpus(folder, args.profile, args.seed)
+    result = measure(folder, spec, args)
+    print_report(result, spec)
+    record = {"timing": TIMING_VERSION, "profile": args.profile, "seed": args.seed, "font": args.font_path,
+              "color_mode": args.color_mode, "machine": machine(), "result": result}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+
+    # One baseline per profile, they are not comparable with each other
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baselines = json.load(f)
+    except (OSError, ValueError):
+        baselines = {}
+    if args.save_baseline:
+        baselines[args.profile] = record
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2)
+        print(f"\nbaseline saved to {args.baseline}")
+        return 0
+
+    baseline = baselines.get(args.profile)
+    if baseline is None:
+        print(f"\nno {args.profile} baseline in {args.baseline}, run with --save-baseline to create one")
+        return 0
+    if baseline.get("timing") != TIMING_VERSION:
+        print(f"\nthe {args.profile} baseline times other stages, run with --save-baseline to replace it")
+        return 0
+    if baseline["machine"] != record["machine"]:
+        print("\nwarning: the baseline was recorded on another machine or Python/Pillow version", file=sys.stderr)
+    if (baseline["seed"], baseline["font"], baseline["color_mode"]) != (args.seed, args.font_path, args.color_mode):
+        print("warning: the baseline used another seed, font or color mode", file=sys.stderr)
+    failures = compare(result, baseline["result"], args.tolerance)
+    if failures:
+        print(f"\nREGRESSION against {args.baseline}:")
+        for line in failures:
+            print(f"  {line}")
+        return 1
+    print(f"\nno regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,39 @@
 import os
 import json
-from io import BytesIO
-from PIL import Image, ImageFont, ImageDraw, ImageStat
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox, font as tkfont
-from matplotlib import font_manager
 import threading
 import time
+from PIL import ImageTk
+from watermark_engine import (OUTPUT_PREFIX, EventChannel, FolderSource, FontCatalog, JobReport, Manifest,
+                              OutputOptions, PipelineOptions, PixelProgress, Rendition, WatermarkJob, run_batch)
+from watermark_engine.preview import PreviewRenderer
+
+FONT_CATALOG_PATH = "setting/font_catalog.json"
+
+# The worker thread only queues events, the Tk thread applies them every frame
+FRAME_MS = 33
+MAX_EVENTS_PER_FRAME = 2000
+MAX_CONSOLE_LINES = 1000
+
+# The preview renders once the settings stop changing for this long, fitted in this box
+PREVIEW_DELAY_MS = 120
+PREVIEW_FIT = (760, 220)
 
 class WatermarkApp:
     def __init__(self, root):
         self.root = root
         self.root.title("WaterMark Pro")
-        self.root.geometry("850x700")
+        self.root.geometry("850x940")
         self.set_minimalist_theme()
         self.config = self.load_settings()
+        self.events = EventChannel()
         self.font_map = self.get_system_fonts()
         self.processing = False
+        # Rendered off the Tk thread on a reduced copy of a sample image
+        self.preview = PreviewRenderer(self.on_preview_rendered, skip_prefixes=(OUTPUT_PREFIX,))
+        self.preview_after = None
+        self.preview_photo = None
         self.current_language = self.config.get("language", "english")
         self.languages = {
             "en": self.load_english(),
@@ -27,6 +44,8 @@ class WatermarkApp:
         }
         self.setup_ui()
         self.update_language()
+        self.root.after(FRAME_MS, self.pump_events)
+        self.schedule_preview()
         
     def set_minimalist_theme(self):
         self.bg_color = "#f5f5f7"
@@ -100,19 +119,58 @@ class WatermarkApp:
             "opacity": 180,
             "last_folder": "",
             "auto_color": True,
-            "language": "english"
+            "language": "english",
+            "workers": 0,
+            "color_mode": "region",
+            "output": {"preset": "balanced"},
+            "incremental": True,
+            "report": "",
+            "memory_budget_mb": 2048
         }
 
     def get_system_fonts(self):
-        font_paths = font_manager.findSystemFonts(fontext='ttf')
-        font_map = {}
-        for path in font_paths:
-            try:
-                name = os.path.splitext(os.path.basename(path))[0]
-                font_map[name] = path
-            except:
+        # The catalog loads from disk instantly, only the first launch has to scan
+        self.font_catalog = FontCatalog.load(FONT_CATALOG_PATH)
+        if not self.font_catalog.fonts:
+            self.font_catalog.refresh()
+        else:
+            self.font_catalog.refresh_in_background(self.on_fonts_refreshed)
+        return self.font_catalog.font_map() or {"Default": (None, 0)}
+
+    def on_fonts_refreshed(self, changed):
+        # Runs on the refresh thread, pump_events applies it on the Tk thread
+        if changed:
+            self.events.emit("fonts")
+
+    def pump_events(self):
+        """Apply what the worker threads queued since the last frame, on the Tk thread"""
+        events, progress = self.events.drain(MAX_EVENTS_PER_FRAME)
+        if progress is not None:
+            done, total = progress
+            self.progress['value'] = done / total * 100
+        lines = []
+        for kind, payload in events:
+            if kind == "log":
+                lines.append(payload)
                 continue
-        return dict(sorted(font_map.items())) or {"Arial": font_manager.findfont("Arial")}
+            # Keep the console in order with the other updates
+            self.write_console(lines)
+            lines = []
+            if kind == "status":
+                key, color = payload
+                self.status_label.config(text=self.translate(key), foreground=color)
+            elif kind == "dialog":
+                show, title, message = payload
+                show(title, message)
+            elif kind == "finished":
+                self.finish_processing()
+            elif kind == "fonts":
+                self.font_map = self.font_catalog.font_map() or self.font_map
+                self.filter_fonts()
+            elif kind == "preview":
+                self.show_preview(*payload)
+        self.write_console(lines)
+        self.root.after(FRAME_MS, self.pump_events)
 
     def setup_ui(self):
         # Main frame with improved spacing
@@ -169,10 +227,12 @@ class WatermarkApp:
         ttk.Label(config_frame, text="Watermark text:").grid(row=1, column=0, sticky="w", pady=5)
         self.entry_text = ttk.Entry(config_frame, width=60)
         self.entry_text.grid(row=1, column=1, columnspan=2, sticky="ew", pady=5, padx=5)
+        self.entry_text.bind("<KeyRelease>", self.schedule_preview)
 
         # Font size
         ttk.Label(config_frame, text="Font size (%):").grid(row=2, column=0, sticky="w", pady=5)
-        self.font_size_spin = ttk.Spinbox(config_frame, from_=1, to=50, width=5)
+        self.font_size_spin = ttk.Spinbox(config_frame, from_=1, to=50, width=5, command=self.schedule_preview)
+        self.font_size_spin.bind("<KeyRelease>", self.schedule_preview)
         self.font_size_spin.grid(row=2, column=1, sticky="w", pady=5, padx=5)
         self.font_size_spin.set(self.config.get("font_percent", 5))
 
@@ -183,7 +243,8 @@ class WatermarkApp:
             from_=0, 
             to=255, 
             orient=tk.HORIZONTAL,
-            length=200
+            length=200,
+            command=self.schedule_preview
         )
         self.opacity_slider.set(self.config.get("opacity", 180))
         self.opacity_slider.grid(row=3, column=1, sticky="w", pady=5, padx=5)
@@ -208,13 +269,24 @@ class WatermarkApp:
         self.font_choice = ttk.Combobox(
             config_frame, 
             textvariable=self.font_search_var,
-            values=list(self.font_map.keys()), 
+            values=self.font_catalog.names() or list(self.font_map.keys()), 
             state="normal",
             width=58
         )
         self.font_choice.grid(row=5, column=1, columnspan=2, sticky="ew", pady=5, padx=5)
         self.font_choice.set(self.config.get("font_file", "Arial"))
         self.font_search_var.trace("w", self.filter_fonts)
+        self.font_choice.bind("<<ComboboxSelected>>", self.schedule_preview)
+
+        # Live preview
+        preview_frame = ttk.LabelFrame(
+            self.main_frame,
+            padding=(15, 10))
+        preview_frame.pack(fill=tk.X, pady=(0, 15))
+        self.preview_label = ttk.Label(preview_frame, anchor="center")
+        self.preview_label.pack(fill=tk.X)
+        sample_btn = ttk.Button(preview_frame, text="Sample image", command=self.browse_sample)
+        sample_btn.pack(anchor="e", pady=(5, 0))
 
         # Action buttons
         action_frame = ttk.Frame(self.main_frame)
@@ -274,16 +346,12 @@ class WatermarkApp:
         config_frame.columnconfigure(1, weight=1)
 
     def toggle_color_controls(self):
-        pass  # Placeholder for future functionality
+        self.schedule_preview()
 
     def filter_fonts(self, *args):
-        search_term = self.font_search_var.get().lower()
-        font_names = list(self.font_map.keys())
-        if search_term == "":
-            self.font_choice['values'] = font_names
-        else:
-            filtered = [f for f in font_names if search_term in f.lower()]
-            self.font_choice['values'] = filtered
+        # Indexed lookup, no scan of every font name on each keystroke
+        self.font_choice['values'] = self.font_catalog.search(self.font_search_var.get())
+        self.schedule_preview()
 
     def browse_folder(self):
         folder_selected = filedialog.askdirectory()
@@ -292,10 +360,64 @@ class WatermarkApp:
             self.entry_path.insert(0, folder_selected)
             self.config["last_folder"] = folder_selected
             self.log(self.translate("Selected directory:") + f" {folder_selected}")
+            self.schedule_preview()
+
+    def browse_sample(self):
+        path = filedialog.askopenfilename(initialdir=self.entry_path.get() or None)
+        if path:
+            self.config["preview_image"] = path
+            self.schedule_preview()
+
+    def schedule_preview(self, *args):
+        # Typing or dragging the slider renders once, when it pauses
+        if self.preview_after is not None:
+            self.root.after_cancel(self.preview_after)
+        self.preview_after = self.root.after(PREVIEW_DELAY_MS, self.request_preview)
+
+    def request_preview(self):
+        self.preview_after = None
+        sample = self.config.get("preview_image")
+        folder = self.entry_path.get()
+        font = self.font_map.get(self.font_choice.get())
+        if not (sample or folder) or font is None:
+            return
+        try:
+            job = self.build_job(self.read_settings(), *font)
+        except ValueError:
+            return  # Half typed font size
+        # The chosen sample, else the first image of the folder, looked for on the preview thread
+        self.preview.request(sample, job, PREVIEW_FIT, folder=folder)
+
+    def on_preview_rendered(self, image, info, error):
+        # Runs on the preview thread, only the Tk thread may build the PhotoImage
+        self.events.emit("preview", (image, error))
+
+    def show_preview(self, image, error):
+        if error is not None:
+            self.preview_photo = None
+            self.preview_label.config(image="", text=f"{self.translate('Preview unavailable:')} {error}")
+            return
+        if image is None:
+            # No image in the folder
+            self.preview_photo = None
+            self.preview_label.config(image="", text="")
+            return
+        self.preview_photo = ImageTk.PhotoImage(image)
+        self.preview_label.config(image=self.preview_photo, text="")
 
     def log(self, message):
+        # Safe from any thread, the line shows up on the next frame
+        self.events.log(message)
+
+    def write_console(self, lines):
+        if not lines:
+            return
         self.console.config(state=tk.NORMAL)
-        self.console.insert(tk.END, f"{message}\n")
+        self.console.insert(tk.END, "\n".join(lines) + "\n")
+        # Drop the oldest lines so long batches do not slow the widget down
+        excess = int(self.console.index("end-1c").split(".")[0]) - 1 - MAX_CONSOLE_LINES
+        if excess > 0:
+            self.console.delete("1.0", f"{excess + 1}.0")
         self.console.see(tk.END)
         self.console.config(state=tk.DISABLED)
 
@@ -309,13 +431,32 @@ class WatermarkApp:
             messagebox.showerror(self.translate("Error"), self.translate("Please select a valid directory"))
             return
             
+        settings = self.read_settings()
         self.processing = True
         self.process_btn.state(['disabled'])
         self.cancel_btn.state(['!disabled'])
         self.status_label.config(text=self.translate("Status: Processing..."), foreground=self.accent_color)
         
-        # Start processing in separate thread
-        threading.Thread(target=self.process_images_thread, daemon=True).start()
+        # Start processing in separate thread, widgets are read here since only the Tk thread may touch them
+        threading.Thread(target=self.process_images_thread, args=(settings,), daemon=True).start()
+
+    def read_settings(self):
+        """Current settings of the widgets, only the Tk thread may call this"""
+        return {
+            "folder": self.entry_path.get(),
+            "text": self.entry_text.get(),
+            "font_percent": int(self.font_size_spin.get()),
+            "font_name": self.font_choice.get(),
+            "opacity": int(self.opacity_slider.get()),
+            "auto_color": self.auto_color_var.get(),
+        }
+
+    def build_job(self, settings, font_path, font_index):
+        return WatermarkJob(settings["text"], font_path, settings["font_percent"], settings["opacity"],
+                            settings["auto_color"], color_mode=self.config.get("color_mode", "region"),
+                            font_index=font_index, layout=self.config.get("layout", "corner"),
+                            angle=self.config.get("angle", 30), spacing=self.config.get("spacing", 50),
+                            logo_path=self.config.get("logo_path") or None)
 
     def cancel_processing(self):
         if self.processing:
@@ -323,131 +464,117 @@ class WatermarkApp:
             self.log(self.translate("Process canceled by user"))
             self.status_label.config(text=self.translate("Status: Canceled"), foreground=self.error_color)
 
-    def process_images_thread(self):
+    def process_images_thread(self, settings):
+        # Runs off the Tk thread: every UI update goes through self.events
         try:
-            folder = self.entry_path.get()
-            watermark_text = self.entry_text.get()
-            font_percent = int(self.font_size_spin.get())
-            font_name = self.font_choice.get()
-            opacity = int(self.opacity_slider.get())
-            auto_color = self.auto_color_var.get()
+            folder = settings["folder"]
+            font_name = settings["font_name"]
 
             # Update configuration
             self.config.update({
-                "font_percent": font_percent,
+                "font_percent": settings["font_percent"],
                 "font_file": font_name,
-                "opacity": opacity,
+                "opacity": settings["opacity"],
                 "last_folder": folder,
-                "auto_color": auto_color,
+                "auto_color": settings["auto_color"],
                 "language": self.current_language
             })
             
             with open("setting/setting.json", "w", encoding="utf-8") as f:
                 json.dump(self.config, f, indent=2)
 
-            font_path = self.font_map.get(font_name)
-            if not font_path:
+            font = self.font_map.get(font_name)
+            if not font:
                 self.log(self.translate("Error: Font not found -") + f" {font_name}")
-                messagebox.showerror(self.translate("Error"), self.translate("Font not found:") + f" {font_name}")
+                self.events.emit("dialog", (messagebox.showerror, self.translate("Error"),
+                                            self.translate("Font not found:") + f" {font_name}"))
                 return
+            font_path, font_index = font
 
-            images = [f for f in os.listdir(folder) if f.lower().endswith((".png", ".jpg", ".jpeg"))]
-            total = len(images)
+            self.log(self.translate("Starting processing of") + f" {folder}")
             
-            if not images:
+            job = self.build_job(settings, font_path, font_index)
+            output = OutputOptions.from_dict(self.config.get("output", {}))
+            # Optional list of extra sizes/formats written from the same decode, see the README
+            renditions = [Rendition.from_dict(r) for r in self.config.get("renditions", [])] or None
+            # Only new or changed images are processed when re-running a folder
+            manifest = None
+            if self.config.get("incremental", True):
+                manifest = Manifest.for_batch(folder, job, output, renditions=renditions)
+            report = JobReport()
+            self.pixel_progress = PixelProgress()
+            # Opt-in: reads and writes overlap with rendering, which matters on synced and network folders,
+            # but images are then no longer admitted against memory_budget_mb, see the README
+            pipeline = PipelineOptions.from_dict(self.config["pipeline"]) if self.config.get("pipeline") else None
+            try:
+                # The folder is scanned while the first images are already processed
+                results = run_batch(folder, job, FolderSource(folder, skip_prefixes=(OUTPUT_PREFIX,)),
+                                    on_result=self.report_result,
+                                    should_continue=lambda: self.processing,
+                                    workers=self.config.get("workers", 0),
+                                    output=output, manifest=manifest, report=report, pipeline=pipeline,
+                                    memory_budget=self.config.get("memory_budget_mb", 2048) << 20,
+                                    progress=self.pixel_progress, renditions=renditions)
+            finally:
+                if manifest is not None:
+                    manifest.close()
+            # Stage timings of the batch as JSON or CSV, when a path is configured
+            if self.config.get("report"):
+                report.write(self.config["report"])
+            
+            if not results and self.processing:
                 self.log(self.translate("Error: No images found in directory"))
-                messagebox.showwarning(self.translate("Warning"), self.translate("No valid images found in directory"))
+                self.events.emit("dialog", (messagebox.showwarning, self.translate("Warning"),
+                                            self.translate("No valid images found in directory")))
                 return
-                
-            self.log(self.translate("Starting processing of") + f" {total} " + self.translate("images..."))
-            
-            for i, img_file in enumerate(images):
-                if not self.processing:
-                    break
-                    
-                img_path = os.path.join(folder, img_file)
-                try:
-                    # Update progress
-                    progress = (i + 1) / total * 100
-                    self.progress['value'] = progress
-                    self.root.update()
-                    
-                    self.log(self.translate("Processing:") + f" {img_file}")
-                    
-                    with Image.open(img_path).convert("RGBA") as img:
-                        # Determine watermark color based on image brightness if auto color is enabled
-                        watermark_color = (255, 255, 255, opacity)  # Default white
-                        if auto_color:
-                            brightness = self.calculate_image_brightness(img)
-                            self.log(f"{self.translate('Brightness:')} {brightness:.2f}")
-                            if brightness > 128:  # Light background
-                                watermark_color = (0, 0, 0, opacity)  # Black watermark
-                                self.log(self.translate("Using black watermark for light background"))
-                            else:
-                                watermark_color = (255, 255, 255, opacity)  # White watermark
-                                self.log(self.translate("Using white watermark for dark background"))
-                        
-                        self.apply_watermark(img, watermark_text, font_path, font_percent, watermark_color)
-                        output_path = os.path.join(folder, f"wm_{img_file}")
-                        img.save(output_path)
-                    
-                except Exception as e:
-                    self.log(f"{self.translate('Error processing')} {img_file}: {str(e)}")
             
             if self.processing:
-                self.log(f"{self.translate('Process completed.')} {len(images)} " + self.translate("images processed"))
-                messagebox.showinfo(self.translate("Success"), f"{len(images)} " + self.translate("images processed with watermark."))
-                self.status_label.config(text=self.translate("Status: Completed"), foreground=self.success_color)
+                self.log(f"{self.translate('Process completed.')} {len(results)} " + self.translate("images processed"))
+                self.events.emit("status", ("Status: Completed", self.success_color))
+                self.events.emit("dialog", (messagebox.showinfo, self.translate("Success"),
+                                            f"{len(results)} " + self.translate("images processed with watermark.")))
         
         except Exception as e:
             self.log(f"{self.translate('Critical error:')} {str(e)}")
-            messagebox.showerror(self.translate("Error"), f"{self.translate('An error occurred:')} {str(e)}")
-            self.status_label.config(text=self.translate("Status: Error"), foreground=self.error_color)
+            self.events.emit("status", ("Status: Error", self.error_color))
+            self.events.emit("dialog", (messagebox.showerror, self.translate("Error"),
+                                        f"{self.translate('An error occurred:')} {str(e)}"))
         
         finally:
-            self.processing = False
-            self.progress['value'] = 0
-            self.process_btn.state(['!disabled'])
-            self.cancel_btn.state(['disabled'])
-            if self.status_label['text'] not in (self.translate("Status: Canceled"), self.translate("Status: Error")):
-                self.status_label.config(text=self.translate("Status: Ready"), foreground=self.secondary_color)
-
-    def calculate_image_brightness(self, img):
-        """Calculate average image brightness (0-255)"""
-        # Convert to grayscale
-        gray_img = img.convert('L')
-        # Calculate statistics
-        stat = ImageStat.Stat(gray_img)
-        return stat.mean[0]
-
-    def apply_watermark(self, img, text, font_path, font_percent, color):
-        if not text:
-            return
-            
-        width, height = img.size
-        font_size = int((width + height) / 2 * font_percent / 100)
+            self.events.emit("finished")
 
-        try:
-            with open(font_path, "rb") as f:
-                font_bytes = BytesIO(f.read())
-            font = ImageFont.truetype(font_bytes, font_size)
-        except Exception as e:
-            self.log(f"{self.translate('Error loading font:')} {str(e)} - " + self.translate("Using default font"))
-            font = ImageFont.load_default()
+    def finish_processing(self):
+        self.processing = False
+        self.progress['value'] = 0
+        self.process_btn.state(['!disabled'])
+        self.cancel_btn.state(['disabled'])
+        if self.status_label['text'] not in (self.translate("Status: Canceled"), self.translate("Status: Error")):
+            self.status_label.config(text=self.translate("Status: Ready"), foreground=self.secondary_color)
 
-        txt_layer = Image.new("RGBA", img.size, (255, 255, 255, 0))
-        draw = ImageDraw.Draw(txt_layer)
-        
-        # Calculate centered position
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        
-        # Position in bottom right corner with margin
-        position = (width - text_width - 20, height - text_height - 20)
+    def report_result(self, i, total, result):
+        # Only the latest progress is drawn, however many images finished in a frame.
+        # Weighted by pixels so a large TIFF moves the bar more than a thumbnail
+        self.events.progress(self.pixel_progress.fraction(total), 1)
         
-        draw.text(position, text, font=font, fill=color)
-        img.alpha_composite(txt_layer)
+        if result.skipped:
+            self.log(self.translate("Up to date:") + f" {result.name}")
+            return
+            
+        self.log(self.translate("Processing:") + f" {result.name}")
+        if not result.ok:
+            self.log(f"{self.translate('Error processing')} {result.name}: {str(result.error)}")
+            return
+            
+        brightness = result.info.get("brightness")
+        if brightness is not None:
+            self.log(f"{self.translate('Brightness:')} {brightness:.2f}")
+            if brightness > 128:  # Light background
+                self.log(self.translate("Using black watermark for light background"))
+            else:
+                self.log(self.translate("Using white watermark for dark background"))
+        font_error = result.info.get("font_error")
+        if font_error:
+            self.log(f"{self.translate('Error loading font:')} {str(font_error)} - " + self.translate("Using default font"))
 
     def change_language(self, language):
         self.current_language = language.lower()
@@ -501,6 +628,7 @@ class WatermarkApp:
             "cancel": "CANCEL",
             "console_ready": "System initialized. Ready to process images.",
             "Selected directory:": "Selected directory:",
+            "Preview unavailable:": "Preview unavailable:",
             "Error: Invalid directory": "Error: Invalid directory",
             "Please select a valid directory": "Please select a valid directory",
             "Process canceled by user": "Process canceled by user",
@@ -523,7 +651,8 @@ class WatermarkApp:
             "Critical error:": "Critical error:",
             "An error occurred:": "An error occurred:",
             "Error loading font:": "Error loading font:",
-            "Using default font": "Using default font"
+            "Using default font": "Using default font",
+            "Up to date:": "Up to date:"
         }
 
     def load_spanish(self):
@@ -546,6 +675,7 @@ class WatermarkApp:
             "cancel": "CANCELAR",
             "console_ready": "Sistema inicializado. Listo para procesar imágenes.",
             "Selected directory:": "Directorio seleccionado:",
+            "Preview unavailable:": "Vista previa no disponible:",
             "Error: Invalid directory": "Error: Directorio no válido",
             "Please select a valid directory": "Por favor seleccione un directorio válido",
             "Process canceled by user": "Proceso cancelado por el usuario",
@@ -568,7 +698,8 @@ class WatermarkApp:
             "Critical error:": "Error crítico:",
             "An error occurred:": "Ocurrió un error:",
             "Error loading font:": "Error cargando fuente:",
-            "Using default font": "Usando fuente por defecto"
+            "Using default font": "Usando fuente por defecto",
+            "Up to date:": "Actualizado:"
         }
 
     def load_japanese(self):
@@ -591,6 +722,7 @@ class WatermarkApp:
             "cancel": "キャンセル",
             "console_ready": "システムが初期化されました。画像処理の準備ができています。",
             "Selected directory:": "選択されたディレクトリ:",
+            "Preview unavailable:": "プレビューを表示できません:",
             "Error: Invalid directory": "エラー: 無効なディレクトリ",
             "Please select a valid directory": "有効なディレクトリを選択してください",
             "Process canceled by user": "ユーザーによって処理がキャンセルされました",
@@ -613,7 +745,8 @@ class WatermarkApp:
             "Critical error:": "重大なエラー:",
             "An error occurred:": "エラーが発生しました:",
             "Error loading font:": "フォントの読み込みエラー:",
-            "Using default font": "デフォルトフォントを使用"
+            "Using default font": "デフォルトフォントを使用",
+            "Up to date:": "最新:"
         }
 
     def load_chinese(self):
@@ -636,6 +769,7 @@ class WatermarkApp:
             "cancel": "取消",
             "console_ready": "系统已初始化。准备处理图片。",
             "Selected directory:": "已选择目录:",
+            "Preview unavailable:": "无法预览:",
             "Error: Invalid directory": "错误: 无效目录",
             "Please select a valid directory": "请选择有效目录",
             "Process canceled by user": "用户取消了处理",
@@ -658,7 +792,8 @@ class WatermarkApp:
             "Critical error:": "严重错误:",
             "An error occurred:": "发生错误:",
             "Error loading font:": "加载字体错误:",
-            "Using default font": "使用默认字体"
+            "Using default font": "使用默认字体",
+            "Up to date:": "已是最新:"
         }
 
     def load_korean(self):
@@ -681,6 +816,7 @@ class WatermarkApp:
             "cancel": "취소",
             "console_ready": "시스템이 초기화되었습니다. 이미지 처리 준비가 되었습니다.",
             "Selected directory:": "선택된 디렉토리:",
+            "Preview unavailable:": "미리보기를 표시할 수 없습니다:",
             "Error: Invalid directory": "오류: 유효하지 않은 디렉토리",
             "Please select a valid directory": "유효한 디렉토리를 선택하세요",
             "Process canceled by user": "사용자에 의해 처리 취소됨",
@@ -703,7 +839,8 @@ class WatermarkApp:
             "Critical error:": "심각한 오류:",
             "An error occurred:": "오류가 발생했습니다:",
             "Error loading font:": "글꼴 로딩 오류:",
-            "Using default font": "기본 글꼴 사용"
+            "Using default font": "기본 글꼴 사용",
+            "Up to date:": "최신 상태:"
         }
 
     def on_closing(self):
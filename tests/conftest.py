@@ -0,0 +1,17 @@
+import os
+
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def make_image(tmp_path):
+    """Factory writing a small image under tmp_path, returns its path"""
+    def make(name, size=(64, 48), mode="RGB", color=(120, 90, 60), fmt=None, **params):
+        path = os.path.join(tmp_path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if mode == "L" and isinstance(color, tuple):
+            color = color[0]
+        Image.new(mode, size, color).save(path, fmt, **params)
+        return path
+    return make
@@ -0,0 +1,120 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+from PIL import Image
+
+from watermark_engine.batch import run_batch
+from watermark_engine.job import WatermarkJob
+from watermark_engine.manifest import Manifest
+from watermark_engine.shards import Shard
+from watermark_engine.sinks import ArchiveSink
+from watermark_engine.sources import ArchiveSource, _safe_member, archive_type
+
+MEMBERS = {"a.jpg": "JPEG", "sub/b.png": "PNG", "sub/c.bmp": "BMP"}
+
+
+def image_bytes(fmt):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (120, 90, 60)).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def write_zip(path):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, fmt in MEMBERS.items():
+            archive.writestr(name, image_bytes(fmt))
+        archive.writestr("notes.txt", b"not an image")
+        archive.writestr("../escape.jpg", image_bytes("JPEG"))
+    return str(path)
+
+
+def write_tar(path):
+    with tarfile.open(path, "w:gz") as tar:
+        # As written by tar -C dir .
+        for name, fmt in MEMBERS.items():
+            data = image_bytes(fmt)
+            info = tarfile.TarInfo(f"./{name}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return str(path)
+
+
+def convert(source, path, **kwargs):
+    sink = ArchiveSink(path)
+    try:
+        results = run_batch(source.path, WatermarkJob("test"), images=source, sink=sink, **kwargs)
+    finally:
+        source.close()
+    sink.close()
+    return results
+
+
+@pytest.mark.parametrize("write", [write_zip, write_tar])
+def test_round_trip_to_zip(tmp_path, write):
+    source = ArchiveSource(write(tmp_path / ("in.zip" if write is write_zip else "in.tar.gz")))
+    results = convert(source, str(tmp_path / "out.zip"))
+    assert sorted(result.name for result in results) == sorted(MEMBERS)
+    assert all(result.ok for result in results)
+
+    with zipfile.ZipFile(tmp_path / "out.zip") as archive:
+        assert sorted(archive.namelist()) == sorted(MEMBERS)
+        infos = {info.filename: info for info in archive.infolist()}
+        assert infos["a.jpg"].compress_type == zipfile.ZIP_STORED
+        assert infos["sub/c.bmp"].compress_type == zipfile.ZIP_DEFLATED
+        with Image.open(io.BytesIO(archive.read("sub/b.png"))) as img:
+            assert img.format == "PNG" and img.size == (64, 48)
+    # Built under a temporary name, nothing else is left next to it
+    assert sorted(os.listdir(tmp_path)) == sorted(["out.zip", os.path.basename(source.path)])
+
+
+def test_round_trip_to_tar_on_a_process_pool(tmp_path):
+    source = ArchiveSource(write_zip(tmp_path / "in.zip"))
+    convert(source, str(tmp_path / "out.tar.gz"), workers=2)
+    with tarfile.open(tmp_path / "out.tar.gz") as tar:
+        assert sorted(tar.getnames()) == sorted(MEMBERS)
+
+
+def test_names_follow_filters_and_shards(tmp_path):
+    path = write_tar(tmp_path / "in.tar.gz")
+    assert sorted(ArchiveSource(path).names()) == sorted(MEMBERS)
+    assert list(ArchiveSource(path, exclude=["*.png", "*.bmp"]).names()) == ["a.jpg"]
+    shards = [sorted(ArchiveSource(path, shard=Shard(i, 2)).names()) for i in (1, 2)]
+    assert sorted(shards[0] + shards[1]) == sorted(MEMBERS)
+
+
+def test_aborted_sink_leaves_nothing(tmp_path):
+    sink = ArchiveSink(str(tmp_path / "out.zip"))
+    sink.write("a.jpg", "JPEG", image_bytes("JPEG"))
+    sink.abort()
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("name, safe", [
+    ("a.jpg", True),
+    ("sub/a.jpg", True),
+    ("../a.jpg", False),
+    ("sub/../../a.jpg", False),
+    ("/etc/a.jpg", False),
+    ("\\a.jpg", False),
+    ("C:/a.jpg", False),
+])
+def test_safe_member(name, safe):
+    assert _safe_member(name) == safe
+
+
+def test_archive_type():
+    assert archive_type("a.TGZ") == ("tar", "gz")
+    assert archive_type("a.tar.xz") == ("tar", "xz")
+    assert archive_type("a.zip") == ("zip", "")
+    assert archive_type("a.jpg") is None
+
+
+def test_archives_cannot_take_a_manifest(tmp_path):
+    source = ArchiveSource(write_zip(tmp_path / "in.zip"))
+    job = WatermarkJob("test")
+    with Manifest.for_batch(str(tmp_path / "out"), job) as manifest:
+        with pytest.raises(ValueError, match="manifest"):
+            run_batch(source.path, job, images=source, output_dir=str(tmp_path / "out"), manifest=manifest)
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+from watermark_engine.batch import run_batch
+from watermark_engine.cli import main
+from watermark_engine.job import WatermarkJob
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_batch_commands_do_not_load_the_service():
+    code = ("import sys, watermark_engine, watermark_engine.cli; "
+            "print(sorted(m for m in ('asyncio', 'watermark_engine.server', 'watermark_engine.watch') "
+            "if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
+
+
+def test_earlier_results_are_skipped_with_an_output_dir(tmp_path, make_image):
+    make_image("a.png")
+    # Left by an earlier run without -o
+    make_image("wm_a.png")
+    out = tmp_path / "out"
+
+    def written():
+        return sorted(name for name in os.listdir(out) if name.endswith(".png"))
+
+    main(["batch", str(tmp_path), "--text", "Sample", "-o", str(out), "-q"])
+    assert written() == ["a.png"]
+    main(["batch", str(tmp_path), "--text", "Sample", "-o", str(out), "-q", "--include-prefixed"])
+    assert written() == ["a.png", "wm_a.png"]
+
+    results = run_batch(str(tmp_path), WatermarkJob("Sample"), output_dir=str(tmp_path / "api"))
+    assert [result.name for result in results] == ["a.png"]
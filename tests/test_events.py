@@ -0,0 +1,58 @@
+import io
+import threading
+
+from watermark_engine.events import EventChannel, StreamReporter
+
+
+def test_drain_keeps_order_and_respects_limit():
+    channel = EventChannel()
+    for i in range(5):
+        channel.log(f"line {i}")
+    channel.error("failed")
+
+    events, _ = channel.drain(limit=4)
+    assert events == [("log", f"line {i}") for i in range(4)]
+    events, _ = channel.drain()
+    assert events == [("log", "line 4"), ("error", "failed")]
+    assert channel.drain() == ([], None)
+
+
+def test_progress_is_coalesced():
+    channel = EventChannel()
+    for done in range(1, 11):
+        channel.progress(done, 10)
+    assert channel.drain() == ([], (10, 10))
+    # Reported once, until it changes again
+    assert channel.drain() == ([], None)
+
+
+def test_producers_on_many_threads_lose_nothing():
+    channel = EventChannel()
+
+    def produce(n):
+        for i in range(200):
+            channel.emit("item", (n, i))
+
+    threads = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    events, _ = channel.drain()
+    assert len(events) == 800
+    for n in range(4):
+        assert [i for _, (m, i) in events if m == n] == list(range(200))
+
+
+def test_stream_reporter_splits_logs_and_errors():
+    channel = EventChannel()
+    out, err = io.StringIO(), io.StringIO()
+    with StreamReporter(channel, out, err, interval=60):
+        channel.log("one")
+        channel.error("bad")
+        channel.log("two")
+        channel.progress(1, 2)
+    # Everything still queued is written on stop
+    assert out.getvalue() == "one\ntwo\n"
+    assert err.getvalue() == "bad\n"
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+from PIL import Image
+
+from watermark_engine.batch import process_image
+from watermark_engine.job import WatermarkJob
+from watermark_engine.large import raw_layout
+
+
+def gradient(mode, size=(320, 240)):
+    """Image whose brightness varies, so a wrong row or channel shows in the output"""
+    img = Image.linear_gradient("L").resize(size)
+    if mode == "L":
+        return img
+    return Image.merge(mode, [img, img.transpose(Image.Transpose.FLIP_LEFT_RIGHT),
+                              img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)] + [img] * (len(mode) - 3))
+
+
+@pytest.mark.parametrize("name, mode", [("a.tif", "RGB"), ("b.tif", "L"), ("c.tif", "RGBA"), ("d.bmp", "RGB")])
+@pytest.mark.parametrize("color_mode", ["region", "image"])
+def test_patching_matches_a_full_decode(tmp_path, name, mode, color_mode):
+    gradient(mode).save(tmp_path / name)
+    with Image.open(tmp_path / name) as img:
+        assert raw_layout(img) is not None
+    job = WatermarkJob("Sample", color_mode=color_mode)
+
+    patched = process_image(str(tmp_path), name, job, output_dir=str(tmp_path / "patched"), memory_budget=1)
+    decoded = process_image(str(tmp_path), name, job, output_dir=str(tmp_path / "decoded"))
+    assert patched.ok and decoded.ok
+    assert patched.info["large"] and "large" not in decoded.info
+    assert patched.info["color"] == decoded.info["color"]
+    with Image.open(patched.output) as a, Image.open(decoded.output) as b, Image.open(tmp_path / name) as source:
+        assert a.mode == b.mode and a.size == b.size
+        assert a.tobytes() == b.tobytes()
+        assert a.tobytes() != source.tobytes()
+
+
+def test_compressed_sources_are_not_patched(tmp_path):
+    gradient("RGB").save(tmp_path / "a.tif", compression="tiff_lzw")
+    with Image.open(tmp_path / "a.tif") as img:
+        assert raw_layout(img) is None
+
+
+def test_nothing_to_draw_leaves_a_copy(tmp_path):
+    gradient("RGB").save(tmp_path / "a.tif")
+    result = process_image(str(tmp_path), "a.tif", WatermarkJob("", color_mode="image"),
+                           output_dir=str(tmp_path / "out"), memory_budget=1)
+    assert result.ok and result.info["large"]
+    assert os.path.getsize(result.output) == os.path.getsize(tmp_path / "a.tif")
+    with open(result.output, "rb") as a, open(tmp_path / "a.tif", "rb") as b:
+        assert a.read() == b.read()
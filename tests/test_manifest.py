@@ -0,0 +1,69 @@
+import os
+
+from watermark_engine.batch import run_batch
+from watermark_engine.job import WatermarkJob
+from watermark_engine.manifest import Manifest
+from watermark_engine.shards import Shard
+
+
+def run(folder, job, **kwargs):
+    with Manifest.for_batch(folder, job, **kwargs) as manifest:
+        return run_batch(folder, job, images=["a.png", "b.png"], manifest=manifest)
+
+
+def skipped(results):
+    return sorted(result.name for result in results if result.skipped)
+
+
+def test_unchanged_sources_are_skipped(tmp_path, make_image):
+    make_image("a.png")
+    make_image("b.png")
+    job = WatermarkJob("test")
+    assert skipped(run(str(tmp_path), job)) == []
+    assert skipped(run(str(tmp_path), job)) == ["a.png", "b.png"]
+    assert skipped(run(str(tmp_path), job, force=True)) == []
+
+
+def test_changed_source_or_settings_are_processed_again(tmp_path, make_image):
+    make_image("a.png")
+    make_image("b.png")
+    job = WatermarkJob("test")
+    run(str(tmp_path), job)
+
+    make_image("b.png", color=(10, 20, 30))
+    stat = os.stat(tmp_path / "b.png")
+    os.utime(tmp_path / "b.png", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert skipped(run(str(tmp_path), job)) == ["a.png"]
+    assert skipped(run(str(tmp_path), WatermarkJob("other"))) == []
+
+
+def test_touched_source_with_same_content_is_skipped_with_hash(tmp_path, make_image):
+    make_image("a.png")
+    make_image("b.png")
+    job = WatermarkJob("test")
+    run(str(tmp_path), job, use_hash=True)
+
+    stat = os.stat(tmp_path / "a.png")
+    os.utime(tmp_path / "a.png", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert skipped(run(str(tmp_path), job, use_hash=True)) == ["a.png", "b.png"]
+
+
+def test_failed_and_removed_outputs_are_processed_again(tmp_path, make_image):
+    make_image("a.png")
+    (tmp_path / "b.png").write_bytes(b"not an image")
+    job = WatermarkJob("test")
+    results = run(str(tmp_path), job)
+    assert [result.ok for result in results] == [True, False]
+
+    make_image("b.png")
+    assert skipped(run(str(tmp_path), job)) == ["a.png"]
+    os.remove(results[0].output)
+    assert skipped(run(str(tmp_path), job)) == ["b.png"]
+
+
+def test_each_shard_keeps_its_own_manifest(tmp_path):
+    job = WatermarkJob("test")
+    with Manifest.for_batch(str(tmp_path), job) as whole, \
+            Manifest.for_batch(str(tmp_path), job, shard=Shard(2, 4)) as part:
+        assert os.path.basename(whole.path) == ".wm_manifest.sqlite"
+        assert os.path.basename(part.path) == ".wm_manifest.shard-2-of-4.sqlite"
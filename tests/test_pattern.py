@@ -0,0 +1,89 @@
+import math
+
+import pytest
+from PIL import Image, ImageChops
+
+from watermark_engine.render import apply_pattern
+from watermark_engine.stamps import make_pattern, make_stamp, pattern_layout
+
+ANGLES = [0, 10, 30, 45, -20, 60, 75, 90]
+
+
+def periodic_offsets(size):
+    width, height = size
+    return [(i * width, j * height) for i in (-1, 0, 1) for j in (-1, 0, 1)]
+
+
+@pytest.mark.parametrize("angle", ANGLES)
+def test_copies_form_a_lattice_across_tile_edges(angle):
+    text_size, gap = (120, 30), 15
+    size, centers = pattern_layout(text_size, angle, gap)
+    # Every difference between two copies moves every copy onto another one, seams included
+    points = [(cx + dx, cy + dy) for cx, cy in centers for dx, dy in periodic_offsets(size)]
+    for ax, ay in centers:
+        for bx, by in centers:
+            for cx, cy in centers:
+                x, y = (cx + bx - ax) % size[0], (cy + by - ay) % size[1]
+                assert min(math.dist((x, y), point) for point in points) < 1.5
+
+
+@pytest.mark.parametrize("angle", ANGLES)
+def test_copies_keep_their_distance(angle):
+    (text_width, text_height), gap = (120, 30), 15
+    size, centers = pattern_layout((text_width, text_height), angle, gap)
+    radians = math.radians(angle)
+    along, across = (math.cos(radians), -math.sin(radians)), (math.sin(radians), math.cos(radians))
+    for ax, ay in centers:
+        for bx, by in centers:
+            for dx, dy in periodic_offsets(size):
+                vx, vy = bx + dx - ax, by + dy - ay
+                if (vx, vy) == (0, 0):
+                    continue
+                u, v = vx * along[0] + vy * along[1], vx * across[0] + vy * across[1]
+                # On the same line a copy is at least a text and a gap away, otherwise a line and a gap
+                if abs(v) < 1.5:
+                    assert abs(u) > text_width + gap - 1.5
+                else:
+                    assert abs(v) > text_height + gap - 1.5
+
+
+def lattice_canvas(text, font_size, color, angle, spacing, periods):
+    """The copies of a pattern drawn straight onto a canvas of periods x periods tiles, without tiling"""
+    stamp = make_stamp(text, None, font_size, color)
+    rotated = stamp.tile.convert("RGBa").rotate(angle, Image.BICUBIC, expand=True).convert("RGBA")
+    (width, height), centers = pattern_layout(stamp.tile.size, angle, max(1, font_size * spacing // 100))
+    canvas = Image.new("RGBA", (periods * width, periods * height), (255, 255, 255, 0))
+    reach_x = math.ceil(rotated.width / width) + 1
+    reach_y = math.ceil(rotated.height / height) + 1
+    for cx, cy in centers:
+        left, top = round(cx - rotated.width / 2), round(cy - rotated.height / 2)
+        for i in range(-reach_x, periods + reach_x):
+            for j in range(-reach_y, periods + reach_y):
+                # Pasted on a layer of its own, paste clips what falls off the canvas
+                layer = Image.new("RGBA", canvas.size, (255, 255, 255, 0))
+                layer.paste(rotated, (left + i * width, top + j * height))
+                canvas.alpha_composite(layer)
+    return canvas, (width, height)
+
+
+def same(a, b):
+    return ImageChops.difference(a, b).getbbox() is None
+
+
+@pytest.mark.parametrize("angle, spacing", [(30, 50), (-20, 80), (60, 30), (0, 50)])
+def test_tiled_pattern_matches_the_lattice(angle, spacing):
+    color = (200, 30, 30, 180)
+    pattern = make_pattern("Sample", None, 24, color, angle, spacing)
+    canvas, (width, height) = lattice_canvas("Sample", 24, color, angle, spacing, periods=4)
+    assert pattern.tile.size == (width, height)
+
+    # The lattice repeats with the tile period, away from the canvas edges where copies are cut off
+    window = (width, height, 2 * width, 2 * height)
+    assert same(canvas.crop(window), canvas.crop((2 * width, height, 3 * width, 2 * height)))
+    assert same(canvas.crop(window), canvas.crop((width, 2 * height, 2 * width, 3 * height)))
+    assert same(canvas.crop(window), pattern.tile)
+
+    # Tiled over an image, no seam shows where the tiles meet
+    img = Image.new("RGBA", (2 * width + 7, 2 * height + 5), (255, 255, 255, 0))
+    apply_pattern(img, pattern)
+    assert same(img, canvas.crop((width, height, width + img.width, height + img.height)))
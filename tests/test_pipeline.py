@@ -0,0 +1,93 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from watermark_engine.batch import run_batch
+from watermark_engine.job import WatermarkJob
+from watermark_engine.pipeline import Done, PipelineOptions, pipelined
+
+
+def sleepy(fn, seed):
+    """fn delayed by a random few milliseconds, so stages finish out of order"""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def run(value):
+        with lock:
+            delay = rng.uniform(0, 0.01)
+        time.sleep(delay)
+        return fn(value)
+    return run
+
+
+def test_results_come_in_entry_order():
+    options = PipelineOptions(read_ahead=4, write_behind=3, io_threads=4)
+    with ThreadPoolExecutor(3) as pool:
+        results = list(pipelined(range(40), sleepy(lambda x: x, 1), sleepy(lambda x: x * 2, 2),
+                                 sleepy(lambda x: x + 1, 3), options, pool, workers=3))
+    assert results == [(i, i * 2 + 1, None) for i in range(40)]
+
+
+def test_done_skips_the_remaining_stages_and_errors_are_reported():
+    written = []
+
+    def compute(value):
+        if value == 3:
+            raise ValueError("bad")
+        return Done("early") if value == 4 else value
+
+    def write(value):
+        written.append(value)
+        return value
+
+    results = list(pipelined([0, Done("skipped"), 3, 4, 5], lambda x: x, compute, write))
+    assert [entry for entry, _, _ in results][1].value == "skipped"
+    assert [(value, str(error) if error else None) for _, value, error in results] == \
+        [(0, None), ("skipped", None), (None, "bad"), ("early", None), (5, None)]
+    assert written == [0, 5]
+
+
+def test_cancel_drops_what_is_not_writing():
+    started = []
+
+    def read(value):
+        started.append(value)
+        return value
+
+    seen = []
+    for entry, _, _ in pipelined(range(1000), read, lambda x: x, lambda x: x, PipelineOptions(read_ahead=4),
+                                 should_continue=lambda: len(seen) < 5):
+        seen.append(entry)
+    assert seen == list(range(len(seen)))
+    # Reading stops with the cancel instead of running through every entry
+    assert len(started) < 100
+
+
+def test_waiting_on_a_full_stage_does_not_spin():
+    def compute(value):
+        time.sleep(0.02)
+        return value
+
+    def write(value):
+        time.sleep(0.05)
+        return value
+
+    options = PipelineOptions(read_ahead=8, write_behind=1)
+    with ThreadPoolExecutor(4) as pool:
+        cpu, wall = time.process_time(), time.perf_counter()
+        results = list(pipelined(range(20), lambda x: x, compute, write, options, pool, workers=4))
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    assert [entry for entry, _, _ in results] == list(range(20))
+    # Finished computes wait behind the single write slot, which must be slept on
+    assert cpu < wall / 4
+
+
+def test_pipelined_batch_on_a_process_pool(tmp_path, make_image):
+    for i in range(6):
+        make_image(f"img{i}.png")
+    results = run_batch(str(tmp_path), WatermarkJob("test"), images=[f"img{i}.png" for i in range(6)], workers=2,
+                        pipeline=PipelineOptions(), output_dir=str(tmp_path / "out"))
+    assert [result.name for result in results] == [f"img{i}.png" for i in range(6)]
+    assert all(result.ok for result in results)
+    assert (tmp_path / "out" / "img5.png").exists()
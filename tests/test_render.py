@@ -0,0 +1,63 @@
+import pytest
+from PIL import Image, ImageFont
+
+from watermark_engine.batch import process_image
+from watermark_engine.cache import LRUCache
+from watermark_engine import fonts
+from watermark_engine.fonts import FontCache, default_font
+from watermark_engine.job import WatermarkJob
+from watermark_engine.render import font_size_for, probe_brightness, render
+from watermark_engine.stamps import StampCache
+
+
+def test_font_size_is_never_zero():
+    assert font_size_for((1, 1), 5) == 1
+    assert font_size_for((40, 40), 2) == 1
+    assert font_size_for((1000, 600), 5) == 40
+
+
+def test_default_font_of_any_size():
+    assert default_font(1) is not None
+    assert default_font(0) is not None
+
+
+@pytest.mark.parametrize("size", [(1, 1), (10, 10), (30, 20)])
+@pytest.mark.parametrize("font_path", [None, "/no/such/font.ttf"])
+@pytest.mark.parametrize("layout", ["corner", "tiled"])
+def test_tiny_images_are_drawn(size, font_path, layout):
+    img = Image.new("RGB", size, (120, 90, 60))
+    info = render(img, WatermarkJob("Sample", font_path=font_path, font_percent=2, layout=layout))
+    assert info["color"] is not None
+    assert (info["font_error"] is not None) == (font_path is not None)
+
+
+@pytest.mark.parametrize("layout", ["corner", "tiled"])
+def test_every_image_counts_as_a_font_cache_hit_or_miss(tmp_path, monkeypatch, layout):
+    font_path = tmp_path / "font.ttf"
+    font_path.write_bytes(b"stand-in, never parsed")
+    stand_in = ImageFont.load_default()
+    monkeypatch.setattr(fonts.ImageFont, "truetype", lambda f, size, index=0, **kwargs: stand_in)
+    monkeypatch.setattr(fonts, "default_font_cache", FontCache())
+    monkeypatch.setattr(fonts, "_default_fonts", LRUCache(16))
+    job = WatermarkJob("Sample", font_path=str(font_path), layout=layout)
+    stamp_cache = StampCache()
+    hits = [render(Image.new("RGB", (200, 100)), job, stamp_cache)["font_cache_hit"] for _ in range(3)]
+    assert hits == [False, True, True]
+    assert render(Image.new("RGB", (200, 100)), WatermarkJob("Sample"), stamp_cache)["font_cache_hit"] is None
+
+
+def test_only_jpegs_are_probed_on_a_reduced_decode(tmp_path):
+    img = Image.linear_gradient("L").resize((1200, 900)).convert("RGB")
+    img.save(tmp_path / "a.jpg")
+    img.save(tmp_path / "a.png")
+    assert probe_brightness(str(tmp_path / "a.jpg")) == pytest.approx(127.5, abs=2)
+    assert probe_brightness(str(tmp_path / "a.png")) is None
+
+
+@pytest.mark.parametrize("name", ["a.jpg", "a.png"])
+def test_whole_image_brightness_without_a_probe(tmp_path, name):
+    Image.linear_gradient("L").resize((1200, 900)).convert("RGB").save(tmp_path / name)
+    result = process_image(str(tmp_path), name, WatermarkJob("Sample", color_mode="image"),
+                           output_dir=str(tmp_path / "out"))
+    assert result.ok
+    assert result.info["brightness"] == pytest.approx(127.5, abs=2)
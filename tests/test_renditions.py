@@ -0,0 +1,67 @@
+import json
+
+import pytest
+from PIL import Image
+
+from watermark_engine.batch import process_image, run_batch
+from watermark_engine.encode import OutputOptions
+from watermark_engine.job import WatermarkJob
+from watermark_engine.renditions import Rendition, check_renditions, load_renditions, rendition_name
+
+
+def test_target_size_never_enlarges():
+    assert Rendition(size=100).target_size((400, 200)) == (100, 50)
+    assert Rendition(size=100).target_size((30, 60)) == (30, 60)
+    assert Rendition().target_size((400, 200)) == (400, 200)
+
+
+def test_from_dict_splits_job_and_output_keys():
+    rendition = Rendition.from_dict({"name": "web", "size": "1600", "format": "webp", "opacity": 120})
+    assert (rendition.name, rendition.size) == ("web", 1600)
+    assert rendition.job == {"opacity": 120}
+    assert rendition.output == {"format": "webp"}
+    assert rendition.job_for(WatermarkJob("test")).opacity == 120
+    assert rendition.output_for(OutputOptions()).format == "WEBP"
+
+
+def test_bad_spec_fails_up_front():
+    with pytest.raises(ValueError):
+        Rendition("web", output={"no_such_option": 1})
+    with pytest.raises(ValueError):
+        Rendition("web", job={"layout": "spiral"})
+
+
+@pytest.mark.parametrize("names", [["web", "thumb", "web"], ["", "thumb", ""]])
+def test_duplicate_names_are_rejected(names):
+    with pytest.raises(ValueError, match="overwrite"):
+        check_renditions([Rendition(name) for name in names])
+
+
+def test_load_renditions_rejects_duplicates(tmp_path):
+    path = tmp_path / "spec.json"
+    path.write_text(json.dumps([{"size": 800}, {"name": "thumb", "size": 200}]))
+    assert [r.name for r in load_renditions(str(path))] == ["", "thumb"]
+    path.write_text(json.dumps([{"size": 800}, {"size": 200}]))
+    with pytest.raises(ValueError):
+        load_renditions(str(path))
+
+
+def test_every_rendition_is_written(tmp_path, make_image):
+    make_image("photo.jpg", size=(400, 300))
+    renditions = [Rendition("", None), Rendition("web", 200, output={"format": "png"}), Rendition("thumb", 50)]
+    result = process_image(str(tmp_path), "photo.jpg", WatermarkJob("test"), output_dir=str(tmp_path / "out"),
+                           renditions=renditions)
+    assert result.ok
+    expected = {"photo.jpg": (400, 300), "photo_web.png": (200, 150), "photo_thumb.jpg": (50, 38)}
+    assert sorted(result.info["outputs"]) == sorted(str(tmp_path / "out" / name) for name in expected)
+    for name, size in expected.items():
+        with Image.open(tmp_path / "out" / name) as img:
+            assert img.size == size
+    assert result.output == str(tmp_path / "out" / "photo.jpg")
+    assert rendition_name("a/b.jpg", renditions[2]) == "a/b_thumb.jpg"
+
+
+def test_batch_rejects_duplicate_names(tmp_path, make_image):
+    make_image("a.png")
+    with pytest.raises(ValueError):
+        run_batch(str(tmp_path), WatermarkJob("test"), images=["a.png"], renditions=[Rendition("x"), Rendition("x")])
@@ -0,0 +1,131 @@
+from collections import deque
+
+import pytest
+
+from watermark_engine.batch import run_batch
+from watermark_engine.encode import OutputOptions
+from watermark_engine.job import WatermarkJob
+from watermark_engine.renditions import Rendition
+from watermark_engine.schedule import MAX_SKIPS, MemoryScheduler, PixelProgress, Task, estimate_cost, format_eta
+
+
+def task(name, cost):
+    return Task(name, None, cost, cost)
+
+
+def test_largest_that_fits_goes_first():
+    scheduler = MemoryScheduler(100, workers=4)
+    waiting = deque([task("a", 30), task("b", 50), task("c", 40), task("d", 20)])
+    assert scheduler.pick(waiting).name == "b"
+    assert scheduler.pick(waiting).name == "c"
+    # 10 left, neither 30 nor 20 fits
+    assert scheduler.pick(waiting) is None
+    assert (scheduler.in_use, scheduler.running) == (90, 2)
+    assert waiting[0].skipped == 2
+
+
+def test_released_memory_is_used_again():
+    scheduler = MemoryScheduler(100, workers=4)
+    waiting = deque([task("a", 60), task("b", 50), task("c", 30)])
+    first = scheduler.pick(waiting)
+    assert first.name == "a"
+    assert scheduler.pick(waiting).name == "c"
+    assert scheduler.pick(waiting) is None
+    scheduler.release(first)
+    assert scheduler.pick(waiting).name == "b"
+    assert not waiting
+
+
+def test_workers_limit_what_runs():
+    scheduler = MemoryScheduler(1000, workers=2)
+    waiting = deque([task("a", 1), task("b", 1), task("c", 1)])
+    assert scheduler.pick(waiting).name == "a"
+    assert scheduler.pick(waiting).name == "b"
+    assert scheduler.pick(waiting) is None
+    assert scheduler.pick(deque()) is None
+
+
+def test_single_worker_keeps_source_order():
+    scheduler = MemoryScheduler(100, workers=1)
+    waiting = deque([task("a", 10), task("b", 90), task("c", 50)])
+    order = []
+    while waiting:
+        picked = scheduler.pick(waiting)
+        order.append(picked.name)
+        scheduler.release(picked)
+    assert order == ["a", "b", "c"]
+
+
+def test_image_over_the_budget_runs_alone():
+    scheduler = MemoryScheduler(100, workers=4)
+    small = task("small", 10)
+    large = task("large", 500)
+    waiting = deque([small, large])
+    assert scheduler.pick(waiting) is small
+    # Waits for the running image, there is never room for it next to another one
+    assert scheduler.pick(waiting) is None
+    scheduler.release(small)
+    assert scheduler.pick(waiting) is large
+    assert scheduler.in_use == 500
+
+    waiting.append(task("later", 1))
+    assert scheduler.pick(waiting) is None
+    scheduler.release(large)
+    assert scheduler.pick(waiting).name == "later"
+
+
+def test_oldest_image_is_not_starved():
+    scheduler = MemoryScheduler(100, workers=4)
+    running = scheduler.pick(deque([task("running", 30)]))
+    large = task("large", 80)
+    waiting = deque([large] + [task(f"small{i}", 10) for i in range(MAX_SKIPS + 5)])
+    # Small images pass the large one while it does not fit, MAX_SKIPS times
+    for i in range(MAX_SKIPS):
+        picked = scheduler.pick(waiting)
+        assert picked.name == f"small{i}"
+        scheduler.release(picked)
+    assert large.skipped == MAX_SKIPS
+    # Then nothing else starts until the large one fits
+    assert scheduler.pick(waiting) is None
+    assert scheduler.pick(waiting) is None
+    scheduler.release(running)
+    assert scheduler.pick(waiting) is large
+
+
+def test_estimate_cost(tmp_path, make_image):
+    path = make_image("a.png", size=(100, 50))
+    output = OutputOptions()
+    pixels, cost = estimate_cost(path, WatermarkJob("test"), output)
+    assert pixels == 5000
+    assert cost >= 5000 * 3
+    _, with_thumb = estimate_cost(path, WatermarkJob("test"), output, renditions=[Rendition(), Rendition("t", 10)])
+    assert with_thumb == cost + 100 * 50 * 3 + 10 * 5 * 3
+    (tmp_path / "broken.png").write_bytes(b"not an image")
+    assert estimate_cost(str(tmp_path / "broken.png"), WatermarkJob("test"), output) == (0, 0)
+
+
+def test_batch_within_a_budget_smaller_than_one_image(tmp_path, make_image):
+    names = [f"img{i}.png" for i in range(6)]
+    for i, name in enumerate(names):
+        make_image(name, size=(64 + 32 * i, 48))
+    progress = PixelProgress()
+    results = run_batch(str(tmp_path), WatermarkJob("test"), images=names, workers=2, memory_budget=1,
+                        output_dir=str(tmp_path / "out"), progress=progress)
+    assert sorted(result.name for result in results) == names
+    assert all(result.ok for result in results)
+    assert progress.fraction(len(names)) == 1.0
+
+
+def test_pixel_progress_and_eta():
+    progress = PixelProgress()
+    progress.expect(300)
+    progress.expect(100)
+    progress.advance(300)
+    # Two images not looked at yet count as the average of the two seen
+    assert progress.total_pixels(4) == 800
+    assert progress.fraction(4) == pytest.approx(300 / 800)
+    assert progress.eta(4) > 0
+    assert PixelProgress().eta() is None
+    assert format_eta(None) == "--:--"
+    assert format_eta(65) == "1:05"
+    assert format_eta(3725) == "1:02:05"
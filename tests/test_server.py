@@ -0,0 +1,142 @@
+import asyncio
+import http.client
+import io
+import json
+import socket
+import struct
+import threading
+import time
+import zlib
+
+import pytest
+from PIL import Image
+
+from watermark_engine.job import WatermarkJob
+from watermark_engine.server import WatermarkServer
+
+
+@pytest.fixture
+def server():
+    """Service with one worker and no queue, running on a thread of its own"""
+    loop = asyncio.new_event_loop()
+    service = WatermarkServer(WatermarkJob("test"), port=0, workers=1, queue_limit=0, max_body=64 * 1024)
+    loop.run_until_complete(service.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield service
+    asyncio.run_coroutine_threadsafe(shutdown(service), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+async def shutdown(service):
+    """Close the service and the connections still open on its loop"""
+    service.close()
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def request(server, method, target, body=None, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=30)
+    try:
+        connection.request(method, target, body, headers or {})
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def png_bytes(size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (120, 90, 60)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def bomb_bytes():
+    """PNG header claiming far more pixels than Pillow opens, without the pixels"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", 20000, 20000, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"")) + chunk(b"IEND", b"")
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_watermarks_the_body(server):
+    status, headers, body = request(server, "POST", "/watermark", png_bytes())
+    assert status == 200
+    assert headers["Content-Type"] == "image/png"
+    assert Image.open(io.BytesIO(body)).size == (64, 48)
+    assert server.served == 1
+
+
+def test_health(server):
+    status, headers, body = request(server, "GET", "/health")
+    assert status == 200
+    health = json.loads(body)
+    assert health["workers"] == 1 and health["in_flight"] == 0 and health["receiving"] == 0
+
+
+@pytest.mark.parametrize("method, target, body, expected", [
+    ("GET", "/nowhere", None, 404),
+    ("GET", "/watermark", None, 405),
+    ("POST", "/watermark", None, 400),
+    ("POST", "/watermark?opacity=high", b"x", 400),
+    ("POST", "/watermark?layout=spiral", b"x", 400),
+    ("POST", "/watermark", b"not an image", 422),
+    ("POST", "/watermark", b"x" * (128 * 1024), 413),
+])
+def test_error_status(server, method, target, body, expected):
+    status, headers, body = request(server, method, target, body)
+    assert status == expected
+    assert "error" in json.loads(body)
+
+
+@pytest.mark.parametrize("length", [b"-5", b"abc", b"+5", b"1_0", b""])
+def test_invalid_content_length(server, length):
+    with socket.create_connection(("127.0.0.1", server.port), timeout=30) as connection:
+        connection.sendall(b"POST /watermark HTTP/1.1\r\nHost: test\r\nContent-Length: " + length + b"\r\n\r\n")
+        response = connection.makefile("rb").read()
+    assert response.startswith(b"HTTP/1.1 400 ")
+    assert b"Content-Length" in response
+
+
+def test_decompression_bomb_is_too_large(server):
+    status, _, _ = request(server, "POST", "/watermark", bomb_bytes())
+    assert status == 413
+    # The worker is still usable
+    assert request(server, "POST", "/watermark", png_bytes())[0] == 200
+
+
+def test_unexpected_error_still_gets_an_answer(server, monkeypatch):
+    def broken(params):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(server, "job_for", broken)
+    status, headers, body = request(server, "POST", "/watermark", png_bytes())
+    assert status == 500
+    assert headers["Connection"] == "close"
+    assert json.loads(body) == {"error": "RuntimeError: boom"}
+
+
+def test_upload_being_read_holds_a_slot(server):
+    upload = socket.create_connection(("127.0.0.1", server.port))
+    try:
+        upload.sendall(b"POST /watermark HTTP/1.1\r\nHost: test\r\nContent-Length: 1000\r\n\r\npartial")
+        wait_for(lambda: server.receiving == 1)
+        status, headers, _ = request(server, "POST", "/watermark", png_bytes())
+        assert status == 503
+        assert headers["Retry-After"] == "1"
+        assert server.rejected == 1
+    finally:
+        upload.close()
+    wait_for(lambda: server.receiving == 0)
+    assert request(server, "POST", "/watermark", png_bytes())[0] == 200
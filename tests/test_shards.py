@@ -0,0 +1,97 @@
+import os
+import unicodedata
+
+import pytest
+
+from watermark_engine.batch import run_batch
+from watermark_engine.job import WatermarkJob
+from watermark_engine.manifest import settings_fingerprint
+from watermark_engine.metrics import JobReport
+from watermark_engine.shards import Shard, load_shard_reports, merge_shards, shard_of
+
+NAMES = [f"img{i:02d}.png" for i in range(12)]
+
+
+def test_shards_split_names_completely_and_disjointly():
+    names = [f"dir{i % 7}/photo{i}.jpg" for i in range(500)]
+    parts = [[name for name in names if Shard(i, 4).owns(name)] for i in range(1, 5)]
+    assert sorted(sum(parts, [])) == sorted(names)
+    assert all(parts)
+
+
+def test_shard_of_ignores_separator_and_normalization():
+    decomposed = unicodedata.normalize("NFD", "café/a.jpg")
+    assert shard_of(decomposed, 16) == shard_of("café/a.jpg", 16)
+    assert shard_of(os.path.join("a", "b.jpg"), 16) == shard_of("a/b.jpg", 16)
+
+
+@pytest.mark.parametrize("text", ["2", "0/4", "5/4", "a/b", "1/2/3", "1/0"])
+def test_parse_rejects_invalid_shards(text):
+    with pytest.raises(ValueError):
+        Shard.parse(text)
+
+
+def test_shard_names():
+    shard = Shard.parse("2/4")
+    assert (shard.index, shard.count, str(shard)) == (2, 4, "2/4")
+    assert shard.archive_path(os.path.join("out", "delivery.zip")) == os.path.join("out", "delivery.shard-2-of-4.zip")
+    assert shard.archive_path("delivery.tar.gz") == "delivery.shard-2-of-4.tar.gz"
+    assert shard.report_path("reports") == os.path.join("reports", "shard-2-of-4.json")
+
+
+def run_shard(folder, shard, reports, job=None):
+    job = job or WatermarkJob("test")
+    report = JobReport()
+    images = [name for name in NAMES if shard.owns(name)]
+    run_batch(folder, job, images=images, report=report, output_dir=os.path.join(folder, "out"))
+    shard.write_report(report, reports, folder, settings_fingerprint(job))
+
+
+@pytest.fixture
+def batch(tmp_path, make_image):
+    for name in NAMES:
+        make_image(name)
+    return str(tmp_path), str(tmp_path / "reports")
+
+
+def test_merge_of_every_shard_is_complete(batch):
+    folder, reports = batch
+    for i in (1, 2, 3):
+        run_shard(folder, Shard(i, 3), reports)
+    result = merge_shards(reports, NAMES)
+    assert result.complete
+    assert (result.count, result.total) == (3, len(NAMES))
+    assert sorted(row["name"] for row in result.report.rows) == NAMES
+    assert result.report.summary()["processed"] == len(NAMES)
+    assert result.retry_shards() == []
+
+
+def test_merge_reports_what_is_left(batch):
+    folder, reports = batch
+    broken = next(name for name in NAMES if shard_of(name, 3) == 1)
+    with open(os.path.join(folder, broken), "wb") as f:
+        f.write(b"not an image")
+    run_shard(folder, Shard(1, 3), reports)
+    run_shard(folder, Shard(2, 3), reports, WatermarkJob("other"))
+
+    result = merge_shards(reports, NAMES + ["new.png"])
+    assert not result.complete
+    assert result.missing_shards == [3]
+    expected = [name for name in NAMES if shard_of(name, 3) == 3] + ["new.png"]
+    assert sorted(result.missing) == sorted((name, shard_of(name, 3)) for name in expected)
+    assert [(name, shard) for name, shard, _ in result.failed] == [(broken, 1)]
+    assert result.settings_differ
+    assert result.retry_shards() == sorted({1, 3, shard_of("new.png", 3)})
+
+
+def test_reports_of_different_splits_are_refused(batch):
+    folder, reports = batch
+    run_shard(folder, Shard(1, 2), reports)
+    run_shard(folder, Shard(1, 3), reports)
+    with pytest.raises(ValueError, match="2, 3"):
+        load_shard_reports(reports)
+
+
+def test_no_reports(tmp_path):
+    with pytest.raises(ValueError, match="no shard reports"):
+        load_shard_reports(str(tmp_path))
@@ -0,0 +1,55 @@
+import os
+import threading
+
+from watermark_engine.sources import FolderSource, iter_images
+
+
+def test_iter_images_filters_and_recurses(tmp_path, make_image):
+    make_image("a.jpg")
+    make_image("wm_a.jpg")
+    make_image("sub/b.png")
+    make_image("sub/deeper/c.png")
+    (tmp_path / "notes.txt").write_text("not an image")
+
+    assert sorted(iter_images(str(tmp_path), skip_prefixes=("wm_",))) == ["a.jpg"]
+    found = sorted(iter_images(str(tmp_path), recursive=True, skip_prefixes=("wm_",)))
+    assert found == ["a.jpg", os.path.join("sub", "b.png"), os.path.join("sub", "deeper", "c.png")]
+    assert sorted(iter_images(str(tmp_path), recursive=True, exclude=["*.png"])) == ["a.jpg", "wm_a.jpg"]
+
+
+def test_iter_images_sniffs_files_without_extension(tmp_path, make_image):
+    make_image("photo", fmt="JPEG")
+    assert list(iter_images(str(tmp_path))) == []
+    assert list(iter_images(str(tmp_path), sniff=True)) == ["photo"]
+
+
+def test_iter_images_skips_the_output_folder(tmp_path, make_image):
+    make_image("a.jpg")
+    make_image("out/a.jpg")
+    found = list(iter_images(str(tmp_path), recursive=True, skip_dirs=[str(tmp_path / "out")]))
+    assert found == ["a.jpg"]
+
+
+def test_folder_source_queue_is_bounded(tmp_path, make_image):
+    for i in range(20):
+        make_image(f"img{i:02d}.png", size=(4, 4))
+    source = FolderSource(str(tmp_path), queue_size=2)
+    names = iter(source)
+    first = next(names)
+    # The walker stops once the queue is full instead of listing everything
+    threading.Event().wait(0.2)
+    assert not source.finished
+    assert source.discovered <= 4
+    rest = list(names)
+    assert sorted([first] + rest) == [f"img{i:02d}.png" for i in range(20)]
+    assert source.finished and source.discovered == 20
+
+
+def test_folder_source_stops_the_walker_when_the_consumer_leaves(tmp_path, make_image):
+    for i in range(10):
+        make_image(f"img{i}.png", size=(4, 4))
+    source = FolderSource(str(tmp_path), queue_size=1)
+    for _ in source:
+        break
+    threading.Event().wait(0.3)
+    assert source.finished
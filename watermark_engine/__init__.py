@@ -0,0 +1,78 @@
+"""Headless watermarking engine used by the WaterMark Pro GUI and CLI.
+
+Nothing in this package imports tkinter so it can run on machines without
+a display.
+"""
+
+from importlib import import_module
+
+from .job import WatermarkJob
+from .render import render
+from .brightness import calculate_image_brightness, estimate_brightness
+from .fonts import FontCache, default_font_cache
+from .stamps import Stamp, StampCache, default_stamp_cache
+from .logos import LogoPyramid
+from .encode import OutputOptions, encode
+from .sources import ArchiveSource, FolderSource, iter_images, sniff_format
+from .manifest import Manifest
+from .catalog import FontCatalog, FontIndex
+from .events import EventChannel, StreamReporter
+from .metrics import JobReport, StageTimer
+from .pipeline import PipelineOptions
+from .renditions import Rendition, load_renditions
+from .sinks import ArchiveSink, FileSink
+from .schedule import MemoryScheduler, PixelProgress
+from .shards import Shard, merge_shards
+from .batch import OUTPUT_PREFIX, ImageResult, find_images, process_image, run_batch, watermark_bytes
+
+__all__ = [
+    "WatermarkJob",
+    "render",
+    "calculate_image_brightness",
+    "estimate_brightness",
+    "FontCache",
+    "default_font_cache",
+    "Stamp",
+    "StampCache",
+    "default_stamp_cache",
+    "LogoPyramid",
+    "OutputOptions",
+    "encode",
+    "ArchiveSource",
+    "FolderSource",
+    "iter_images",
+    "sniff_format",
+    "Manifest",
+    "FontCatalog",
+    "FontIndex",
+    "EventChannel",
+    "StreamReporter",
+    "JobReport",
+    "StageTimer",
+    "PipelineOptions",
+    "Rendition",
+    "load_renditions",
+    "ArchiveSink",
+    "FileSink",
+    "MemoryScheduler",
+    "PixelProgress",
+    "Shard",
+    "merge_shards",
+    "OUTPUT_PREFIX",
+    "ImageResult",
+    "find_images",
+    "process_image",
+    "run_batch",
+    "watermark_bytes",
+    "WatermarkServer",
+    "watch",
+]
+
+# The service pulls in asyncio and the hot folder watcher inotify, a batch or the GUI needs neither
+_LAZY = {"WatermarkServer": ".server", "watch": ".watch"}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        return getattr(import_module(_LAZY[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,575 @@
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from functools import partial
+from io import BytesIO
+
+from .brightness import estimate_brightness
+from .decode import load_for_render, open_image
+from .encode import OutputOptions, encode
+from .large import large_layout, patch_large
+from .metrics import NULL_TIMER, StageTimer, TimedFile
+from .pipeline import Done, pipelined
+from .renditions import check_renditions, largest_size, render_renditions, rendition_name
+from .render import probe_brightness, render
+from .schedule import MemoryScheduler, PixelProgress, Task, estimate_cost
+from .sinks import OUTPUT_PREFIX, FileSink, output_path_for
+from .sources import FolderSource, iter_images
+
+
+class ImageResult:
+    """Outcome of watermarking a single image"""
+
+    def __init__(self, name, output=None, info=None, error=None, skipped=False, metrics=None):
+        self.name = name
+        self.output = output
+        self.info = info or {}
+        self.error = error
+        # Output was already up to date according to the manifest
+        self.skipped = skipped
+        # Stage times, bytes and pixels, see metrics.JobReport
+        self.metrics = metrics
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def find_images(folder, recursive=False):
+    """List the image files of a folder that can be watermarked"""
+    return sorted(iter_images(folder, recursive, skip_prefixes=(OUTPUT_PREFIX,)))
+
+
+def _large_layout(img_path, job, output, memory_budget):
+    """(RawLayout, format) when img_path is too large to decode within memory_budget, else None"""
+    if not memory_budget:
+        return None
+    with open_image(img_path) as source:
+        fmt = output.format_for(source.format)
+        layout = large_layout(source, job, fmt, output, memory_budget)
+    return (layout, fmt) if layout is not None else None
+
+
+def _process_large(folder, name, job, output_dir, layout, fmt, timer, metrics):
+    img_path = os.path.join(folder, name)
+    output_path = output_path_for(folder, name, fmt, output_dir)
+    info = patch_large(img_path, output_path, job, layout, timer=timer)
+    metrics["pixels"] = layout.size[0] * layout.size[1]
+    metrics["bytes_in"] = metrics["bytes_out"] = os.path.getsize(output_path)
+    info["large"] = True
+    return ImageResult(name, output_path, info, metrics=metrics)
+
+
+def _encode_file(img, output_path, fmt, output, source_info, timer):
+    """Encode img to output_path, returns the number of bytes written"""
+    with timer.stage("write"):
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with timer.stage("encode"):
+        try:
+            with open(output_path, "wb") as out:
+                timed_out = TimedFile(out, timer)
+                encode(img, timed_out, fmt, output, source_info)
+        except Exception:
+            # Like Image.save, do not leave a truncated file behind
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+    return timed_out.bytes_written
+
+
+def _needs_probe(job, renditions=None):
+    """Whether any output measures the whole frame brightness"""
+    jobs = [r.job_for(job) for r in renditions] if renditions else [job]
+    return any(j.auto_color and j.color_mode == "image" and not j.logo_path for j in jobs)
+
+
+def _renditions_of(source, job, output, renditions, brightness, timer):
+    """Decode a lazily opened source once, yield (rendition, image, format, options, info) per rendition"""
+    full_size = source.size
+    # JPEGs decode straight at 1/2 to 1/8 scale when every rendition is that much smaller
+    source.draft(None, largest_size(renditions, full_size))
+    with timer.stage("decode"):
+        img = load_for_render(source)
+    if brightness is None and _needs_probe(job, renditions):
+        # Not probed on a reduced decode, measured once here so every rendition gets the same color
+        with timer.stage("brightness"):
+            brightness = estimate_brightness(img, max_side=256)
+    for rendition, out, info in render_renditions(img, full_size, job, renditions, brightness, timer):
+        options = rendition.output_for(output)
+        yield rendition, out, options.format_for(source.format), options, info
+
+
+def _process_renditions(folder, name, job, output, output_dir, renditions, timer, metrics):
+    img_path = os.path.join(folder, name)
+    brightness = None
+    if _needs_probe(job, renditions):
+        with timer.stage("brightness"), open(img_path, "rb") as f:
+            brightness = probe_brightness(TimedFile(f, timer))
+    outputs = []
+    infos = []
+    with open(img_path, "rb") as f, open_image(TimedFile(f, timer)) as source:
+        source_info = dict(source.info)
+        metrics["pixels"] = source.width * source.height
+        metrics["bytes_in"] = os.fstat(f.fileno()).st_size
+        for rendition, img, fmt, options, info in _renditions_of(source, job, output, renditions, brightness,
+                                                                 timer):
+            output_path = output_path_for(folder, rendition_name(name, rendition), fmt, output_dir)
+            metrics["bytes_out"] += _encode_file(img, output_path, fmt, options, source_info, timer)
+            outputs.append(output_path)
+            infos.append(info)
+    # The largest rendition stands for the source, every file is listed in outputs
+    info = dict(infos[0], outputs=outputs)
+    return ImageResult(name, outputs[0], info, metrics=metrics)
+
+
+def process_image(folder, name, job, output=None, output_dir=None, memory_budget=None, renditions=None):
+    """Watermark one image of a folder, errors are captured in the result.
+
+    The result carries the time of every stage in its metrics, file reads
+    and writes are timed apart from decoding and encoding. Images whose
+    decode would take more than memory_budget bytes are patched in place
+    of a full decode when their format allows it, see large.patch_large.
+    With renditions (a list of renditions.Rendition) the source is decoded
+    once and every rendition written, result.info["outputs"] lists them.
+    """
+    output = output or OutputOptions()
+    img_path = os.path.join(folder, name)
+    timer = StageTimer()
+    metrics = {"times": timer.times, "bytes_in": 0, "bytes_out": 0, "pixels": 0}
+    try:
+        if renditions:
+            return _process_renditions(folder, name, job, output, output_dir, renditions, timer, metrics)
+        large = _large_layout(img_path, job, output, memory_budget)
+        if large is not None:
+            return _process_large(folder, name, job, output_dir, *large, timer, metrics)
+        brightness = None
+        if _needs_probe(job):
+            # Whole frame brightness of a JPEG only needs a reduced decode, other formats measure the render decode
+            with timer.stage("brightness"), open(img_path, "rb") as f:
+                brightness = probe_brightness(TimedFile(f, timer))
+        with open(img_path, "rb") as f, open_image(TimedFile(f, timer)) as source:
+            source_info = dict(source.info)
+            fmt = output.format_for(source.format)
+            with timer.stage("decode"):
+                img = load_for_render(source)
+            metrics["pixels"] = img.width * img.height
+            metrics["bytes_in"] = os.fstat(f.fileno()).st_size
+            info = render(img, job, brightness=brightness, timer=timer)
+            output_path = output_path_for(folder, name, fmt, output_dir)
+            metrics["bytes_out"] = _encode_file(img, output_path, fmt, output, source_info, timer)
+        return ImageResult(name, output_path, info, metrics=metrics)
+    except Exception as e:
+        # Keep the message only, results may cross process boundaries
+        return ImageResult(name, error=str(e), metrics=metrics)
+
+
+def watermark_bytes(data, job, output=None, timer=None):
+    """Watermark an encoded image held in memory, returns (encoded bytes, format, info).
+
+    info is the dict of render() plus the pixel size of the image.
+    """
+    output = output or OutputOptions()
+    timer = timer or NULL_TIMER
+    brightness = None
+    if _needs_probe(job):
+        with timer.stage("brightness"):
+            brightness = probe_brightness(BytesIO(data))
+    with open_image(BytesIO(data)) as source:
+        source_info = dict(source.info)
+        fmt = output.format_for(source.format)
+        with timer.stage("decode"):
+            img = load_for_render(source)
+        info = render(img, job, brightness=brightness, timer=timer)
+        info["size"] = img.size
+    buf = BytesIO()
+    with timer.stage("encode"):
+        encode(img, buf, fmt, output, source_info)
+    return buf.getvalue(), fmt, info
+
+
+def watermark_renditions_bytes(data, job, renditions, output=None, timer=None):
+    """Every rendition of an encoded image held in memory, from one decode.
+
+    Returns a list of (rendition, encoded bytes, format, info), largest
+    first, info holding the pixel size of the source like watermark_bytes.
+    """
+    output = output or OutputOptions()
+    timer = timer or NULL_TIMER
+    brightness = None
+    if _needs_probe(job, renditions):
+        with timer.stage("brightness"):
+            brightness = probe_brightness(BytesIO(data))
+    results = []
+    with open_image(BytesIO(data)) as source:
+        source_info = dict(source.info)
+        size = source.size
+        for rendition, img, fmt, options, info in _renditions_of(source, job, output, renditions, brightness,
+                                                                 timer):
+            buf = BytesIO()
+            with timer.stage("encode"):
+                encode(img, buf, fmt, options, source_info)
+            info["size"] = size
+            results.append((rendition, buf.getvalue(), fmt, info))
+    return results
+
+
+def resolve_workers(workers):
+    """Number of worker processes to use, 0 or None means one per CPU core"""
+    if not workers or workers < 1:
+        return os.cpu_count() or 1
+    return workers
+
+
+def _total(images):
+    """Number of images known so far, a streaming source may still be growing"""
+    if hasattr(images, "__len__"):
+        return len(images)
+    return getattr(images, "discovered", None)
+
+
+def _check(manifest, name):
+    """Return (result, state), result is set when name needs no processing"""
+    if manifest is None:
+        return None, None
+    try:
+        existing, state = manifest.check(name)
+    except OSError as e:
+        return ImageResult(name, error=str(e)), None
+    if existing:
+        return ImageResult(name, existing, skipped=True), state
+    return None, state
+
+
+def _record(manifest, state, result):
+    if manifest is not None and state is not None and not result.skipped:
+        manifest.record(result.name, state, result.output, result.error)
+
+
+def _run_serial(folder, job, images, output, output_dir, manifest, on_result, should_continue, renditions):
+    results = []
+    for i, name in enumerate(images):
+        if should_continue is not None and not should_continue():
+            break
+        result, state = _check(manifest, name)
+        if result is None:
+            result = process_image(folder, name, job, output, output_dir, renditions=renditions)
+            _record(manifest, state, result)
+        results.append(result)
+        if on_result is not None:
+            on_result(i, _total(images), result)
+    return results
+
+
+def _run_parallel(folder, job, images, output, output_dir, manifest, workers, on_result, should_continue,
+                  renditions):
+    results = []
+    pending = deque()
+    names = iter(images)
+    cancelled = False
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # Keep a small window of work in flight so cancel stays responsive
+            while not cancelled and len(pending) < workers * 2:
+                if should_continue is not None and not should_continue():
+                    cancelled = True
+                    break
+                name = next(names, None)
+                if name is None:
+                    break
+                result, state = _check(manifest, name)
+                if result is None:
+                    future = pool.submit(process_image, folder, name, job, output, output_dir,
+                                         renditions=renditions)
+                else:
+                    # Already done, queued as finished to keep the reporting order
+                    future = Future()
+                    future.set_result(result)
+                pending.append((future, state))
+            if cancelled:
+                for future, _ in pending:
+                    future.cancel()
+                break
+            if not pending:
+                break
+            # Results are reported in submission order
+            future, state = pending.popleft()
+            result = future.result()
+            _record(manifest, state, result)
+            results.append(result)
+            if on_result is not None:
+                on_result(len(results) - 1, _total(images), result)
+    return results
+
+
+def _run_scheduled(folder, job, images, output, output_dir, manifest, workers, on_result, should_continue,
+                   memory_budget, progress, renditions, lookahead=256):
+    output = output or OutputOptions()
+    scheduler = MemoryScheduler(memory_budget, workers)
+    results = []
+    waiting = deque()
+    running = {}
+    names = iter(images)
+    exhausted = cancelled = False
+
+    def report(result, state, pixels):
+        _record(manifest, state, result)
+        progress.advance(pixels)
+        results.append(result)
+        if on_result is not None:
+            on_result(len(results) - 1, _total(images), result)
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while True:
+            if not cancelled and should_continue is not None and not should_continue():
+                cancelled = True
+                waiting.clear()
+                for future in running:
+                    future.cancel()
+            # Headers are read ahead so the scheduler has sizes to choose from
+            while not exhausted and not cancelled and len(waiting) < lookahead:
+                name = next(names, None)
+                if name is None:
+                    exhausted = True
+                    break
+                result, state = _check(manifest, name)
+                if result is not None:
+                    progress.expect(0)
+                    report(result, state, 0)
+                    continue
+                pixels, cost = estimate_cost(os.path.join(folder, name), job, output, memory_budget, renditions)
+                progress.expect(pixels)
+                waiting.append(Task(name, state, pixels, cost))
+            while not cancelled:
+                task = scheduler.pick(waiting)
+                if task is None:
+                    break
+                args = (folder, task.name, job, output, output_dir, memory_budget, renditions)
+                if pool is None:
+                    future = Future()
+                    future.set_result(process_image(*args))
+                else:
+                    future = pool.submit(process_image, *args)
+                running[future] = task
+            if not running:
+                if exhausted or cancelled:
+                    break
+                continue
+            # Results are reported as they complete, not in source order
+            for future in wait(running, return_when=FIRST_COMPLETED).done:
+                task = running.pop(future)
+                scheduler.release(task)
+                if not future.cancelled():
+                    report(future.result(), task.state, task.pixels)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return results
+
+
+def _read_entry(folder, large, entry):
+    name, state = entry
+    if large is not None:
+        # Too large to hold in memory, patched in place by this I/O thread instead
+        job, output, output_dir, memory_budget = large
+        if _large_layout(os.path.join(folder, name), job, output, memory_budget) is not None:
+            return Done(process_image(folder, name, job, output, output_dir, memory_budget))
+    timer = StageTimer()
+    with timer.stage("read"), open(os.path.join(folder, name), "rb") as f:
+        data = f.read()
+    return name, state, data, timer.times
+
+
+def _read_member(source, entry):
+    """Read an entry from a source holding the image bytes itself, such as an ArchiveSource"""
+    name, state = entry
+    timer = StageTimer()
+    with timer.stage("read"):
+        data = source.read(name)
+    return name, state, data, timer.times
+
+
+def _compute_entry(job, output, renditions, value):
+    """Encoded outputs of an entry as [(output name, format, bytes)] with the info and metrics"""
+    name, state, data, times = value
+    timer = StageTimer(times)
+    if renditions:
+        encoded = watermark_renditions_bytes(data, job, renditions, output, timer)
+        outputs = [(rendition_name(name, rendition), fmt, buf) for rendition, buf, fmt, _ in encoded]
+        info = encoded[0][3]
+    else:
+        buf, fmt, info = watermark_bytes(data, job, output, timer)
+        outputs = [(name, fmt, buf)]
+    width, height = info.pop("size")
+    metrics = {"times": timer.times, "bytes_in": len(data), "bytes_out": sum(len(buf) for _, _, buf in outputs),
+               "pixels": width * height}
+    return name, outputs, info, metrics
+
+
+def _write_entry(sink, value):
+    name, outputs, info, metrics = value
+    timer = StageTimer(metrics["times"])
+    with timer.stage("write"):
+        paths = [sink.write(output_name, fmt, buf) for output_name, fmt, buf in outputs]
+    if len(paths) > 1:
+        info["outputs"] = paths
+    return ImageResult(name, paths[0], info, metrics=metrics)
+
+
+def _run_pipelined(folder, job, images, output, output_dir, manifest, workers, on_result, should_continue,
+                   options, sink, memory_budget, renditions):
+    output = output or OutputOptions()
+    streamed = _reads_itself(images)
+    if streamed:
+        read = partial(_read_member, images)
+    else:
+        # Large images are patched straight into their output file, only a FileSink can take them
+        large = None
+        if memory_budget and sink is None and not renditions:
+            large = (job, output, output_dir, memory_budget)
+        read = partial(_read_entry, folder, large)
+    sink = sink or FileSink(folder, output_dir)
+
+    def entries():
+        for name in images:
+            result, state = _check(manifest, name)
+            yield Done(result) if result is not None else (name, state)
+
+    results = []
+    pool = _started_pool(workers)
+    try:
+        for entry, value, error in pipelined(entries(), read, partial(_compute_entry, job, output, renditions),
+                                             partial(_write_entry, sink), options, pool, workers, should_continue):
+            if isinstance(entry, Done):
+                result, state = value, None
+            elif error is not None:
+                result, state = ImageResult(entry[0], error=str(error)), entry[1]
+            else:
+                result, state = value, entry[1]
+            _record(manifest, state, result)
+            results.append(result)
+            if on_result is not None:
+                on_result(len(results) - 1, _total(images), result)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if streamed and hasattr(images, "discard"):
+            # Members dropped by a cancel or a failed stage were never read
+            images.discard()
+    return results
+
+
+def _started_pool(workers):
+    """Process pool with its workers already forked, None for a single worker.
+
+    Workers are otherwise forked on the first submit, when the read
+    threads of the pipeline may be holding a lock (the import lock, for
+    one) that then stays locked forever in the child.
+    """
+    if workers <= 1:
+        return None
+    pool = ProcessPoolExecutor(max_workers=workers)
+    wait([pool.submit(os.getpid) for _ in range(workers)])
+    return pool
+
+
+def _reads_itself(images):
+    """Whether a source hands out the image bytes rather than paths under the folder"""
+    return hasattr(images, "read")
+
+
+def _progressing(progress, on_result):
+    """Count results in progress when their size was not known ahead"""
+    def callback(i, total, result):
+        pixels = (result.metrics or {}).get("pixels", 0)
+        progress.expect(pixels)
+        progress.advance(pixels)
+        if on_result is not None:
+            on_result(i, total, result)
+    return callback
+
+
+def _reporting(report, on_result):
+    def callback(i, total, result):
+        report.add(result)
+        if on_result is not None:
+            on_result(i, total, result)
+    return callback
+
+
+def run_batch(folder, job, images=None, on_result=None, should_continue=None, workers=1, output=None,
+              output_dir=None, manifest=None, report=None, pipeline=None, sink=None, memory_budget=None,
+              progress=None, renditions=None):
+    """Watermark every image of a folder.
+
+    images is a list of paths relative to folder or a streaming source such
+    as FolderSource, by default the top level of folder is streamed, without
+    the wm_ files, even with an output_dir they are results of earlier runs.
+    on_result(index, total, result) is called after each image, in source
+    order, with the number of images known so far, and should_continue()
+    before each one is started, returning False cancels the batch. With more
+    than one worker the images are spread across a process pool (workers=0
+    uses every CPU core). output is the OutputOptions used to encode the
+    results and output_dir, when given, receives a mirror of the input tree.
+    With a Manifest, sources whose output is up to date are reported as
+    skipped instead of being processed again, and every processed source is
+    recorded so an interrupted batch can resume. Every result is added to
+    report, a metrics.JobReport, when one is given.
+
+    With pipeline (PipelineOptions) or a sink, sources are read ahead and
+    results written behind on I/O threads while the CPU stage runs, and
+    every output is written to a temporary file then renamed. sink
+    defaults to a FileSink laid out like the other modes.
+
+    With a memory_budget in bytes, images are admitted to the workers by a
+    schedule.MemoryScheduler so the images being processed at once fit in
+    it, by their estimated cost read from the headers, and results are
+    reported as they complete. Uncompressed TIFF and BMP sources too large
+    for the budget on their own only have the rows under the watermark
+    decoded and patched, other formats are decoded in full and run alone.
+    progress, a schedule.PixelProgress, is kept up to date as images are
+    looked at and finished, for a pixel-weighted progress and ETA.
+
+    With renditions, a list of renditions.Rendition, every source is
+    decoded once and written once per rendition, see process_image.
+
+    images may also be a source that reads the image bytes itself, such as
+    a sources.ArchiveSource, with folder naming the archive. It always runs
+    pipelined and needs a sink, such as a sinks.ArchiveSink, or an
+    output_dir. It cannot take a manifest, which checks sources on disk.
+    """
+    if images is None:
+        images = FolderSource(folder, skip_dirs=[output_dir] if output_dir else (),
+                              skip_prefixes=(OUTPUT_PREFIX,))
+    workers = resolve_workers(workers)
+    if hasattr(images, "__len__"):
+        workers = min(workers, max(len(images), 1))
+    if report is not None:
+        on_result = _reporting(report, on_result)
+    streamed = _reads_itself(images)
+    if streamed and sink is None and output_dir is None:
+        raise ValueError("images read from an archive need a sink or an output_dir")
+    if streamed and manifest is not None:
+        raise ValueError("a manifest only works with sources on disk, archives are always processed in full")
+    if renditions:
+        check_renditions(renditions)
+    scheduled = memory_budget and pipeline is None and sink is None and not streamed
+    if progress is not None and not scheduled:
+        on_result = _progressing(progress, on_result)
+    try:
+        if pipeline is not None or sink is not None or streamed:
+            return _run_pipelined(folder, job, images, output, output_dir, manifest, workers, on_result,
+                                  should_continue, pipeline, sink, memory_budget, renditions)
+        if scheduled:
+            return _run_scheduled(folder, job, images, output, output_dir, manifest, workers, on_result,
+                                  should_continue, memory_budget, progress or PixelProgress(), renditions)
+        if workers == 1:
+            return _run_serial(folder, job, images, output, output_dir, manifest, on_result, should_continue,
+                               renditions)
+        return _run_parallel(folder, job, images, output, output_dir, manifest, workers, on_result,
+                             should_continue, renditions)
+    finally:
+        if report is not None:
+            report.finish()
+        if manifest is not None:
+            manifest.flush()
@@ -0,0 +1,44 @@
+from PIL import ImageStat
+
+# Mean luma above which a background counts as light
+LIGHT_THRESHOLD = 128
+
+
+def calculate_image_brightness(img):
+    """Calculate average image brightness (0-255)"""
+    # Convert to grayscale
+    gray_img = img.convert('L')
+    # Calculate statistics
+    stat = ImageStat.Stat(gray_img)
+    return stat.mean[0]
+
+
+def clip_box(box, size):
+    left, top, right, bottom = box
+    width, height = size
+    box = (max(left, 0), max(top, 0), min(right, width), min(bottom, height))
+    if box[2] <= box[0] or box[3] <= box[1]:
+        return None
+    return box
+
+
+def estimate_brightness(img, box=None, max_side=64):
+    """Mean brightness (0-255) of a box of the image, or of all of it.
+
+    The region is box-reduced to at most about max_side pixels per side
+    before measuring, so the cost stays at a few thousand pixels whatever
+    the image resolution. Returns None when the box falls outside the image.
+    """
+    if box is not None:
+        box = clip_box(box, img.size)
+        if box is None:
+            return None
+        region = img.crop(box)
+    else:
+        region = img
+    if region.mode not in ("L", "RGB", "RGBA"):
+        region = region.convert("L")
+    factor = max(region.size) // max_side
+    if factor > 1:
+        region = region.reduce(factor)
+    return calculate_image_brightness(region)
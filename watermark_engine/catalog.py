@@ -0,0 +1,333 @@
+import bisect
+import json
+import os
+import struct
+import sys
+import threading
+
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc", ".otc")
+
+CATALOG_VERSION = 1
+
+# OS/2 ulUnicodeRange bits that identify the scripts the UI languages need
+SCRIPT_BITS = {
+    "latin": (0,),
+    "greek": (7,),
+    "cyrillic": (9,),
+    "hebrew": (11,),
+    "arabic": (13,),
+    "thai": (24,),
+    "kana": (49, 50),
+    "hangul": (56,),
+    "han": (59,),
+}
+
+# Subfamily names used when a face has no name table entry
+WEIGHT_STYLES = {100: "Thin", 200: "ExtraLight", 300: "Light", 400: "Regular", 500: "Medium",
+                 600: "SemiBold", 700: "Bold", 800: "ExtraBold", 900: "Black"}
+
+
+def system_font_dirs():
+    """Font directories of the current platform, whether they exist or not"""
+    home = os.path.expanduser("~")
+    if sys.platform.startswith("win"):
+        windir = os.environ.get("WINDIR", r"C:\Windows")
+        dirs = [os.path.join(windir, "Fonts")]
+        local = os.environ.get("LOCALAPPDATA")
+        if local:
+            dirs.append(os.path.join(local, "Microsoft", "Windows", "Fonts"))
+        return dirs
+    if sys.platform == "darwin":
+        return ["/System/Library/Fonts", "/Library/Fonts", os.path.join(home, "Library", "Fonts")]
+    return ["/usr/share/fonts", "/usr/local/share/fonts", os.path.join(home, ".fonts"),
+            os.path.join(home, ".local", "share", "fonts")]
+
+
+def default_catalog_path():
+    """Per-user cache location of the catalog for headless use"""
+    if sys.platform.startswith("win"):
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "watermark_pro", "font_catalog.json")
+
+
+def _read(f, offset, size):
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("truncated font file")
+    return data
+
+
+def _tables(f, offset):
+    num_tables = struct.unpack(">H", _read(f, offset + 4, 2))[0]
+    records = _read(f, offset + 12, num_tables * 16)
+    tables = {}
+    for i in range(num_tables):
+        tag, _, table_offset, length = struct.unpack(">4sIII", records[i * 16:(i + 1) * 16])
+        tables[tag] = (table_offset, length)
+    return tables
+
+
+def _names(f, table):
+    """Family and subfamily from the name table, preferring typographic names"""
+    offset, length = table
+    data = _read(f, offset, length)
+    _, count, string_offset = struct.unpack(">HHH", data[:6])
+    found = {}
+    for i in range(count):
+        platform, encoding, language, name_id, size, name_offset = struct.unpack(
+            ">6H", data[6 + i * 12:18 + i * 12])
+        if name_id not in (1, 2, 16, 17):
+            continue
+        raw = data[string_offset + name_offset:string_offset + name_offset + size]
+        if platform in (0, 3):
+            value = raw.decode("utf-16-be", "replace")
+            # English Windows names win over the others
+            rank = 0 if platform == 3 and language == 0x409 else 1
+        elif platform == 1 and encoding == 0:
+            value, rank = raw.decode("mac_roman", "replace"), 2
+        else:
+            continue
+        if name_id not in found or rank < found[name_id][0]:
+            found[name_id] = (rank, value.strip())
+    family = (found.get(16) or found.get(1) or (0, None))[1]
+    style = (found.get(17) or found.get(2) or (0, None))[1]
+    return family, style
+
+
+def _os2(f, table):
+    """(weight class, script names) from the OS/2 table"""
+    offset, length = table
+    if length < 58:
+        return None, []
+    data = _read(f, offset, 58)
+    weight = struct.unpack(">H", data[4:6])[0]
+    ranges = struct.unpack(">4I", data[42:58])
+    bits = ranges[0] | ranges[1] << 32 | ranges[2] << 64 | ranges[3] << 96
+    scripts = [script for script, script_bits in SCRIPT_BITS.items() if any(bits >> b & 1 for b in script_bits)]
+    return weight, scripts
+
+
+def read_faces(path):
+    """Describe every face of a font file by reading only its table headers.
+
+    Returns a list of dicts with family, style, index and scripts. TrueType
+    collections (.ttc) yield one entry per face.
+    """
+    faces = []
+    with open(path, "rb") as f:
+        tag = _read(f, 0, 4)
+        if tag == b"ttcf":
+            count = struct.unpack(">I", _read(f, 8, 4))[0]
+            offsets = struct.unpack(f">{count}I", _read(f, 12, 4 * count))
+        else:
+            offsets = (0,)
+        for index, offset in enumerate(offsets):
+            tables = _tables(f, offset)
+            family, style = _names(f, tables[b"name"]) if b"name" in tables else (None, None)
+            weight, scripts = _os2(f, tables[b"OS/2"]) if b"OS/2" in tables else (None, [])
+            stem = os.path.splitext(os.path.basename(path))[0]
+            faces.append({
+                "family": family or stem,
+                "style": style or WEIGHT_STYLES.get(weight, "Regular"),
+                "index": index,
+                "scripts": scripts,
+            })
+    return faces
+
+
+def display_name(face):
+    if face["style"].lower() in ("regular", "normal", "book", "roman"):
+        return face["family"]
+    return f"{face['family']} {face['style']}"
+
+
+class FontIndex:
+    """Prefix and substring search over font names without a linear scan.
+
+    Names are kept sorted for prefix lookups with bisect, and every 1 to 3
+    character slice of a name maps to the names containing it. A query of up
+    to three characters is a single lookup, a longer one intersects the sets
+    of its trigrams and only checks the few candidates left.
+    """
+
+    GRAM = 3
+
+    def __init__(self, names):
+        self.names = sorted(set(names), key=str.lower)
+        self._lower = [n.lower() for n in self.names]
+        self._grams = {}
+        for i, name in enumerate(self._lower):
+            for size in range(1, self.GRAM + 1):
+                for start in range(len(name) - size + 1):
+                    self._grams.setdefault(name[start:start + size], set()).add(i)
+
+    def prefix(self, term):
+        term = term.lower()
+        start = bisect.bisect_left(self._lower, term)
+        end = bisect.bisect_left(self._lower, term + "\uffff")
+        return self.names[start:end]
+
+    def search(self, term):
+        """Names containing term, the ones starting with it first"""
+        term = term.lower()
+        if not term:
+            return list(self.names)
+        if len(term) <= self.GRAM:
+            candidates = self._grams.get(term, set())
+        else:
+            grams = [term[i:i + self.GRAM] for i in range(len(term) - self.GRAM + 1)]
+            sets = sorted((self._grams.get(g, set()) for g in grams), key=len)
+            candidates = set.intersection(*sets) if sets else set()
+            candidates = {i for i in candidates if term in self._lower[i]}
+        prefixed = [i for i in candidates if self._lower[i].startswith(term)]
+        rest = [i for i in candidates if not self._lower[i].startswith(term)]
+        return [self.names[i] for i in sorted(prefixed)] + [self.names[i] for i in sorted(rest)]
+
+
+class FontCatalog:
+    """On-disk catalog of the installed fonts.
+
+    Entries carry family, style, path, face index and supported scripts and
+    the catalog remembers the mtime of every font directory. Loading is a
+    single JSON read; refresh() only re-reads font files whose size or mtime
+    changed and is skipped entirely when no directory changed.
+    """
+
+    def __init__(self, path=None, dirs=None):
+        self.path = path
+        self.dirs = list(dirs) if dirs is not None else system_font_dirs()
+        self.fonts = []
+        self.files = {}
+        self.dir_mtimes = {}
+        self._lock = threading.Lock()
+        self._index = None
+        self._by_name = {}
+
+    @classmethod
+    def load(cls, path, dirs=None):
+        catalog = cls(path, dirs)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return catalog
+        if data.get("version") == CATALOG_VERSION:
+            catalog.files = data.get("files", {})
+            catalog.dir_mtimes = data.get("dir_mtimes", {})
+            catalog._set_fonts(data.get("fonts", []))
+        return catalog
+
+    def save(self):
+        if not self.path:
+            return
+        data = {"version": CATALOG_VERSION, "dir_mtimes": self.dir_mtimes, "files": self.files,
+                "fonts": self.fonts}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _set_fonts(self, fonts):
+        by_name = {}
+        for font in fonts:
+            by_name.setdefault(font["name"], font)
+        for font in fonts:
+            # Names older settings used: the file stem of the first face
+            if font["index"] == 0:
+                by_name.setdefault(os.path.splitext(os.path.basename(font["path"]))[0], font)
+        with self._lock:
+            self.fonts = fonts
+            self._by_name = by_name
+            self._index = None
+
+    def _current_dir_mtimes(self):
+        mtimes = {}
+        for root_dir in self.dirs:
+            for dirpath, _, _ in os.walk(root_dir):
+                try:
+                    mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+                except OSError:
+                    continue
+        return mtimes
+
+    def is_stale(self):
+        """True when a font directory was added, removed or modified since the last scan"""
+        return not self.fonts or self._current_dir_mtimes() != self.dir_mtimes
+
+    def refresh(self, force=False):
+        """Rescan the font directories, returns True when the catalog changed"""
+        dir_mtimes = self._current_dir_mtimes()
+        if not force and self.fonts and dir_mtimes == self.dir_mtimes:
+            return False
+        files = {}
+        fonts = []
+        for dirpath in sorted(dir_mtimes):
+            try:
+                entries = list(os.scandir(dirpath))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.name.lower().endswith(FONT_EXTENSIONS) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                known = self.files.get(entry.path)
+                if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+                    faces = known["faces"]
+                else:
+                    try:
+                        faces = read_faces(entry.path)
+                    except (OSError, ValueError, struct.error, KeyError):
+                        continue
+                files[entry.path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "faces": faces}
+                for face in faces:
+                    fonts.append(dict(face, path=entry.path, name=display_name(face)))
+        fonts.sort(key=lambda font: (font["name"].lower(), font["path"], font["index"]))
+        changed = fonts != self.fonts
+        self.files = files
+        self.dir_mtimes = dir_mtimes
+        self._set_fonts(fonts)
+        self.save()
+        return changed
+
+    def refresh_in_background(self, on_done=None):
+        """Refresh on a daemon thread, on_done(changed) is called from that thread"""
+        def run():
+            try:
+                changed = self.refresh()
+            except OSError:
+                changed = False
+            if on_done is not None:
+                on_done(changed)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def index(self):
+        with self._lock:
+            if self._index is None:
+                self._index = FontIndex(font["name"] for font in self.fonts)
+            return self._index
+
+    def names(self):
+        return self.index.names
+
+    def search(self, term):
+        return self.index.search(term)
+
+    def resolve(self, name):
+        """Catalog entry for a display name or a legacy file stem, or None"""
+        with self._lock:
+            return self._by_name.get(name)
+
+    def font_map(self):
+        """Display name -> (path, face index)"""
+        with self._lock:
+            return {name: (font["path"], font["index"]) for name, font in self._by_name.items()}
+
+    def for_script(self, script):
+        return [font["name"] for font in self.fonts if script in font["scripts"]]
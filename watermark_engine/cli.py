@@ -0,0 +1,519 @@
+import argparse
+import os
+import sys
+from functools import partial
+
+from PIL import Image
+
+from .batch import OUTPUT_PREFIX, run_batch
+from .catalog import SCRIPT_BITS, FontCatalog, default_catalog_path
+from .encode import FORMAT_EXTENSIONS, PRESETS, SUBSAMPLING, OutputOptions
+from .events import EventChannel, StreamReporter
+from .job import COLOR_MODES, LAYOUTS, WatermarkJob
+from .manifest import Manifest, settings_fingerprint
+from .metrics import STAGES, JobReport, profiling
+from .pipeline import PipelineOptions
+from .renditions import load_renditions
+from .schedule import PixelProgress, format_eta
+from .shards import SHARD_REPORT_DIR, Shard, merge_shards
+from .sinks import ArchiveSink
+from .sources import ArchiveSource, FolderSource, archive_type
+
+
+def add_job_arguments(parser, text_required=True):
+    parser.add_argument("--text", default="", help="watermark text")
+    parser.add_argument("--logo", metavar="IMAGE", help="draw this image (e.g. a transparent PNG) instead of the text")
+    parser.set_defaults(text_required=text_required)
+    parser.add_argument("--font", help="installed font name (see 'fonts') or path to a TrueType/OpenType file")
+    parser.add_argument("--font-index", type=int, default=0, help="face to use inside a .ttc collection")
+    parser.add_argument("--font-percent", type=int, default=5,
+                        help="font size (or logo height) as a percentage of the image size")
+    parser.add_argument("--opacity", type=int, default=180, help="watermark opacity (0-255)")
+    parser.add_argument("--no-auto-color", dest="auto_color", action="store_false",
+                        help="always use a white watermark instead of adapting to the image brightness")
+    parser.add_argument("--color-mode", choices=COLOR_MODES, default="region",
+                        help="what auto color measures: the whole image, the area under the text (default) "
+                             "or each character")
+    parser.add_argument("--layout", choices=LAYOUTS, default="corner",
+                        help="text once in the bottom right corner (default) or repeated across the image")
+    parser.add_argument("--angle", type=int, default=30, help="rotation of the tiled text in degrees")
+    parser.add_argument("--spacing", type=int, default=50,
+                        help="gap between tiled copies in percent of the font size")
+
+
+def add_output_arguments(parser):
+    parser.add_argument("--format", choices=[f.lower() for f in FORMAT_EXTENSIONS],
+                        help="output format, keeps the source format by default")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="balanced",
+                        help="encoder speed/size trade-off (default balanced)")
+    parser.add_argument("--quality", type=int, help="JPEG quality (1-95)")
+    parser.add_argument("--subsampling", choices=SUBSAMPLING, help="JPEG chroma subsampling")
+    parser.add_argument("--progressive", action="store_true", default=None, help="write progressive JPEGs")
+    parser.add_argument("--optimize", action="store_true", default=None, help="optimize JPEG Huffman tables")
+    parser.add_argument("--png-compress-level", type=int, choices=range(10), metavar="0-9",
+                        help="PNG zlib level, lower is faster")
+    parser.add_argument("--webp-quality", type=int, help="WebP/AVIF quality (0-100)")
+    parser.add_argument("--lossless", action="store_true", default=None, help="write lossless WebP")
+    parser.add_argument("--strip-metadata", dest="keep_metadata", action="store_false", default=None,
+                        help="do not copy EXIF and ICC profiles to the outputs")
+
+
+def add_memory_arguments(parser):
+    parser.add_argument("--memory-budget", type=int, default=2048, metavar="MB",
+                        help="memory the images processed at once may take together (default 2048), bigger "
+                             "uncompressed TIFF/BMP images are only decoded under the watermark, 0 disables")
+    parser.add_argument("--max-megapixels", type=int, metavar="MP",
+                        help="raise Pillow's decompression bomb limit for trusted very large images")
+
+
+def memory_budget_from_args(args):
+    if args.max_megapixels:
+        # Process-wide, pool workers forked afterwards inherit it
+        Image.MAX_IMAGE_PIXELS = args.max_megapixels * 1000000
+    return args.memory_budget << 20
+
+
+def output_from_args(args):
+    return OutputOptions.from_preset(
+        args.preset,
+        format=args.format,
+        jpeg_quality=args.quality,
+        jpeg_subsampling=args.subsampling,
+        jpeg_progressive=args.progressive,
+        jpeg_optimize=args.optimize,
+        png_compress_level=args.png_compress_level,
+        webp_quality=args.webp_quality,
+        avif_quality=args.webp_quality,
+        webp_lossless=args.lossless,
+        keep_metadata=args.keep_metadata
+    )
+
+
+def resolve_font(args):
+    """(path, face index) for --font, looked up in the font catalog unless it is a file"""
+    if not args.font or os.path.isfile(args.font):
+        return args.font, args.font_index
+    catalog = FontCatalog.load(default_catalog_path())
+    catalog.refresh()
+    font = catalog.resolve(args.font)
+    if font is None:
+        raise SystemExit(f"Font not found: {args.font}")
+    return font["path"], font["index"]
+
+
+def job_from_args(args):
+    if args.text_required and not args.text and not args.logo:
+        raise SystemExit("--text or --logo is required")
+    if args.logo and not os.path.isfile(args.logo):
+        raise SystemExit(f"Logo not found: {args.logo}")
+    if args.logo and args.layout != "corner":
+        raise SystemExit("--logo only works with --layout corner")
+    font_path, font_index = resolve_font(args)
+    return WatermarkJob(
+        text=args.text,
+        font_path=font_path,
+        font_index=font_index,
+        font_percent=args.font_percent,
+        opacity=args.opacity,
+        auto_color=args.auto_color,
+        color_mode=args.color_mode,
+        layout=args.layout,
+        angle=args.angle,
+        spacing=args.spacing,
+        logo_path=args.logo
+    )
+
+
+def report_result(channel, i, total, result, progress=None):
+    counter = f"{i + 1}/{total}"
+    if progress is not None:
+        counter += f" {progress.fraction(total):.0%} eta {format_eta(progress.eta(total))}"
+    if result.skipped:
+        channel.log(f"[{counter}] {result.name} is up to date")
+    elif result.ok:
+        line = f"[{counter}] {result.name} -> {result.output}"
+        if result.info.get("brightness") is not None:
+            line += f" (brightness {result.info['brightness']:.2f})"
+        channel.log(line)
+        if result.info.get("font_error"):
+            channel.error(f"  warning: error loading font: {result.info['font_error']} - using default font")
+    else:
+        channel.error(f"[{counter}] error processing {result.name}: {result.error}")
+
+
+def add_source_arguments(parser):
+    parser.add_argument("-r", "--recursive", action="store_true", help="also process subfolders")
+    parser.add_argument("--include", action="append", metavar="GLOB",
+                        help="only process files matching this pattern (repeatable)")
+    parser.add_argument("--exclude", action="append", metavar="GLOB",
+                        help="skip files matching this pattern (repeatable)")
+    parser.add_argument("--sniff", action="store_true",
+                        help="detect images without a known extension from their contents")
+    parser.add_argument("--queue-size", type=int, default=1024,
+                        help="paths buffered ahead of processing while the folder is scanned")
+    parser.add_argument("--include-prefixed", action="store_true",
+                        help="also process files starting with wm_, skipped by default as results of earlier runs")
+    parser.add_argument("-o", "--output-dir",
+                        help="write results here, mirroring the input tree, instead of wm_ files next to the sources "
+                             "(batch: a .zip or .tar[.gz] name writes them into that archive)")
+
+
+def skip_prefixes_from_args(args):
+    return () if args.include_prefixed else (OUTPUT_PREFIX,)
+
+
+def is_archive_input(args):
+    return os.path.isfile(args.folder) and archive_type(args.folder) is not None
+
+
+def archive_output(args, shard=None):
+    """Path of the archive batch results go to, None when they are written as files"""
+    if args.output_dir and archive_type(args.output_dir) is not None:
+        path = args.output_dir
+    elif is_archive_input(args) and not args.output_dir:
+        # Archives come back as archives, next to the source like wm_ files
+        directory, base = os.path.split(args.folder)
+        path = os.path.join(directory, OUTPUT_PREFIX + base)
+    else:
+        return None
+    # Shards cannot append to one archive, each writes its own
+    return shard.archive_path(path) if shard is not None else path
+
+
+def source_from_args(args, shard=None):
+    if is_archive_input(args):
+        # Tar members are queued with their bytes, the default queue of paths would hold far too many
+        return ArchiveSource(args.folder, include=args.include, exclude=args.exclude, shard=shard)
+    return FolderSource(
+        args.folder,
+        recursive=args.recursive,
+        include=args.include,
+        exclude=args.exclude,
+        sniff=args.sniff,
+        skip_dirs=[args.output_dir] if args.output_dir else (),
+        skip_prefixes=skip_prefixes_from_args(args),
+        queue_size=args.queue_size,
+        shard=shard
+    )
+
+
+def add_shard_arguments(parser):
+    parser.add_argument("--shard-reports", metavar="DIR",
+                        help=f"where shards write their reports (default {SHARD_REPORT_DIR} where the outputs go)")
+
+
+def shard_from_args(args):
+    if not args.shard:
+        return None
+    try:
+        return Shard.parse(args.shard)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+
+def shard_report_dir(args):
+    if args.shard_reports:
+        return args.shard_reports
+    archive = archive_output(args)
+    if archive:
+        location = os.path.dirname(archive)
+    elif is_archive_input(args):
+        location = os.path.dirname(args.folder)
+    else:
+        location = args.output_dir or args.folder
+    return os.path.join(location, SHARD_REPORT_DIR)
+
+
+def add_manifest_arguments(parser):
+    parser.add_argument("--no-manifest", dest="manifest", action="store_false",
+                        help="do not keep a manifest, every run processes everything")
+    parser.add_argument("--force", action="store_true", help="process up to date images again")
+    parser.add_argument("--hash", dest="use_hash", action="store_true",
+                        help="compare file contents, not only size and mtime, to detect changed sources")
+
+
+def manifest_from_args(args, job, output, renditions=None, shard=None):
+    if not args.manifest or is_archive_input(args) or (args.output_dir and archive_type(args.output_dir)):
+        # Archives are rebuilt in full, skipped sources would be missing from the output
+        return None
+    return Manifest.for_batch(args.folder, job, output, args.output_dir, args.use_hash, args.force, renditions,
+                              shard)
+
+
+def renditions_from_args(args):
+    if not args.renditions:
+        return None
+    try:
+        return load_renditions(args.renditions)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Invalid rendition spec {args.renditions}: {e}")
+
+
+def add_pipeline_arguments(parser):
+    parser.add_argument("--pipeline", action="store_true",
+                        help="read ahead and write behind on I/O threads, for slow disks and network shares")
+    parser.add_argument("--read-ahead", type=int, default=8, metavar="N", help="files read ahead (default 8)")
+    parser.add_argument("--compute-depth", type=int, metavar="N",
+                        help="images handed to the workers at once (default 2 per worker)")
+    parser.add_argument("--write-behind", type=int, default=8, metavar="N",
+                        help="finished images whose write may be pending (default 8)")
+    parser.add_argument("--io-threads", type=int, default=4, metavar="N", help="threads reading and writing files")
+
+
+def pipeline_from_args(args):
+    if not args.pipeline:
+        return None
+    return PipelineOptions(args.read_ahead, args.compute_depth, args.write_behind, args.io_threads)
+
+
+def add_report_arguments(parser):
+    parser.add_argument("--report", metavar="PATH",
+                        help="write per-image stage timings, bytes and errors to a .json or .csv report")
+    parser.add_argument("--stats", action="store_true", help="print where the time went after the summary")
+    parser.add_argument("--cprofile", metavar="PATH", help="dump cProfile stats of this process to PATH")
+    parser.add_argument("--tracemalloc", type=int, default=0, metavar="N",
+                        help="print the peak traced memory and the N biggest allocation sites")
+
+
+def print_stats(summary):
+    busy = summary["busy_seconds"] or 1
+    stages = ", ".join(f"{stage} {summary['stage_seconds'][stage]:.2f}s ({summary['stage_seconds'][stage] / busy:.0%})"
+                       for stage in STAGES if summary["stage_seconds"][stage])
+    print(f"stages: {stages}")
+    print(f"{summary['wall_seconds']:.2f}s wall, {summary['images_per_sec']:.2f} images/s, "
+          f"{summary['mb_per_sec']:.1f} MB/s in, {summary['io_share']:.0%} of busy time in I/O "
+          f"({summary['bound']}-bound)")
+
+
+def cmd_batch(args):
+    job = job_from_args(args)
+    output = output_from_args(args)
+    renditions = renditions_from_args(args)
+    shard = shard_from_args(args)
+    manifest = manifest_from_args(args, job, output, renditions, shard)
+    archive = archive_output(args, shard)
+    sink = ArchiveSink(archive) if archive else None
+    source = source_from_args(args, shard)
+    channel = EventChannel()
+    # Lines are written in batches by the reporter thread, not once per image
+    reporter = StreamReporter(channel).start()
+    report = JobReport()
+    progress = PixelProgress()
+    try:
+        with profiling(args.cprofile, args.tracemalloc):
+            results = run_batch(args.folder, job, source,
+                                on_result=None if args.quiet else partial(report_result, channel, progress=progress),
+                                workers=args.workers, output=output, output_dir=None if sink else args.output_dir,
+                                manifest=manifest, report=report, pipeline=pipeline_from_args(args), sink=sink,
+                                memory_budget=memory_budget_from_args(args), progress=progress,
+                                renditions=renditions)
+        if sink is not None:
+            sink.close()
+    except BaseException:
+        if sink is not None:
+            sink.abort()
+        raise
+    finally:
+        reporter.stop()
+        source.close()
+        if manifest is not None:
+            manifest.close()
+    if args.report:
+        report.write(args.report)
+    if shard is not None:
+        # Written even when the shard is empty, merge would report it as never run otherwise
+        path = shard.write_report(report, shard_report_dir(args), args.folder,
+                                  settings_fingerprint(job, output, renditions))
+        if not args.quiet:
+            print(f"shard {shard} report written to {path}")
+        if not results:
+            print(f"No images in shard {shard} of {args.folder}")
+            return 0
+    if not results:
+        print(f"No images found in {args.folder}", file=sys.stderr)
+        return 1
+    failed = sum(1 for r in results if not r.ok)
+    skipped = sum(1 for r in results if r.skipped)
+    print(f"{len(results) - failed - skipped} images processed, {skipped} up to date, {failed} failed")
+    # Counted from the results so the figures add up across pool workers
+    hits = sum(1 for r in results if r.info.get("font_cache_hit") is True)
+    misses = sum(1 for r in results if r.info.get("font_cache_hit") is False)
+    if hits or misses:
+        print(f"font cache: {hits} hits, {misses} misses")
+    reused = sum(1 for r in results if r.info.get("stamp_cache_hit") is True)
+    rendered = sum(1 for r in results if r.info.get("stamp_cache_hit") is False)
+    if reused or rendered:
+        print(f"stamp cache: {reused} reused, {rendered} rendered")
+    if args.stats:
+        print_stats(report.summary())
+    return 1 if failed else 0
+
+
+def cmd_merge(args):
+    source = source_from_args(args)
+    try:
+        # The sources are listed again, a shard that never ran or stopped early leaves no trace of its images
+        names = source.names() if isinstance(source, ArchiveSource) else source
+        result = merge_shards(shard_report_dir(args), names)
+    except (OSError, ValueError) as e:
+        print(f"Cannot merge shard reports: {e}", file=sys.stderr)
+        return 1
+    finally:
+        source.close()
+    count = result.count
+    if not args.quiet:
+        for index in result.missing_shards:
+            print(f"shard {index}/{count} has no report, it did not run or did not finish")
+        for name, index in result.missing:
+            print(f"missing {name} (shard {index}/{count})")
+        for name, index, error in result.failed:
+            print(f"failed {name} (shard {index}/{count}): {error}")
+    if result.settings_differ:
+        print("warning: the shards ran with different settings", file=sys.stderr)
+    if args.report:
+        result.report.write(args.report)
+    done = result.total - len(result.missing) - len(result.failed)
+    print(f"{done} of {result.total} images done in {count} shards, {len(result.missing)} missing, "
+          f"{len(result.failed)} failed")
+    if result.complete:
+        return 0
+    retry = result.retry_shards()
+    if retry:
+        print("shards to run again: " + ", ".join(f"{index}/{count}" for index in retry))
+    return 1
+
+
+def cmd_watch(args):
+    from .watch import watch
+    job = job_from_args(args)
+    output = output_from_args(args)
+    manifest = manifest_from_args(args, job, output)
+    channel = EventChannel()
+    reporter = StreamReporter(channel).start()
+    channel.log(f"Watching {args.folder}, press Ctrl+C to stop")
+    try:
+        watch(args.folder, job, output, args.output_dir, manifest, args.recursive, args.include, args.exclude,
+              args.sniff, settle=args.settle, polling=args.polling, poll_interval=args.poll_interval,
+              initial=args.initial, on_result=None if args.quiet else partial(report_result, channel),
+              workers=args.workers, memory_budget=memory_budget_from_args(args),
+              skip_prefixes=skip_prefixes_from_args(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reporter.stop()
+        if manifest is not None:
+            manifest.close()
+    return 0
+
+
+def cmd_serve(args):
+    # Imported here so the other commands do not load asyncio
+    import asyncio
+
+    from .server import WatermarkServer
+    catalog = FontCatalog.load(default_catalog_path())
+    catalog.refresh()
+    server = WatermarkServer(job_from_args(args), output_from_args(args), host=args.host, port=args.port,
+                             workers=args.workers, queue_limit=args.queue_limit, max_body=args.max_body << 20,
+                             allowed_roots=args.allow_path or (), catalog=catalog)
+
+    async def run():
+        await server.start()
+        print(f"Serving on http://{server.host}:{server.port}/watermark with {server.workers} workers", flush=True)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_fonts(args):
+    catalog = FontCatalog.load(default_catalog_path())
+    catalog.refresh(force=args.rescan)
+    names = catalog.search(args.search or "")
+    for name in names:
+        font = catalog.resolve(name)
+        if args.script and args.script not in font["scripts"]:
+            continue
+        suffix = f" #{font['index']}" if font["index"] else ""
+        print(f"{name}\t{font['path']}{suffix}\t{','.join(font['scripts'])}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m watermark_engine", description="Headless WaterMark Pro engine")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    batch = commands.add_parser("batch", help="watermark every image of a folder")
+    batch.add_argument("folder", help="folder containing the images, or a .zip or .tar[.gz] archive of them")
+    add_job_arguments(batch)
+    add_source_arguments(batch)
+    add_output_arguments(batch)
+    add_manifest_arguments(batch)
+    add_report_arguments(batch)
+    add_pipeline_arguments(batch)
+    add_memory_arguments(batch)
+    batch.add_argument("--renditions", metavar="SPEC.json",
+                       help="write several sizes/formats of every image from one decode, see README")
+    batch.add_argument("-j", "--workers", type=int, default=0,
+                       help="worker processes, 0 uses every CPU core (default), 1 runs in-process")
+    batch.add_argument("--shard", metavar="I/N",
+                       help="only process the I-th of N parts of the folder, split by path hash, see README")
+    add_shard_arguments(batch)
+    batch.add_argument("-q", "--quiet", action="store_true", help="only print the summary")
+    batch.set_defaults(func=cmd_batch)
+
+    merge = commands.add_parser("merge", help="combine the reports of a sharded batch and list what is left to do")
+    merge.add_argument("folder", help="folder or archive the shards processed")
+    add_source_arguments(merge)
+    add_shard_arguments(merge)
+    merge.add_argument("--report", metavar="PATH", help="write the combined per-image report to a .json or .csv file")
+    merge.add_argument("-q", "--quiet", action="store_true", help="only print the summary, not every missing image")
+    merge.set_defaults(func=cmd_merge)
+
+    watcher = commands.add_parser("watch", help="watermark images as they are dropped into a folder")
+    watcher.add_argument("folder", help="folder to watch")
+    add_job_arguments(watcher)
+    add_source_arguments(watcher)
+    add_output_arguments(watcher)
+    add_manifest_arguments(watcher)
+    add_memory_arguments(watcher)
+    watcher.add_argument("--settle", type=float, default=1.0, metavar="SECONDS",
+                         help="how long a file must stay unchanged before it is processed")
+    watcher.add_argument("--polling", action="store_true",
+                         help="poll instead of using inotify, for network shares")
+    watcher.add_argument("--poll-interval", type=float, default=2.0, metavar="SECONDS")
+    watcher.add_argument("--no-initial", dest="initial", action="store_false",
+                         help="do not process the images already in the folder")
+    watcher.add_argument("-j", "--workers", type=int, default=1,
+                         help="worker processes per group of arrivals (default 1, in-process)")
+    watcher.add_argument("-q", "--quiet", action="store_true", help="do not print every image")
+    watcher.set_defaults(func=cmd_watch)
+
+    serve = commands.add_parser("serve", help="watermark images sent over HTTP by a long-running local service")
+    add_job_arguments(serve, text_required=False)
+    add_output_arguments(serve)
+    serve.add_argument("--host", default="127.0.0.1", help="address to listen on (default localhost only)")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("-j", "--workers", type=int, default=0, help="worker processes, 0 uses every CPU core")
+    serve.add_argument("--queue-limit", type=int,
+                       help="requests waiting for a worker before new ones get 503 (default 4 per worker)")
+    serve.add_argument("--max-body", type=int, default=256, metavar="MB", help="largest accepted upload")
+    serve.add_argument("--allow-path", action="append", metavar="DIR",
+                       help="let requests name files under DIR instead of uploading them (repeatable)")
+    serve.set_defaults(func=cmd_serve)
+
+    fonts = commands.add_parser("fonts", help="list the installed fonts from the font catalog")
+    fonts.add_argument("search", nargs="?", help="only fonts whose name contains this text")
+    fonts.add_argument("--script", choices=sorted(SCRIPT_BITS), help="only fonts covering this script")
+    fonts.add_argument("--rescan", action="store_true", help="rebuild the catalog from scratch")
+    fonts.set_defaults(func=cmd_fonts)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
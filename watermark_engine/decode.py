@@ -0,0 +1,54 @@
+from PIL import Image
+
+# Modes the watermark can be composited into without converting the source
+RENDER_MODES = ("RGB", "RGBA", "L")
+
+
+def open_image(source):
+    """Open an image lazily, only the header is read until pixels are needed"""
+    return Image.open(source)
+
+
+def render_mode(img):
+    """Mode to composite in: the source mode when possible, RGBA only with transparency"""
+    if img.mode in RENDER_MODES:
+        return img.mode
+    if img.mode in ("LA", "PA", "La", "RGBa") or "transparency" in img.info:
+        return "RGBA"
+    return "RGB"
+
+
+def load_for_render(img):
+    """Decode a lazily opened image, converting only when its mode needs it.
+
+    Opaque JPEGs stay RGB instead of taking the RGB -> RGBA -> RGB trip.
+    """
+    mode = render_mode(img)
+    if img.mode == mode:
+        img.load()
+        return img
+    return img.convert(mode)
+
+
+def draft_reduced(img, max_side):
+    """Have a lazily opened image decode at reduced scale, at least max_side per side, if its format can.
+
+    Only JPEGs can, at 1/2, 1/4 or 1/8 scale through draft(). Returns
+    whether the decode got smaller, other formats still decode in full.
+    """
+    full_size = img.size
+    img.draft(None, (max_side, max_side))
+    return img.size != full_size
+
+
+def load_proxy(img, max_side):
+    """Decode a reduced copy of a lazily opened image, at most max_side per side.
+
+    JPEGs are decoded straight at 1/2, 1/4 or 1/8 scale through draft(),
+    other formats are decoded in full then box-reduced. Returns
+    (proxy, full_size) since draft() changes the reported size.
+    """
+    full_size = img.size
+    img.thumbnail((max_side, max_side))
+    proxy = load_for_render(img)
+    return proxy, full_size
@@ -0,0 +1,165 @@
+import os
+from PIL import Image
+
+# Output format name -> file extension
+FORMAT_EXTENSIONS = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "WEBP": ".webp",
+    "AVIF": ".avif",
+    "TIFF": ".tif",
+    "BMP": ".bmp",
+    "GIF": ".gif",
+}
+
+# Source formats written back as another format when preserving
+FORMAT_ALIASES = {"MPO": "JPEG"}
+
+# Color space an ICC profile declares in its header, for the modes images are written in
+ICC_SPACES = {"RGB": b"RGB ", "RGBA": b"RGB ", "P": b"RGB ", "L": b"GRAY", "LA": b"GRAY", "1": b"GRAY",
+              "CMYK": b"CMYK"}
+
+# Modes each format can store, anything else is converted
+FORMAT_MODES = {
+    "JPEG": ("RGB", "L", "CMYK"),
+    "WEBP": ("RGB", "RGBA"),
+    "AVIF": ("RGB", "RGBA"),
+    "BMP": ("RGB", "L", "P", "1"),
+}
+
+PRESETS = {
+    "fast": {"jpeg_quality": 85, "png_compress_level": 1, "webp_quality": 85, "webp_method": 0,
+             "avif_quality": 70, "avif_speed": 10},
+    "balanced": {},
+    "small": {"jpeg_quality": 82, "jpeg_optimize": True, "jpeg_progressive": True, "png_compress_level": 9,
+              "webp_quality": 80, "webp_method": 6, "avif_quality": 60, "avif_speed": 4},
+    "max": {"jpeg_quality": 95, "jpeg_subsampling": "4:4:4", "png_compress_level": 6, "webp_lossless": True,
+            "avif_quality": 90},
+}
+
+SUBSAMPLING = ("4:4:4", "4:2:2", "4:2:0")
+
+
+class OutputOptions:
+    """How watermarked images are encoded.
+
+    format=None keeps the source format. PNG defaults to compress_level 3
+    which is several times faster than Pillow's 6 for a few percent more
+    bytes.
+    """
+
+    def __init__(self, format=None, jpeg_quality=90, jpeg_subsampling=None, jpeg_optimize=False,
+                 jpeg_progressive=False, png_compress_level=3, webp_quality=90, webp_lossless=False,
+                 webp_method=4, avif_quality=80, avif_speed=6, keep_metadata=True):
+        if format is not None:
+            format = format.upper()
+            format = "JPEG" if format == "JPG" else format
+            if format not in FORMAT_EXTENSIONS:
+                raise ValueError(f"Unsupported output format: {format}")
+        if jpeg_subsampling is not None and jpeg_subsampling not in SUBSAMPLING:
+            raise ValueError(f"jpeg_subsampling must be one of {', '.join(SUBSAMPLING)}")
+        self.format = format
+        self.jpeg_quality = jpeg_quality
+        self.jpeg_subsampling = jpeg_subsampling
+        self.jpeg_optimize = jpeg_optimize
+        self.jpeg_progressive = jpeg_progressive
+        self.png_compress_level = png_compress_level
+        self.webp_quality = webp_quality
+        self.webp_lossless = webp_lossless
+        self.webp_method = webp_method
+        self.avif_quality = avif_quality
+        self.avif_speed = avif_speed
+        self.keep_metadata = keep_metadata
+
+    @classmethod
+    def from_preset(cls, preset="balanced", **overrides):
+        if preset not in PRESETS:
+            raise ValueError(f"Unknown output preset: {preset}")
+        options = dict(PRESETS[preset])
+        options.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**options)
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        return cls.from_preset(data.pop("preset", "balanced"), **data)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def format_for(self, source_format):
+        """Format an image read as source_format is written in"""
+        if self.format:
+            return self.format
+        source_format = FORMAT_ALIASES.get(source_format, source_format)
+        return source_format if source_format in FORMAT_EXTENSIONS else "PNG"
+
+    def save_params(self, fmt):
+        if fmt == "JPEG":
+            params = {"quality": self.jpeg_quality, "optimize": self.jpeg_optimize,
+                      "progressive": self.jpeg_progressive}
+            if self.jpeg_subsampling:
+                params["subsampling"] = self.jpeg_subsampling
+            return params
+        if fmt == "PNG":
+            return {"compress_level": self.png_compress_level}
+        if fmt == "WEBP":
+            return {"quality": self.webp_quality, "lossless": self.webp_lossless, "method": self.webp_method}
+        if fmt == "AVIF":
+            return {"quality": self.avif_quality, "speed": self.avif_speed}
+        return {}
+
+
+def output_name(name, fmt):
+    """Swap the extension of a file name for the one of the output format"""
+    root, ext = os.path.splitext(name)
+    if Image.registered_extensions().get(ext.lower()) == fmt:
+        return name
+    return root + FORMAT_EXTENSIONS[fmt]
+
+
+def convert_for_format(img, fmt):
+    """Convert to a mode the format can store, flattening alpha onto white"""
+    modes = FORMAT_MODES.get(fmt)
+    if modes is None or img.mode in modes:
+        return img
+    if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        if "RGBA" in modes:
+            return rgba
+        flat = Image.new("RGB", img.size, (255, 255, 255))
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        return flat
+    return img.convert("RGB")
+
+
+def icc_matches(profile, mode):
+    """Whether an ICC profile describes pixels of mode, from the color space in its header"""
+    return profile[16:20] == ICC_SPACES.get(mode)
+
+
+def metadata_params(info, mode=None):
+    """EXIF and ICC profile of the source, as save() keyword arguments.
+
+    With the mode written, a profile of another color space (CMYK decoded
+    to RGB) is dropped, viewers would read the pixels through it.
+    """
+    params = {}
+    if info.get("exif"):
+        params["exif"] = info["exif"]
+    profile = info.get("icc_profile")
+    if profile and (mode is None or icc_matches(profile, mode)):
+        params["icc_profile"] = profile
+    return params
+
+
+def encode(img, fp, fmt, options, source_info=None):
+    """Write img to a path or file object as fmt with the options of that format"""
+    Image.init()
+    if fmt not in Image.SAVE:
+        raise ValueError(f"{fmt} encoding is not available in this Pillow build")
+    img = convert_for_format(img, fmt)
+    params = options.save_params(fmt)
+    if options.keep_metadata:
+        params.update(metadata_params(source_info if source_info is not None else img.info, img.mode))
+    img.save(fp, format=fmt, **params)
@@ -0,0 +1,98 @@
+import queue
+import sys
+import threading
+
+
+class EventChannel:
+    """Thread-safe hand-off of batch events from workers to a single consumer.
+
+    Producers call log(), error(), progress() or emit() from any thread and
+    never block. The consumer calls drain() at its own pace, typically on a
+    timer, and gets every queued event in one go. Progress is coalesced:
+    only the latest value is kept, however many images finished in between.
+    """
+
+    def __init__(self):
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._progress = None
+
+    def emit(self, kind, payload=None):
+        self._events.put((kind, payload))
+
+    def log(self, message):
+        self.emit("log", message)
+
+    def error(self, message):
+        self.emit("error", message)
+
+    def progress(self, done, total):
+        with self._lock:
+            self._progress = (done, total)
+
+    def drain(self, limit=None):
+        """Return (events, progress), progress is None when it did not change.
+
+        limit caps the events taken per call so one drain cannot stall the
+        consumer after a burst, the rest waits for the next call.
+        """
+        events = []
+        while limit is None or len(events) < limit:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            progress, self._progress = self._progress, None
+        return events, progress
+
+
+class StreamReporter:
+    """Drain a channel to text streams at a fixed interval from a daemon thread.
+
+    log events go to out and error events to err, each drain is written
+    with a single call so a fast batch does not pay one write per line.
+    """
+
+    def __init__(self, channel, out=None, err=None, interval=0.1):
+        self.channel = channel
+        self.out = out or sys.stdout
+        self.err = err or sys.stderr
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def flush(self):
+        events, _ = self.channel.drain()
+        out = [payload for kind, payload in events if kind == "log"]
+        err = [payload for kind, payload in events if kind == "error"]
+        if out:
+            self.out.write("\n".join(out) + "\n")
+            self.out.flush()
+        if err:
+            self.err.write("\n".join(err) + "\n")
+            self.err.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the thread and write whatever is still queued"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,80 @@
+import threading
+from io import BytesIO
+from PIL import ImageFont
+
+from .cache import LRUCache
+
+
+class FontCache:
+    """Shared FreeType fonts keyed by (font_path, pixel size, face index).
+
+    Each font file is read from disk once and every size is parsed once,
+    which matters for the large CJK fonts where a single file is tens of MB.
+    """
+
+    def __init__(self, maxsize=64):
+        self._fonts = LRUCache(maxsize)
+        self._files = {}
+        self._files_lock = threading.Lock()
+
+    def font_bytes(self, font_path):
+        with self._files_lock:
+            data = self._files.get(font_path)
+        if data is None:
+            with open(font_path, "rb") as f:
+                data = f.read()
+            with self._files_lock:
+                data = self._files.setdefault(font_path, data)
+        return data
+
+    def fetch(self, font_path, size, index=0):
+        """Return (font, hit) for a font file at a pixel size, index selects a face of a .ttc"""
+        return self._fonts.fetch(
+            (font_path, size, index),
+            lambda: ImageFont.truetype(BytesIO(self.font_bytes(font_path)), size, index=index)
+        )
+
+    def get(self, font_path, size, index=0):
+        return self.fetch(font_path, size, index)[0]
+
+    def clear(self):
+        self._fonts.clear()
+        with self._files_lock:
+            self._files.clear()
+
+    def stats(self):
+        return self._fonts.stats()
+
+
+# Process wide cache, each pool worker gets its own copy
+default_font_cache = FontCache()
+
+
+def load_font(font_path, font_size, cache=None, index=0):
+    """Load a TrueType font through the font cache.
+
+    Returns (font, cache_hit, error), falling back to the default font when
+    the file cannot be loaded.
+    """
+    if font_path is None:
+        return default_font(font_size), None, None
+    cache = cache or default_font_cache
+    try:
+        font, hit = cache.fetch(font_path, font_size, index)
+        return font, hit, None
+    except Exception as e:
+        return default_font(font_size), None, e
+
+
+_default_fonts = LRUCache(16)
+
+
+def default_font(font_size):
+    """Pillow's built-in font at font_size, a fixed size bitmap font before Pillow 10.1"""
+    def load():
+        try:
+            return ImageFont.load_default(size=font_size)
+        except (TypeError, ValueError):
+            # No size argument before Pillow 10.1, or a size FreeType cannot render
+            return ImageFont.load_default()
+    return _default_fonts.fetch(font_size, load)[0]
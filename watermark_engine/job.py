@@ -0,0 +1,71 @@
+import json
+
+# How auto_color measures the background: the whole image, the area under
+# the text, or each character on its own
+COLOR_MODES = ("image", "region", "glyph")
+
+# Where the text goes: once in the bottom right corner, or repeated at an
+# angle across the whole image
+LAYOUTS = ("corner", "tiled")
+
+
+class WatermarkJob:
+    """Watermark settings shared by every image of a batch"""
+
+    def __init__(self, text, font_path=None, font_percent=5, opacity=180, auto_color=True,
+                 color_mode="region", font_index=0, layout="corner", angle=30, spacing=50, logo_path=None):
+        if color_mode not in COLOR_MODES:
+            raise ValueError(f"color_mode must be one of {', '.join(COLOR_MODES)}, not {color_mode!r}")
+        if layout not in LAYOUTS:
+            raise ValueError(f"layout must be one of {', '.join(LAYOUTS)}, not {layout!r}")
+        if logo_path and layout != "corner":
+            raise ValueError("a logo can only be placed with the corner layout")
+        self.text = text
+        self.font_path = font_path
+        self.font_percent = font_percent
+        self.opacity = opacity
+        self.auto_color = auto_color
+        self.color_mode = color_mode
+        # Face to use inside a TrueType collection (.ttc)
+        self.font_index = font_index
+        self.layout = layout
+        # Tiled layout only: rotation in degrees counterclockwise and the gap
+        # between copies in percent of the font size
+        self.angle = angle
+        self.spacing = spacing
+        # Image drawn instead of the text, its height is font_percent of the image like the font size
+        self.logo_path = logo_path
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            text=data.get("text", ""),
+            font_path=data.get("font_path"),
+            font_percent=int(data.get("font_percent", 5)),
+            opacity=int(data.get("opacity", 180)),
+            auto_color=bool(data.get("auto_color", True)),
+            color_mode=data.get("color_mode", "region"),
+            font_index=int(data.get("font_index", 0)),
+            layout=data.get("layout", "corner"),
+            angle=int(data.get("angle", 30)),
+            spacing=int(data.get("spacing", 50)),
+            logo_path=data.get("logo_path")
+        )
+
+    def to_dict(self):
+        return {
+            "text": self.text,
+            "font_path": self.font_path,
+            "font_percent": self.font_percent,
+            "opacity": self.opacity,
+            "auto_color": self.auto_color,
+            "color_mode": self.color_mode,
+            "font_index": self.font_index,
+            "layout": self.layout,
+            "angle": self.angle,
+            "spacing": self.spacing,
+            "logo_path": self.logo_path
+        }
+
+    def __repr__(self):
+        return f"WatermarkJob({json.dumps(self.to_dict(), ensure_ascii=False)})"
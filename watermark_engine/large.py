@@ -0,0 +1,240 @@
+import os
+import shutil
+import threading
+
+from PIL import Image
+
+from .brightness import clip_box, estimate_brightness
+from .decode import RENDER_MODES, render_mode
+from .metrics import NULL_TIMER
+from .render import (WHITE, apply_stamp, choose_color, corner_origin, font_size_for, offset_box, text_metrics,
+                     text_origin)
+from .stamps import default_stamp_cache
+
+# Formats that can store their pixels uncompressed at fixed offsets in the file
+PATCHABLE_FORMATS = ("TIFF", "BMP")
+
+# Raw layouts that can be decoded and written back, per image mode, with their bits per pixel
+RAW_MODES = {
+    "L": {"L": 8},
+    "RGB": {"RGB": 24, "BGR": 24, "RGBX": 32, "BGRX": 32},
+    "RGBA": {"RGBA": 32, "BGRA": 32},
+}
+
+# Bytes decoded at a time when the whole frame is streamed to measure its brightness
+STREAM_BYTES = 4 * 1024 * 1024
+
+
+def decoded_bytes(img):
+    """Memory a full decode of a lazily opened image takes, in the mode it is rendered in"""
+    return img.width * img.height * len(render_mode(img))
+
+
+class RawStrip:
+    """One strip or tile of uncompressed pixels: where it sits in the image and in the file.
+
+    stride is the number of bytes between two stored rows, which may
+    include padding (BMP rows are padded to 4 bytes), and orientation -1
+    means the rows are stored bottom-up.
+    """
+
+    def __init__(self, box, offset, rawmode, bits, stride=0, orientation=1):
+        self.box = box
+        self.offset = offset
+        self.rawmode = rawmode
+        self.row_bytes = (box[2] - box[0]) * bits // 8
+        self.stride = stride or self.row_bytes
+        self.orientation = orientation
+
+    @property
+    def width(self):
+        return self.box[2] - self.box[0]
+
+    def span(self, top, bottom):
+        """(file offset, length) of the stored rows holding image rows top to bottom"""
+        if self.orientation < 0:
+            first = self.box[3] - bottom
+        else:
+            first = top - self.box[1]
+        return self.offset + first * self.stride, (bottom - top) * self.stride
+
+    def decode(self, data, mode, rows):
+        return Image.frombytes(mode, (self.width, rows), bytes(data), "raw", self.rawmode, self.stride,
+                               self.orientation)
+
+    def encode_into(self, data, img):
+        """Pack img back into the stored rows of data, leaving the row padding untouched"""
+        packed = img.tobytes("raw", self.rawmode)
+        rows = img.height
+        for i in range(rows):
+            stored = rows - 1 - i if self.orientation < 0 else i
+            start = stored * self.stride
+            data[start:start + self.row_bytes] = packed[i * self.row_bytes:(i + 1) * self.row_bytes]
+
+
+class RawLayout:
+    """Size, mode and strips of an image whose pixels can be patched in the file"""
+
+    def __init__(self, size, mode, strips):
+        self.size = size
+        self.mode = mode
+        self.strips = strips
+
+
+def raw_layout(img):
+    """RawLayout of a lazily opened image, None unless every strip is stored uncompressed"""
+    if img.format not in PATCHABLE_FORMATS or img.mode not in RENDER_MODES or getattr(img, "n_frames", 1) != 1:
+        return None
+    strips = []
+    for tile in img.tile:
+        decoder, box, offset, args = tile[:4]
+        if decoder != "raw":
+            return None
+        if isinstance(args, str):
+            args = (args,)
+        bits = RAW_MODES[img.mode].get(args[0])
+        if bits is None:
+            return None
+        strips.append(RawStrip(box, offset, args[0], bits, *args[1:3]))
+    return RawLayout(img.size, img.mode, strips) if strips else None
+
+
+def large_layout(img, job, fmt, output, memory_budget):
+    """RawLayout to patch when decoding img would exceed memory_budget bytes, else None.
+
+    Only sources written back in their own format with their metadata can
+    be patched, the output is then a copy of the file with the pixels
+    under the watermark replaced. A tiled watermark covers every pixel and
+    is never patched.
+    """
+    if not memory_budget or job.layout != "corner" or decoded_bytes(img) <= memory_budget:
+        return None
+    if fmt != img.format or not output.keep_metadata:
+        return None
+    return raw_layout(img)
+
+
+def _stream_brightness(f, layout):
+    """Mean brightness of the whole frame, decoded a few rows at a time"""
+    total = weight = 0.0
+    for strip in layout.strips:
+        step = max(1, STREAM_BYTES // strip.stride)
+        for top in range(strip.box[1], strip.box[3], step):
+            bottom = min(top + step, strip.box[3])
+            start, length = strip.span(top, bottom)
+            f.seek(start)
+            rows = strip.decode(f.read(length), layout.mode, bottom - top)
+            pixels = rows.width * rows.height
+            total += estimate_brightness(rows) * pixels
+            weight += pixels
+    return total / weight if weight else None
+
+
+def patch_large(path, output_path, job, layout, stamp_cache=None, timer=None):
+    """Watermark an uncompressed image without decoding all of it.
+
+    The file is copied to output_path, then only the rows of the strips
+    under the watermark are read, decoded, composited and written back
+    over the copy, so memory grows with the watermark area rather than
+    with the image. Auto color in "image" mode still reads the whole frame,
+    a few rows at a time. Returns the info dict of render().
+    """
+    timer = timer or NULL_TIMER
+    info = {"brightness": None, "color": None, "font_error": None, "font_cache_hit": None,
+            "stamp_cache_hit": None}
+    stamp_cache = stamp_cache or default_stamp_cache
+    directory, base = os.path.split(output_path)
+    tmp_path = os.path.join(directory, f".{base}.{os.getpid()}-{threading.get_ident()}.part")
+    with timer.stage("write"):
+        os.makedirs(directory or ".", exist_ok=True)
+        shutil.copyfile(path, tmp_path)
+    try:
+        with open(tmp_path, "r+b") as f:
+            if job.logo_path:
+                _patch_logo(f, layout, job, stamp_cache, info, timer)
+            elif not job.text:
+                # Nothing is drawn, there is no color to measure the frame for
+                info["color"] = WHITE + (job.opacity,)
+            else:
+                brightness = None
+                if job.auto_color and job.color_mode == "image":
+                    with timer.stage("brightness"):
+                        brightness = _stream_brightness(f, layout)
+                _patch_text(f, layout, job, stamp_cache, brightness, info, timer)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return info
+
+
+def _read_band(f, layout, box, timer):
+    """Decode the part of every strip box overlaps into one band, returns (band, parts)"""
+    left, top, right, bottom = box
+    band = Image.new(layout.mode, (right - left, bottom - top))
+    parts = []
+    for strip in layout.strips:
+        x0, y0, x1, y1 = strip.box
+        if x1 <= left or x0 >= right or y1 <= top or y0 >= bottom:
+            continue
+        part_top, part_bottom = max(y0, top), min(y1, bottom)
+        start, length = strip.span(part_top, part_bottom)
+        with timer.stage("read"):
+            f.seek(start)
+            data = bytearray(f.read(length))
+        with timer.stage("decode"):
+            part = strip.decode(data, layout.mode, part_bottom - part_top)
+            band.paste(part, (x0 - left, part_top - top))
+        parts.append((strip, part_top, start, data, part))
+    return band, parts
+
+
+def _write_band(f, band, parts, box, timer):
+    """Write a band read by _read_band back over the strips it came from"""
+    left, top = box[:2]
+    for strip, part_top, start, data, part in parts:
+        with timer.stage("encode"):
+            part.paste(band, (left - strip.box[0], top - part_top))
+            strip.encode_into(data, part)
+        with timer.stage("write"):
+            f.seek(start)
+            f.write(data)
+
+
+def _patch_text(f, layout, job, stamp_cache, brightness, info, timer):
+    font_size = font_size_for(layout.size, job.font_percent)
+    with timer.stage("font"):
+        metrics, info["font_cache_hit"] = text_metrics(stamp_cache, job, font_size)
+    info["font_error"] = metrics.font_error
+    origin = text_origin(layout.size, metrics)
+    # The stamp tile and the area auto color measures are both the text box
+    box = clip_box(offset_box(metrics.bbox, origin), layout.size)
+    if box is None:
+        return
+    band, parts = _read_band(f, layout, box, timer)
+
+    band_origin = (origin[0] - box[0], origin[1] - box[1])
+    with timer.stage("brightness"):
+        color, info["brightness"] = choose_color(band, job, metrics, band_origin, brightness)
+    info["color"] = color
+    with timer.stage("render"):
+        stamp, info["stamp_cache_hit"] = stamp_cache.fetch(job.text, job.font_path, font_size, color,
+                                                           job.font_index)
+    with timer.stage("composite"):
+        apply_stamp(band, stamp, (band_origin[0] + stamp.bbox[0], band_origin[1] + stamp.bbox[1]))
+    _write_band(f, band, parts, box, timer)
+
+
+def _patch_logo(f, layout, job, stamp_cache, info, timer):
+    height = font_size_for(layout.size, job.font_percent)
+    with timer.stage("render"):
+        stamp, info["stamp_cache_hit"] = stamp_cache.logo(job.logo_path, height, job.opacity)
+    origin = corner_origin(layout.size, stamp.tile.size)
+    box = clip_box(offset_box((0, 0) + stamp.tile.size, origin), layout.size)
+    if box is None:
+        return
+    band, parts = _read_band(f, layout, box, timer)
+    with timer.stage("composite"):
+        apply_stamp(band, stamp, (origin[0] - box[0], origin[1] - box[1]))
+    _write_band(f, band, parts, box, timer)
@@ -0,0 +1,45 @@
+from PIL import Image
+
+# Levels stop halving once the longest side would drop below this
+MIN_LEVEL_SIDE = 16
+
+
+class LogoPyramid:
+    """A logo decoded once and kept premultiplied at its full size and every half size below.
+
+    Levels are "RGBa", the mode Pillow resamples RGBA images in, so
+    scaling a level skips the round trip through premultiplied alpha and
+    transparent pixels do not bleed their color into the edges. A size is
+    resampled from the smallest level still covering it, at most twice as
+    big, instead of from the full logo.
+    """
+
+    def __init__(self, img):
+        level = img.convert("RGBA").convert("RGBa")
+        self.levels = [level]
+        while max(level.size) // 2 >= MIN_LEVEL_SIDE:
+            level = level.reduce(2)
+            self.levels.append(level)
+
+    @classmethod
+    def open(cls, path):
+        with Image.open(path) as img:
+            return cls(img)
+
+    @property
+    def size(self):
+        return self.levels[0].size
+
+    def size_for(self, height):
+        """Logo size at a height in pixels, keeping the aspect ratio"""
+        width, full_height = self.size
+        return max(1, round(width * height / full_height)), max(1, height)
+
+    def scaled(self, size):
+        """Premultiplied logo at size, from the nearest level at least as big"""
+        level = next((level for level in reversed(self.levels)
+                      if level.width >= size[0] and level.height >= size[1]), self.levels[0])
+        if level.size == size:
+            return level
+        return level.resize(size, Image.LANCZOS)
+
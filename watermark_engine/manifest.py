@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+MANIFEST_NAME = ".wm_manifest.sqlite"
+
+# Bump when a change to the engine alters its output for the same settings
+ENGINE_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    source TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT,
+    fingerprint TEXT NOT NULL,
+    output TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated REAL NOT NULL
+)
+"""
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def settings_fingerprint(job, output=None, renditions=None):
+    """Hash of everything that changes the output of an unchanged source"""
+    data = {"engine": ENGINE_VERSION, "job": job.to_dict(), "output": output.to_dict() if output else None}
+    if renditions:
+        data["renditions"] = [r.to_dict() for r in renditions]
+    if job.font_path and os.path.exists(job.font_path):
+        stat = os.stat(job.font_path)
+        data["font"] = [stat.st_size, stat.st_mtime_ns]
+    encoded = json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class SourceState:
+    """Size, mtime and optionally content hash of a source when it was checked"""
+
+    def __init__(self, size, mtime_ns, content_hash=None):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.content_hash = content_hash
+
+
+class Manifest:
+    """Record of what a batch already produced, kept in SQLite next to the outputs.
+
+    A source is up to date when its size and mtime (or, with use_hash, its
+    content) and the settings fingerprint match the last successful run and
+    the output still exists. Failed or never reached sources have no ok row
+    so an interrupted batch resumes where it stopped.
+    """
+
+    def __init__(self, path, folder, fingerprint, use_hash=False, force=False, commit_every=64):
+        self.path = path
+        self.folder = folder
+        self.fingerprint = fingerprint
+        self.use_hash = use_hash
+        self.force = force
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(SCHEMA)
+        self._db.commit()
+
+    @classmethod
+    def for_batch(cls, folder, job, output=None, output_dir=None, use_hash=False, force=False, renditions=None,
+                  shard=None):
+        """Open the manifest of a batch, stored where its outputs go.
+
+        With force every source is processed again but still recorded. Each
+        shard keeps its own manifest, SQLite cannot be shared by several
+        machines writing over a network share.
+        """
+        location = output_dir or folder
+        os.makedirs(location, exist_ok=True)
+        name = MANIFEST_NAME
+        if shard is not None:
+            root, ext = os.path.splitext(MANIFEST_NAME)
+            name = f"{root}.{shard.label}{ext}"
+        return cls(os.path.join(location, name), folder, settings_fingerprint(job, output, renditions),
+                   use_hash, force)
+
+    def check(self, name):
+        """Return (output, state), output is the existing result when name is up to date, else None"""
+        stat = os.stat(os.path.join(self.folder, name))
+        state = SourceState(stat.st_size, stat.st_mtime_ns)
+        if self.force:
+            return None, state
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, content_hash, fingerprint, output, status FROM images WHERE source = ?",
+                (name,)
+            ).fetchone()
+        if row is None:
+            return None, state
+        size, mtime_ns, content_hash, fingerprint, output, status = row
+        if status != "ok" or fingerprint != self.fingerprint or not output or not os.path.exists(output):
+            return None, state
+        if size == state.size and mtime_ns == state.mtime_ns:
+            state.content_hash = content_hash
+            return output, state
+        if self.use_hash and size == state.size:
+            # Touched but maybe not modified, the contents decide
+            state.content_hash = file_hash(os.path.join(self.folder, name))
+            if state.content_hash == content_hash:
+                self.record(name, state, output)
+                return output, state
+        return None, state
+
+    def record(self, name, state, output=None, error=None):
+        if self.use_hash and state.content_hash is None and error is None:
+            state.content_hash = file_hash(os.path.join(self.folder, name))
+        if output:
+            output = os.path.abspath(output)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, state.size, state.mtime_ns, state.content_hash, self.fingerprint, output,
+                 "error" if error else "ok", error, time.time())
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def flush(self):
+        with self._lock:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
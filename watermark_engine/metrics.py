@@ -0,0 +1,209 @@
+import cProfile
+import csv
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Pipeline stages of one image, in the order they run
+STAGES = ("read", "decode", "resize", "brightness", "font", "render", "composite", "encode", "write")
+
+# Stages waiting on the disk rather than the CPU
+IO_STAGES = ("read", "write")
+
+
+class StageTimer:
+    """Seconds spent in each stage of one image.
+
+    Stages may nest: time already added to an inner stage while an outer
+    one runs, such as the reads made while decoding, is not counted again
+    in the outer stage.
+    """
+
+    def __init__(self, times=None):
+        # Continue the times of earlier stages, e.g. measured in another process
+        self.times = times if times is not None else {}
+        self._attributed = 0.0
+
+    def add(self, name, seconds):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self._attributed += seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        attributed = self._attributed
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start - (self._attributed - attributed))
+
+
+class _NullTimer:
+    @contextmanager
+    def stage(self, name):
+        yield
+
+
+NULL_TIMER = _NullTimer()
+
+
+class TimedFile:
+    """File object wrapper charging read() to the read stage and write() to the write stage.
+
+    fileno() is deliberately not exposed so Pillow goes through write()
+    instead of handing the descriptor to the encoder.
+    """
+
+    def __init__(self, f, timer):
+        self._f = f
+        self._timer = timer
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def read(self, size=-1):
+        with self._timer.stage("read"):
+            data = self._f.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self, size=-1):
+        with self._timer.stage("read"):
+            data = self._f.readline(size)
+        self.bytes_read += len(data)
+        return data
+
+    def write(self, data):
+        with self._timer.stage("write"):
+            written = self._f.write(data)
+        self.bytes_written += len(data)
+        return written
+
+    def seek(self, offset, whence=0):
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    def flush(self):
+        with self._timer.stage("write"):
+            self._f.flush()
+
+
+class JobReport:
+    """Per-image and aggregate metrics of a batch.
+
+    Results are added as they come in, with the stage timings, byte counts
+    and pixel count process_image stored in ImageResult.metrics. Stage
+    seconds are summed over every worker, so with a process pool they add
+    up to more than the wall time. io_share is the part of that busy time
+    spent in read and write, above one half the batch is I/O-bound.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.wall_seconds = None
+
+    @classmethod
+    def from_dicts(cls, reports):
+        """One report of several written by to_dict(), such as the shards of a batch, from first start to last end"""
+        merged = cls()
+        for data in reports:
+            merged.rows.extend(data["images"])
+        if reports:
+            merged.started = min(data["summary"]["started"] for data in reports)
+            merged.wall_seconds = max(data["summary"]["started"] + data["summary"]["wall_seconds"]
+                                      for data in reports) - merged.started
+        return merged
+
+    def add(self, result):
+        metrics = result.metrics or {}
+        row = {"name": result.name, "status": "skipped" if result.skipped else "ok" if result.ok else "error",
+               "error": result.error, "output": result.output, "pixels": metrics.get("pixels", 0),
+               "bytes_in": metrics.get("bytes_in", 0), "bytes_out": metrics.get("bytes_out", 0)}
+        times = metrics.get("times", {})
+        for stage in STAGES:
+            row[stage] = times.get(stage, 0.0)
+        self.rows.append(row)
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self._start
+
+    def summary(self):
+        wall = self.wall_seconds if self.wall_seconds is not None else time.perf_counter() - self._start
+        stage_seconds = {stage: sum(row[stage] for row in self.rows) for stage in STAGES}
+        busy = sum(stage_seconds.values())
+        processed = [row for row in self.rows if row["status"] == "ok"]
+        bytes_in = sum(row["bytes_in"] for row in self.rows)
+        io_share = sum(stage_seconds[stage] for stage in IO_STAGES) / busy if busy else 0.0
+        return {
+            "started": self.started,
+            "wall_seconds": wall,
+            "busy_seconds": busy,
+            "images": len(self.rows),
+            "processed": len(processed),
+            "skipped": sum(1 for row in self.rows if row["status"] == "skipped"),
+            "failed": sum(1 for row in self.rows if row["status"] == "error"),
+            "pixels": sum(row["pixels"] for row in self.rows),
+            "bytes_in": bytes_in,
+            "bytes_out": sum(row["bytes_out"] for row in self.rows),
+            "images_per_sec": len(processed) / wall if wall else 0.0,
+            "mb_per_sec": bytes_in / 1e6 / wall if wall else 0.0,
+            "stage_seconds": stage_seconds,
+            "io_share": io_share,
+            "bound": "io" if io_share > 0.5 else "cpu",
+        }
+
+    def to_dict(self):
+        return {"summary": self.summary(), "images": self.rows}
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_csv(self, path):
+        """One row per image, the summary is left to the JSON report"""
+        fields = ["name", "status", "error", "output", "pixels", "bytes_in", "bytes_out"] + list(STAGES)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def write(self, path):
+        """Write a CSV report for a .csv path and a JSON report otherwise"""
+        if path.lower().endswith(".csv"):
+            self.write_csv(path)
+        else:
+            self.write_json(path)
+
+
+@contextmanager
+def profiling(cprofile_path=None, tracemalloc_top=0, out=None):
+    """Optionally run the enclosed code under cProfile and/or tracemalloc.
+
+    cProfile stats are dumped to cprofile_path (read them with pstats or
+    snakeviz), tracemalloc prints the peak traced memory and the
+    tracemalloc_top biggest allocation sites to out. tracemalloc only sees
+    Python allocations, not Pillow's pixel buffers. Both only cover the
+    current process, use a single worker to profile the image pipeline.
+    """
+    profiler = cProfile.Profile() if cprofile_path else None
+    if tracemalloc_top:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+        if tracemalloc_top:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"tracemalloc peak: {peak / 1e6:.1f} MB", file=out)
+            for stat in snapshot.statistics("lineno")[:tracemalloc_top]:
+                print(f"  {stat}", file=out)
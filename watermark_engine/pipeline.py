@@ -0,0 +1,149 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+READ, COMPUTE, WRITE, FINISHED, DROPPED = range(5)
+
+_END = object()
+
+
+class PipelineOptions:
+    """Queue depths of the read-ahead, compute and write-behind stages.
+
+    read_ahead is the number of files read (or being read) ahead of the
+    compute stage, compute_depth the number handed to the workers at once
+    (default two per worker) and write_behind the number of finished
+    images whose write may still be pending. io_threads read and write.
+    """
+
+    def __init__(self, read_ahead=8, compute_depth=None, write_behind=8, io_threads=4):
+        self.read_ahead = max(1, read_ahead)
+        self.compute_depth = compute_depth
+        self.write_behind = max(1, write_behind)
+        self.io_threads = max(1, io_threads)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class Done:
+    """An entry or stage value that needs no further stage, value is the final outcome"""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class _Item:
+    __slots__ = ("entry", "stage", "future", "value", "error")
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.stage = READ
+        self.future = None
+        self.value = None
+        self.error = None
+
+    def finish(self, value=None, error=None):
+        self.stage = FINISHED
+        self.future = None
+        self.value = value
+        self.error = error
+
+
+def _inline(fn, value):
+    """Run fn now and wrap the outcome in a finished Future"""
+    future = Future()
+    try:
+        future.set_result(fn(value))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def pipelined(entries, read, compute, write, options=None, pool=None, workers=1, should_continue=None):
+    """Run every entry through read -> compute -> write with bounded overlap.
+
+    read and write run on a thread pool so file and network latency overlap
+    with the compute stage, which runs on pool (a process pool) or inline
+    in this thread when pool is None. Each stage gets the value returned by
+    the previous one. An entry given as Done, or a stage returning Done,
+    skips the remaining stages. Yields (entry, value, error) in entry
+    order, error being the exception of the stage that failed. Once
+    should_continue() returns False no entry is started and everything not
+    yet writing is dropped, writes in progress still complete.
+    """
+    options = options or PipelineOptions()
+    limits = {READ: options.read_ahead, COMPUTE: options.compute_depth or max(1, workers) * 2,
+              WRITE: options.write_behind}
+    counts = {READ: 0, COMPUTE: 0, WRITE: 0}
+    # Finished items wait for the ones before them, this caps how far ahead they get
+    max_inflight = 2 * sum(limits.values())
+    entries = iter(entries)
+    inflight = deque()
+    exhausted = cancelled = False
+    with ThreadPoolExecutor(max_workers=options.io_threads) as io:
+        submit = {READ: io.submit, COMPUTE: pool.submit if pool is not None else _inline, WRITE: io.submit}
+        functions = {READ: read, COMPUTE: compute, WRITE: write}
+        while True:
+            progressed = False
+            if not cancelled and should_continue is not None and not should_continue():
+                cancelled = True
+                for item in inflight:
+                    if item.stage in (READ, COMPUTE):
+                        item.future.cancel()
+                        counts[item.stage] -= 1
+                        item.stage = DROPPED
+
+            while not exhausted and not cancelled and counts[READ] < limits[READ] \
+                    and len(inflight) < max_inflight:
+                entry = next(entries, _END)
+                if entry is _END:
+                    exhausted = True
+                    break
+                item = _Item(entry)
+                if isinstance(entry, Done):
+                    item.finish(entry.value)
+                else:
+                    item.future = io.submit(read, entry)
+                    counts[READ] += 1
+                inflight.append(item)
+                progressed = True
+
+            for item in inflight:
+                if item.stage not in (READ, COMPUTE, WRITE) or not item.future.done():
+                    continue
+                next_stage = item.stage + 1
+                if next_stage != FINISHED and counts[next_stage] >= limits[next_stage]:
+                    continue
+                counts[item.stage] -= 1
+                progressed = True
+                try:
+                    value = item.future.result()
+                except Exception as e:
+                    item.finish(error=e)
+                    continue
+                if next_stage == FINISHED or isinstance(value, Done):
+                    item.finish(value.value if isinstance(value, Done) else value)
+                    continue
+                item.stage = next_stage
+                item.future = submit[next_stage](functions[next_stage], value)
+                counts[next_stage] += 1
+
+            while inflight and inflight[0].stage in (FINISHED, DROPPED):
+                item = inflight.popleft()
+                progressed = True
+                if item.stage == FINISHED:
+                    yield item.entry, item.value, item.error
+
+            if not inflight and (exhausted or cancelled):
+                return
+            if not progressed:
+                # A finished future stuck behind a full stage would make wait() return at once and spin, so only
+                # wait on running ones, and only on those that could move on, the stage holding up the others
+                running = [item for item in inflight if item.stage in (READ, COMPUTE, WRITE) and not item.future.done()]
+                movable = [item.future for item in running
+                           if item.stage == WRITE or counts[item.stage + 1] < limits[item.stage + 1]]
+                wait(movable or [item.future for item in running], return_when=FIRST_COMPLETED)
@@ -0,0 +1,156 @@
+import os
+import threading
+
+from PIL import Image
+
+from .cache import LRUCache
+from .decode import load_proxy, open_image
+from .render import MARGIN, apply_pattern, apply_stamp, choose_color, font_size_for, render, text_origin
+from .renditions import REDUCING_GAP
+from .sources import iter_images
+from .stamps import Stamp, TextMetrics, default_stamp_cache
+
+# Long side of the proxy previews are rendered on
+PREVIEW_SIDE = 1024
+
+# The text is rasterized at most this many times the size it shows at, past that resampling hides any difference
+SUPERSAMPLE = 4
+
+
+def _scale_box(box, scale):
+    return tuple(round(v * scale) for v in box)
+
+
+def render_preview(img, full_size, job, stamp_cache=None, brightness=None):
+    """Draw the watermark of a job on a reduced copy of an image as it comes out at full_size.
+
+    render() sizes the watermark for the image it is given, so a proxy
+    would get a font a few pixels high, hinted differently, with a full
+    size margin. Here the text is laid out for full_size, rasterized at up
+    to SUPERSAMPLE times the proxy scale and resampled to the box the full
+    size text covers. Tiled patterns and logos are drawn at the scaled font
+    size instead, the pattern would not tile once resampled. Returns the
+    info dict of render().
+    """
+    scale = img.width / full_size[0]
+    if scale >= 1:
+        return render(img, job, stamp_cache, brightness)
+    stamp_cache = stamp_cache or default_stamp_cache
+    info = {"brightness": None, "color": None, "font_error": None, "font_cache_hit": None,
+            "stamp_cache_hit": None}
+    font_size = font_size_for(full_size, job.font_percent)
+    scaled_size = max(1, round(font_size * scale))
+    if job.logo_path:
+        stamp, info["stamp_cache_hit"] = stamp_cache.logo(job.logo_path, scaled_size, job.opacity)
+        right, bottom = round((full_size[0] - MARGIN) * scale), round((full_size[1] - MARGIN) * scale)
+        apply_stamp(img, stamp, (right - stamp.tile.width, bottom - stamp.tile.height))
+        return info
+    if not job.text:
+        info["color"], info["brightness"] = choose_color(img, job, brightness=brightness)
+        return info
+
+    if job.layout == "tiled":
+        color, info["brightness"] = choose_color(img, job, brightness=brightness)
+        info["color"] = color
+        pattern, info["stamp_cache_hit"] = stamp_cache.pattern(job.text, job.font_path, scaled_size, color,
+                                                               job.angle, job.spacing, job.font_index)
+        apply_pattern(img, pattern)
+        return info
+
+    metrics, _ = stamp_cache.metrics(job.text, job.font_path, font_size, job.font_index)
+    info["font_error"] = metrics.font_error
+    origin = text_origin(full_size, metrics)
+    # Auto color measures the proxy under where the full size text lands
+    glyph_boxes = [_scale_box(box, scale) for box in metrics.glyph_boxes] if metrics.glyph_boxes else None
+    scaled = TextMetrics(_scale_box(metrics.bbox, scale), glyph_boxes)
+    scaled_origin = (round(origin[0] * scale), round(origin[1] * scale))
+    color, info["brightness"] = choose_color(img, job, scaled, scaled_origin, brightness)
+    info["color"] = color
+    raster_size = min(font_size, SUPERSAMPLE * scaled_size)
+    stamp, info["stamp_cache_hit"] = stamp_cache.fetch(job.text, job.font_path, raster_size, color, job.font_index)
+    width, height = metrics.text_size
+    tile = stamp.tile.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS,
+                             reducing_gap=REDUCING_GAP)
+    dest = (round((origin[0] + metrics.bbox[0]) * scale), round((origin[1] + metrics.bbox[1]) * scale))
+    apply_stamp(img, Stamp(tile, metrics.bbox), dest)
+    return info
+
+
+class PreviewRenderer:
+    """Renders watermark previews of sample images on a background thread.
+
+    Each sample is decoded once into a proxy of at most max_side pixels
+    (see decode.load_proxy, JPEGs are drafted) and kept, so a preview only
+    copies the proxy and draws the watermark. Requests replace each other
+    until the thread picks the latest, and a result is dropped when a newer
+    request came in while it rendered. on_result(image, info, error) is
+    called from the thread, image fitted within the size given to request,
+    or None when there is no image to preview. Looking for a sample in a
+    folder, which may be large or on a network share, happens on the
+    thread too, files starting with skip_prefixes are passed over.
+    """
+
+    def __init__(self, on_result, max_side=PREVIEW_SIDE, stamp_cache=None, skip_prefixes=()):
+        self.on_result = on_result
+        self.max_side = max_side
+        self.stamp_cache = stamp_cache or default_stamp_cache
+        self.skip_prefixes = skip_prefixes
+        self._proxies = LRUCache(4)
+        self._samples = LRUCache(8)
+        self._cond = threading.Condition()
+        self._pending = None
+        self._thread = None
+
+    def proxy(self, path):
+        """(proxy, full_size) of a sample, decoded again when the file changed"""
+        key = (path, os.path.getmtime(path))
+        return self._proxies.fetch(key, lambda: self._load(path))[0]
+
+    def _load(self, path):
+        with open_image(path) as img:
+            return load_proxy(img, self.max_side)
+
+    def sample(self, path, folder=None):
+        """Image to preview: path when it is a file, else the first image of folder, None without one"""
+        if path and os.path.isfile(path):
+            return path
+        if not folder or not os.path.isdir(folder):
+            return None
+        # Adding or removing files changes the mtime of the folder, and so the first image
+        key = (folder, os.path.getmtime(folder))
+        first = self._samples.fetch(key, lambda: next(iter_images(folder, skip_prefixes=self.skip_prefixes), None))[0]
+        return os.path.join(folder, first) if first else None
+
+    def request(self, path, job, fit=None, folder=None):
+        """Preview job on path, or on the first image of folder when path is not a file"""
+        with self._cond:
+            self._pending = (path, folder, job, fit)
+            self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                path, folder, job, fit = self._pending
+                self._pending = None
+            try:
+                path = self.sample(path, folder)
+                if path is None:
+                    result = (None, None, None)
+                else:
+                    proxy, full_size = self.proxy(path)
+                    img = proxy.copy()
+                    info = render_preview(img, full_size, job, self.stamp_cache)
+                    if fit:
+                        img.thumbnail(fit)
+                    result = (img, info, None)
+            except Exception as e:
+                result = (None, None, e)
+            with self._cond:
+                stale = self._pending is not None
+            if not stale:
+                self.on_result(*result)
@@ -0,0 +1,180 @@
+from .brightness import LIGHT_THRESHOLD, estimate_brightness
+from .decode import draft_reduced, load_proxy, open_image
+from .fonts import load_font
+from .metrics import NULL_TIMER
+from .stamps import default_stamp_cache
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+MARGIN = 20
+
+
+def font_size_for(size, font_percent):
+    """Pixel font size for an image, relative to its mean side length, at least 1 for tiny images"""
+    width, height = size
+    return max(1, int((width + height) / 2 * font_percent / 100))
+
+
+def contrast_color(brightness, opacity):
+    if brightness is not None and brightness > LIGHT_THRESHOLD:  # Light background
+        return BLACK + (opacity,)
+    return WHITE + (opacity,)
+
+
+def corner_origin(img_size, size):
+    """Where a watermark of size is drawn: bottom right corner with margin"""
+    width, height = img_size
+    return width - size[0] - MARGIN, height - size[1] - MARGIN
+
+
+def text_origin(img_size, metrics):
+    return corner_origin(img_size, metrics.text_size)
+
+
+def offset_box(box, origin):
+    return (box[0] + origin[0], box[1] + origin[1], box[2] + origin[0], box[3] + origin[1])
+
+
+def choose_color(img, job, metrics=None, origin=None, brightness=None):
+    """Pick the watermark color for an image, returns (color, brightness).
+
+    With color_mode "region" only the area the text covers is measured and
+    with "glyph" every character gets its own color, returned as a tuple
+    of colors. Both fall back to the whole image when there is no text.
+    A whole image brightness measured beforehand (on a reduced decode, see
+    probe_brightness) can be passed in to skip measuring img.
+    """
+    if not job.auto_color:
+        return WHITE + (job.opacity,), None
+    if metrics is None or job.color_mode == "image":
+        if brightness is None:
+            brightness = estimate_brightness(img, max_side=256)
+        return contrast_color(brightness, job.opacity), brightness
+
+    brightness = estimate_brightness(img, offset_box(metrics.bbox, origin))
+    if job.color_mode == "glyph" and metrics.glyph_boxes:
+        colors = []
+        for box in metrics.glyph_boxes:
+            glyph_brightness = estimate_brightness(img, offset_box(box, origin), max_side=16)
+            colors.append(contrast_color(glyph_brightness if glyph_brightness is not None else brightness,
+                                         job.opacity))
+        return tuple(colors), brightness
+    return contrast_color(brightness, job.opacity), brightness
+
+
+def apply_stamp(img, stamp, dest):
+    """Blend a stamp tile at dest, clipped to the image.
+
+    RGBA images are alpha composited, opaque RGB and L images get the tile
+    pasted through its alpha channel, which is the same blend without
+    converting the whole frame to RGBA.
+    """
+    width, height = img.size
+    tile_width, tile_height = stamp.tile.size
+    left, top = max(dest[0], 0), max(dest[1], 0)
+    right, bottom = min(dest[0] + tile_width, width), min(dest[1] + tile_height, height)
+    if right <= left or bottom <= top:
+        return
+    source = (left - dest[0], top - dest[1], right - dest[0], bottom - dest[1])
+    if img.mode == "RGBA":
+        img.alpha_composite(stamp.tile, dest=(left, top), source=source)
+        return
+    tile = stamp.tile.crop(source)
+    img.paste(tile.convert(img.mode), (left, top), tile.getchannel("A"))
+
+
+def apply_pattern(img, pattern):
+    """Repeat a pattern tile over the whole image, every pixel is blended once"""
+    tile_width, tile_height = pattern.tile.size
+    if img.mode != "RGBA":
+        colors, mask = pattern.layer(img.mode)
+    for y in range(0, img.height, tile_height):
+        for x in range(0, img.width, tile_width):
+            if img.mode == "RGBA":
+                img.alpha_composite(pattern.tile, (x, y),
+                                    (0, 0, min(tile_width, img.width - x), min(tile_height, img.height - y)))
+            else:
+                # paste() clips the tiles of the last row and column
+                img.paste(colors, (x, y), mask)
+
+
+def probe_brightness(source, max_side=256):
+    """Whole image brightness measured on a reduced decode of a file.
+
+    None when the format cannot decode at reduced scale, the brightness is
+    then measured on the full decode made for rendering rather than on a
+    second one.
+    """
+    with open_image(source) as img:
+        if not draft_reduced(img, max_side):
+            return None
+        proxy = load_proxy(img, max_side)[0]
+        return estimate_brightness(proxy, max_side=max_side)
+
+
+def text_metrics(stamp_cache, job, font_size):
+    """(metrics, font_cache_hit) of the job text, font_cache_hit None for the default font.
+
+    Cached metrics were measured with a font loaded earlier, the font cache
+    is still asked so every image counts as a font cache hit or miss.
+    """
+    metrics, metrics_hit = stamp_cache.metrics(job.text, job.font_path, font_size, job.font_index)
+    if not metrics_hit or metrics.font_error is not None or job.font_path is None:
+        return metrics, metrics.font_cache_hit
+    return metrics, load_font(job.font_path, font_size, index=job.font_index)[1]
+
+
+def render(img, job, stamp_cache=None, brightness=None, timer=None):
+    """Draw the watermark of a job onto an RGBA, RGB or L image in place.
+
+    Returns a dict describing what was done (brightness, color, font_error,
+    font_cache_hit, stamp_cache_hit) so callers can report it without the
+    engine knowing about any UI. A StageTimer passed as timer receives the
+    brightness, font, render and composite times. With the tiled layout
+    the text is repeated over the whole image from a cached Pattern and
+    auto color measures the whole image. A logo is drawn in its own colors
+    instead of the text.
+    """
+    timer = timer or NULL_TIMER
+    info = {"brightness": None, "color": None, "font_error": None, "font_cache_hit": None,
+            "stamp_cache_hit": None}
+    stamp_cache = stamp_cache or default_stamp_cache
+    font_size = font_size_for(img.size, job.font_percent)
+    if job.logo_path:
+        with timer.stage("render"):
+            stamp, info["stamp_cache_hit"] = stamp_cache.logo(job.logo_path, font_size, job.opacity)
+        with timer.stage("composite"):
+            apply_stamp(img, stamp, corner_origin(img.size, stamp.tile.size))
+        return info
+
+    if not job.text:
+        with timer.stage("brightness"):
+            info["color"], info["brightness"] = choose_color(img, job, brightness=brightness)
+        return info
+
+    with timer.stage("font"):
+        metrics, info["font_cache_hit"] = text_metrics(stamp_cache, job, font_size)
+    info["font_error"] = metrics.font_error
+
+    if job.layout == "tiled":
+        # The text covers the whole image, so does what auto color measures
+        with timer.stage("brightness"):
+            color, info["brightness"] = choose_color(img, job, brightness=brightness)
+        info["color"] = color
+        with timer.stage("render"):
+            pattern, info["stamp_cache_hit"] = stamp_cache.pattern(job.text, job.font_path, font_size, color,
+                                                                   job.angle, job.spacing, job.font_index)
+        with timer.stage("composite"):
+            apply_pattern(img, pattern)
+        return info
+
+    origin = text_origin(img.size, metrics)
+    with timer.stage("brightness"):
+        color, info["brightness"] = choose_color(img, job, metrics, origin, brightness)
+    info["color"] = color
+    with timer.stage("render"):
+        stamp, info["stamp_cache_hit"] = stamp_cache.fetch(job.text, job.font_path, font_size, color,
+                                                           job.font_index)
+    with timer.stage("composite"):
+        apply_stamp(img, stamp, (origin[0] + stamp.bbox[0], origin[1] + stamp.bbox[1]))
+    return info
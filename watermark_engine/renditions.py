@@ -0,0 +1,142 @@
+import json
+import os
+
+from PIL import Image
+
+from .encode import OutputOptions
+from .job import WatermarkJob
+from .metrics import NULL_TIMER
+from .render import render
+
+# Rendition keys that override the watermark job, the others are output options
+JOB_KEYS = ("text", "font_percent", "opacity", "auto_color", "color_mode", "layout", "angle", "spacing",
+            "logo_path")
+
+# Resize in two steps, a fast integer reduce() then a filter on at most 3x the target
+REDUCING_GAP = 3.0
+
+
+class Rendition:
+    """One output of a source: a size, an encoding and watermark overrides.
+
+    name is appended to the output file names (photo_web.jpg), an empty
+    name keeps them unchanged. size is the longest side in pixels, None
+    keeps the source size and images are never enlarged. job and output
+    hold the WatermarkJob fields and OutputOptions (plus preset and
+    quality) that differ from the batch settings.
+    """
+
+    def __init__(self, name="", size=None, job=None, output=None):
+        self.name = name
+        self.size = size
+        self.job = dict(job or {})
+        self.output = dict(output or {})
+        # Fail on a bad spec before the batch starts
+        self.output_for(OutputOptions())
+        self.job_for(WatermarkJob(""))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rendition from a flat dict such as {"name": "web", "size": 1600, "format": "webp", "opacity": 120}"""
+        data = dict(data)
+        name = data.pop("name", "")
+        size = data.pop("size", None)
+        job = {key: data.pop(key) for key in JOB_KEYS if key in data}
+        return cls(name, int(size) if size else None, job, data)
+
+    def to_dict(self):
+        data = {"name": self.name, "size": self.size}
+        data.update(self.job)
+        data.update(self.output)
+        return data
+
+    def job_for(self, job):
+        if not self.job:
+            return job
+        data = job.to_dict()
+        data.update(self.job)
+        return WatermarkJob.from_dict(data)
+
+    def output_for(self, output):
+        if not self.output:
+            return output
+        data = dict(self.output)
+        preset = data.pop("preset", None)
+        quality = data.pop("quality", None)
+        if quality is not None:
+            data.update(jpeg_quality=quality, webp_quality=quality, avif_quality=quality)
+        try:
+            if preset is not None:
+                # A preset replaces the encoder settings but not the format or metadata policy
+                base = {"format": output.format, "keep_metadata": output.keep_metadata}
+                base.update(data)
+                return OutputOptions.from_preset(preset, **base)
+            base = output.to_dict()
+            base.update(data)
+            return OutputOptions(**base)
+        except TypeError as e:
+            raise ValueError(f"invalid rendition {self.name!r}: {e}")
+
+    def target_size(self, size):
+        """Pixel size of this rendition for a source of the given size"""
+        width, height = size
+        if self.size is None or self.size >= max(width, height):
+            return size
+        scale = self.size / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def load_renditions(path):
+    """Read a rendition spec, a JSON list of Rendition.from_dict dicts"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, list) or not data:
+        raise ValueError("a rendition spec is a non-empty JSON list")
+    return check_renditions([Rendition.from_dict(item) for item in data])
+
+
+def check_renditions(renditions):
+    """Return renditions, raising ValueError when two share a name and would write the same files"""
+    seen = set()
+    for rendition in renditions:
+        if rendition.name in seen:
+            label = repr(rendition.name) if rendition.name else "with no name"
+            raise ValueError(f"more than one rendition {label}, their outputs would overwrite each other")
+        seen.add(rendition.name)
+    return renditions
+
+
+def rendition_name(name, rendition):
+    """Source name with the rendition name appended before the extension"""
+    if not rendition.name:
+        return name
+    root, ext = os.path.splitext(name)
+    return f"{root}_{rendition.name}{ext}"
+
+
+def largest_size(renditions, size):
+    """Largest rendition size for a source of the given size, to draft the decode to"""
+    return max((r.target_size(size) for r in renditions), key=lambda s: s[0] * s[1])
+
+
+def render_renditions(img, full_size, job, renditions, brightness=None, timer=None):
+    """Yield (rendition, image, info) for every rendition of a decoded image, largest first.
+
+    Each size is resized from the previous, unwatermarked, one rather than
+    from the source, and the watermark is drawn after resizing so it stays
+    sharp and is sized for the rendition by font_percent. img may have
+    been drafted down from full_size, the size rendition sizes are relative
+    to. It is used as the largest rendition when it is that size.
+    """
+    timer = timer or NULL_TIMER
+    ordered = sorted(renditions, key=lambda r: r.target_size(full_size), reverse=True)
+    base = img
+    for i, rendition in enumerate(ordered):
+        size = rendition.target_size(full_size)
+        if base.size != size:
+            with timer.stage("resize"):
+                base = base.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+        # The next rendition is resized from base, so it must stay clean
+        out = base.copy() if i < len(ordered) - 1 else base
+        info = render(out, rendition.job_for(job), brightness=brightness, timer=timer)
+        yield rendition, out, info
@@ -0,0 +1,152 @@
+import os
+import time
+
+from .decode import open_image, render_mode
+from .large import large_layout
+from .render import font_size_for
+
+# Times the oldest waiting image may be passed over by smaller ones before it gets the next free memory
+MAX_SKIPS = 32
+
+
+def estimate_cost(path, job, output, memory_budget=None, renditions=None):
+    """(pixels, bytes) a worker needs to watermark path, from its header only.
+
+    The cost is the decoded frame, plus the source frame when its mode has
+    to be converted, plus the file itself which may be held while it is
+    read or encoded, plus the renditions resized from the frame. Images
+    patched in place (see large.patch_large) only cost a band as wide as
+    the image and twice as high as the text. Unreadable files cost
+    nothing, processing reports the error.
+    """
+    try:
+        size = os.path.getsize(path)
+        with open_image(path) as img:
+            fmt = output.format_for(img.format)
+            pixels = img.width * img.height
+            mode = render_mode(img)
+            if not renditions and large_layout(img, job, fmt, output, memory_budget) is not None:
+                band = 2 * font_size_for(img.size, job.font_percent) * img.width
+                return pixels, band * len(mode)
+            cost = pixels * len(mode) + size
+            if img.mode != mode:
+                cost += pixels * len(img.getbands())
+            for rendition in renditions or ():
+                width, height = rendition.target_size(img.size)
+                cost += width * height * len(mode)
+            return pixels, cost
+    except (OSError, ValueError, SyntaxError):
+        return 0, 0
+
+
+class Task:
+    """An image waiting for or holding part of the memory budget"""
+
+    __slots__ = ("name", "state", "pixels", "cost", "skipped")
+
+    def __init__(self, name, state, pixels, cost):
+        self.name = name
+        self.state = state
+        self.pixels = pixels
+        self.cost = cost
+        self.skipped = 0
+
+
+class MemoryScheduler:
+    """Admits images to the workers against a memory budget shared by all of them.
+
+    Waiting images are picked largest first among those that fit in the
+    memory left, so a large image runs next to small ones instead of next
+    to other large ones, and small images fill what large ones leave free.
+    An image bigger than the whole budget runs alone. The oldest waiting
+    image is passed over at most MAX_SKIPS times, then nothing else starts
+    until it fits, so large images are not starved by a stream of small
+    ones.
+    """
+
+    def __init__(self, budget, workers=1):
+        self.budget = budget
+        self.workers = workers
+        self.in_use = 0
+        self.running = 0
+
+    def pick(self, waiting):
+        """Remove and return the next task of waiting (a deque) to start, or None to wait"""
+        if not waiting or self.running >= self.workers:
+            return None
+        free = self.budget - self.in_use
+        head = waiting[0]
+        if self.workers == 1 or head.skipped >= MAX_SKIPS:
+            task = head if head.cost <= free or not self.running else None
+        else:
+            fitting = [t for t in waiting if t.cost <= free]
+            if fitting:
+                task = max(fitting, key=lambda t: t.cost)
+            else:
+                task = head if not self.running else None
+        if task is None:
+            return None
+        waiting.remove(task)
+        if task is not head:
+            head.skipped += 1
+        self.in_use += task.cost
+        self.running += 1
+        return task
+
+    def release(self, task):
+        self.in_use -= task.cost
+        self.running -= 1
+
+
+class PixelProgress:
+    """Batch progress and ETA weighted by pixels rather than by image count.
+
+    expect() is called as image headers are read and advance() as images
+    finish. Images not looked at yet are assumed to be as large as the
+    average of those that were, given how many images the source holds.
+    """
+
+    def __init__(self):
+        self.expected_pixels = 0
+        self.expected_images = 0
+        self.done_pixels = 0
+        self.done_images = 0
+        self._start = time.perf_counter()
+
+    def expect(self, pixels):
+        self.expected_pixels += pixels
+        self.expected_images += 1
+
+    def advance(self, pixels):
+        self.done_pixels += pixels
+        self.done_images += 1
+
+    def total_pixels(self, total_images=None):
+        """Estimated pixels of the whole batch"""
+        unseen = (total_images or 0) - self.expected_images
+        if unseen > 0 and self.expected_images:
+            return self.expected_pixels + unseen * self.expected_pixels / self.expected_images
+        return self.expected_pixels
+
+    def fraction(self, total_images=None):
+        total = self.total_pixels(total_images)
+        if not total:
+            return self.done_images / total_images if total_images else 0.0
+        return min(self.done_pixels / total, 1.0)
+
+    def eta(self, total_images=None):
+        """Seconds left at the pixel rate so far, None until something finished"""
+        elapsed = time.perf_counter() - self._start
+        if not self.done_pixels or not elapsed:
+            return None
+        left = self.total_pixels(total_images) - self.done_pixels
+        return max(left, 0) / (self.done_pixels / elapsed)
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
@@ -0,0 +1,355 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+from .batch import resolve_workers, watermark_bytes
+from .encode import OutputOptions
+from .fonts import load_font
+from .job import WatermarkJob
+
+MAX_HEADER_BYTES = 64 * 1024
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, target, version, headers, body):
+        self.method = method
+        url = urlsplit(target)
+        self.path = url.path
+        # Last value wins when a parameter is repeated
+        self.params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+def _warm_worker(font_path, font_index):
+    """Pool initializer: read the default font once so the first request does not pay for it"""
+    if font_path:
+        load_font(font_path, 12, index=font_index)
+
+
+def _watermark_file(path, job, output):
+    with open(path, "rb") as f:
+        data = f.read()
+    return watermark_bytes(data, job, output)
+
+
+def _int_param(params, name, default):
+    try:
+        return int(params[name]) if name in params else default
+    except ValueError:
+        raise HTTPError(400, f"{name} must be an integer")
+
+
+class WatermarkServer:
+    """Long-running watermarking service over HTTP/1.1 with keep-alive.
+
+    POST /watermark with the image as the request body, or with a path
+    parameter naming a file under one of allowed_roots, answers with the
+    watermarked image. Query parameters override the default job and
+    output options: text, font (a font catalog name), font_percent,
+    opacity, auto_color, color_mode, layout, angle, spacing, format,
+    preset and quality. A logo can only be set when starting the service,
+    requests cannot point at files. GET /health reports the load.
+
+    Images are processed by a pool of worker processes that stay up, so
+    fonts and rendered stamps remain cached between requests. At most
+    workers + queue_limit requests are admitted at a time, uploads still
+    being read included, the next ones get 503 with Retry-After instead of
+    piling up in memory. Every request gets a response, errors nobody
+    expected included (500).
+    """
+
+    def __init__(self, job, output=None, host="127.0.0.1", port=8765, workers=0, queue_limit=None,
+                 max_body=256 * 1024 * 1024, allowed_roots=(), catalog=None, keepalive_timeout=15):
+        self.job = job
+        self.output = output or OutputOptions()
+        self.host = host
+        self.port = port
+        self.workers = resolve_workers(workers)
+        self.queue_limit = self.workers * 4 if queue_limit is None else queue_limit
+        self.max_body = max_body
+        self.allowed_roots = [os.path.realpath(root) for root in allowed_roots]
+        self.catalog = catalog
+        self.keepalive_timeout = keepalive_timeout
+        self.in_flight = 0
+        self.receiving = 0
+        self.served = 0
+        self.rejected = 0
+        self._pool = None
+        self._server = None
+
+    async def start(self):
+        # Fills Image.MIME for the Content-Type of the responses
+        Image.init()
+        self._pool = self._new_pool()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES)
+        # Port 0 picks a free port, report the real one
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            self.close()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker,
+                                   initargs=(self.job.font_path, self.job.font_index))
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader, writer)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except HTTPError as e:
+                    # The body was not read, the rest of the stream cannot be used
+                    await self._respond(writer, *_error_response(e), keep_alive=False)
+                    return
+                if request is None:
+                    return
+                try:
+                    status, headers, body = await self._dispatch(request)
+                except HTTPError as e:
+                    status, headers, body = _error_response(e)
+                except Exception as e:
+                    # Still answer, but do not trust the rest of the connection
+                    error = HTTPError(500, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+                    await self._respond(writer, *_error_response(error), keep_alive=False)
+                    return
+                await self._respond(writer, status, headers, body, request.keep_alive)
+                if not request.keep_alive:
+                    return
+        except ConnectionError:
+            return
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        """Parse one request, None when the client closed the connection between requests"""
+        try:
+            # Idle keep-alive connections are dropped after keepalive_timeout
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepalive_timeout)
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431)
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        upload = method == "POST"
+        if upload:
+            if self.is_full():
+                # Refuse before the upload is read rather than after
+                self.rejected += 1
+                raise HTTPError(503, "too many requests in progress")
+            # Each upload may buffer up to max_body, so it holds a slot while it is read
+            self.receiving += 1
+        try:
+            if headers.get("expect", "").lower() == "100-continue":
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            if headers.get("transfer-encoding", "").lower() == "chunked":
+                body = await self._read_chunked(reader)
+            else:
+                # Digits only, int() would also take a sign, spaces or underscores
+                value = headers.get("content-length", "0")
+                if not (value.isascii() and value.isdigit()):
+                    raise HTTPError(400, "invalid Content-Length")
+                length = int(value)
+                if length > self.max_body:
+                    raise HTTPError(413)
+                body = await reader.readexactly(length) if length else b""
+        finally:
+            if upload:
+                self.receiving -= 1
+        return Request(method, target, version, headers, body)
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        size = 0
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            try:
+                chunk_size = int(line.split(b";")[0], 16)
+            except ValueError:
+                raise HTTPError(400, "invalid chunk size")
+            if chunk_size == 0:
+                # Skip trailers
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass
+                return b"".join(chunks)
+            size += chunk_size
+            if size > self.max_body:
+                raise HTTPError(413)
+            chunks.append(await reader.readexactly(chunk_size))
+            await reader.readexactly(2)
+
+    async def _respond(self, writer, status, headers, body, keep_alive=True):
+        head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Length: {len(body)}",
+                f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        writer.write(body)
+        await writer.drain()
+
+    async def _dispatch(self, request):
+        if request.path == "/health" and request.method == "GET":
+            return 200, {"Content-Type": "application/json"}, json.dumps(self.health()).encode("utf-8")
+        if request.path != "/watermark":
+            raise HTTPError(404)
+        if request.method != "POST":
+            raise HTTPError(405)
+        job = self.job_for(request.params)
+        output = self.output_for(request.params)
+        if self.is_full():
+            self.rejected += 1
+            raise HTTPError(503, "too many requests in progress")
+
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            if "path" in request.params:
+                call = (_watermark_file, self.allowed_path(request.params["path"]), job, output)
+            elif request.body:
+                call = (watermark_bytes, request.body, job, output)
+            else:
+                raise HTTPError(400, "send the image as the request body or a path parameter")
+            pool = self._pool
+            try:
+                data, fmt, info = await loop.run_in_executor(pool, *call)
+            except FileNotFoundError:
+                raise HTTPError(404, "no such file")
+            except Image.DecompressionBombError as e:
+                raise HTTPError(413, str(e))
+            except BrokenProcessPool:
+                # A worker died (killed for memory, most likely), later requests get a fresh pool
+                if self._pool is pool:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = self._new_pool()
+                raise
+            except (OSError, ValueError, SyntaxError) as e:
+                # Pillow reports undecodable input with these
+                raise HTTPError(422, str(e))
+        finally:
+            self.in_flight -= 1
+        self.served += 1
+        headers = {
+            "Content-Type": Image.MIME.get(fmt, "application/octet-stream"),
+            "X-Watermark-Format": fmt,
+            "X-Process-Time-Ms": f"{(time.perf_counter() - start) * 1000:.1f}",
+        }
+        if info.get("brightness") is not None:
+            headers["X-Watermark-Brightness"] = f"{info['brightness']:.2f}"
+        return 200, headers, data
+
+    def is_full(self):
+        return self.in_flight + self.receiving >= self.workers + self.queue_limit
+
+    def allowed_path(self, path):
+        """Resolve a path parameter, only files under the allowed roots can be read"""
+        real = os.path.realpath(path)
+        for root in self.allowed_roots:
+            if real == root or real.startswith(root.rstrip(os.sep) + os.sep):
+                return real
+        raise HTTPError(403, "path is outside the allowed roots")
+
+    def job_for(self, params):
+        """Default job with the overrides of a request"""
+        data = self.job.to_dict()
+        for name in ("text", "color_mode", "layout"):
+            if name in params:
+                data[name] = params[name]
+        for name in ("font_percent", "opacity", "angle", "spacing"):
+            data[name] = _int_param(params, name, data[name])
+        if "auto_color" in params:
+            data["auto_color"] = params["auto_color"].lower() in TRUE_VALUES
+        if "font" in params:
+            # Fonts are only looked up by name, requests cannot point at arbitrary files
+            font = self.catalog.resolve(params["font"]) if self.catalog is not None else None
+            if font is None:
+                raise HTTPError(400, f"unknown font: {params['font']}")
+            data["font_path"], data["font_index"] = font["path"], font["index"]
+        if not data["text"] and not data["logo_path"]:
+            raise HTTPError(400, "text is required")
+        try:
+            return WatermarkJob.from_dict(data)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+    def output_for(self, params):
+        if not any(name in params for name in ("format", "preset", "quality")):
+            return self.output
+        if "preset" in params:
+            # A preset replaces the encoder settings but not the format or metadata policy
+            data = {"format": self.output.format, "keep_metadata": self.output.keep_metadata}
+        else:
+            data = self.output.to_dict()
+        if "format" in params:
+            data["format"] = params["format"]
+        if "quality" in params:
+            quality = _int_param(params, "quality", None)
+            data.update(jpeg_quality=quality, webp_quality=quality, avif_quality=quality)
+        try:
+            if "preset" in params:
+                return OutputOptions.from_preset(params["preset"], **data)
+            return OutputOptions(**data)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+    def health(self):
+        return {"workers": self.workers, "queue_limit": self.queue_limit, "in_flight": self.in_flight,
+                "receiving": self.receiving, "served": self.served, "rejected": self.rejected}
+
+
+def _error_response(error):
+    headers = {"Content-Type": "application/json"}
+    if error.status == 503:
+        headers["Retry-After"] = "1"
+    return error.status, headers, json.dumps({"error": str(error)}).encode("utf-8")
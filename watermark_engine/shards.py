@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import re
+import unicodedata
+
+from .metrics import JobReport
+
+# Folder the shard reports of a batch are written to, where its outputs go
+SHARD_REPORT_DIR = ".wm_shards"
+
+REPORT_NAME = re.compile(r"shard-(\d+)-of-(\d+)\.json")
+
+
+def shard_key(name):
+    """Form of a source path that is hashed, the same whichever OS or file system a node uses"""
+    return unicodedata.normalize("NFC", name.replace(os.sep, "/"))
+
+
+def shard_of(name, count):
+    """Shard (1 to count) a source path, relative to the batch folder, belongs to"""
+    digest = hashlib.blake2b(shard_key(name).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count + 1
+
+
+class Shard:
+    """Part index of count, counted from 1, of a batch split across processes or machines.
+
+    A source belongs to the shard its relative path hashes to, so every
+    node works out the same split of the same folder without talking to
+    the others, and new images never move existing ones to another shard.
+    """
+
+    def __init__(self, index, count):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f"invalid shard {index}/{count}, expected 1 <= i <= N")
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, text):
+        """Shard from "i/N", such as "2/4" """
+        try:
+            index, count = (int(part) for part in text.split("/"))
+        except ValueError:
+            raise ValueError(f"invalid shard {text!r}, expected i/N such as 2/4")
+        return cls(index, count)
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    @property
+    def label(self):
+        return f"shard-{self.index}-of-{self.count}"
+
+    def owns(self, name):
+        return shard_of(name, self.count) == self.index
+
+    def archive_path(self, path):
+        """Output archive of this shard, delivery.zip becomes delivery.shard-2-of-4.zip"""
+        directory, base = os.path.split(path)
+        root, dot, ext = base.partition(".")
+        return os.path.join(directory, f"{root}.{self.label}{dot}{ext}")
+
+    def report_path(self, directory):
+        return os.path.join(directory, f"{self.label}.json")
+
+    def write_report(self, report, directory, folder, fingerprint):
+        """Write the JobReport of this shard to directory, replaced in one step as merge may be reading it"""
+        data = report.to_dict()
+        data["shard"] = {"index": self.index, "count": self.count, "folder": folder, "fingerprint": fingerprint}
+        os.makedirs(directory, exist_ok=True)
+        path = self.report_path(directory)
+        tmp_path = f"{path}.{os.getpid()}.part"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+
+def load_shard_reports(directory):
+    """(count, {index: report dict}) of the shard reports in directory, which must all split the batch alike"""
+    reports = {}
+    counts = set()
+    for entry in sorted(os.listdir(directory)):
+        match = REPORT_NAME.fullmatch(entry)
+        if not match:
+            continue
+        with open(os.path.join(directory, entry), "r", encoding="utf-8") as f:
+            reports[int(match.group(1))] = json.load(f)
+        counts.add(int(match.group(2)))
+    if len(counts) > 1:
+        counts = ", ".join(str(count) for count in sorted(counts))
+        raise ValueError(f"{directory} holds reports of batches split {counts} ways, remove the stale ones")
+    if not reports:
+        raise ValueError(f"no shard reports in {directory}")
+    return counts.pop(), reports
+
+
+class MergeResult:
+    """Shard reports merged into one JobReport, with what is left to retry.
+
+    total is the number of sources in the batch, missing holds (name,
+    shard) for sources no report lists and failed (name, shard, error) for
+    those whose last attempt failed. Running those shards again with the
+    manifest on only processes them.
+    """
+
+    def __init__(self, count, total, report, missing_shards, missing, failed, settings_differ):
+        self.count = count
+        self.total = total
+        self.report = report
+        self.missing_shards = missing_shards
+        self.missing = missing
+        self.failed = failed
+        self.settings_differ = settings_differ
+
+    @property
+    def complete(self):
+        return not (self.missing_shards or self.missing or self.failed or self.settings_differ)
+
+    def retry_shards(self):
+        """Shards to run again, in order"""
+        shards = set(self.missing_shards)
+        shards.update(shard for _, shard in self.missing)
+        shards.update(shard for _, shard, _ in self.failed)
+        return sorted(shards)
+
+
+def merge_shards(directory, names):
+    """Merge the shard reports in directory and check them against names, every source of the batch.
+
+    A shard run again overwrites its report, so a source counts as done
+    when the last run of its shard processed it or found it up to date.
+    """
+    count, reports = load_shard_reports(directory)
+    report = JobReport.from_dicts([reports[index] for index in sorted(reports)])
+    rows = {shard_key(row["name"]): row for row in report.rows}
+    total = 0
+    missing = []
+    failed = []
+    for name in names:
+        total += 1
+        row = rows.get(shard_key(name))
+        if row is None:
+            missing.append((name, shard_of(name, count)))
+        elif row["status"] == "error":
+            failed.append((name, shard_of(name, count), row["error"]))
+    missing_shards = [index for index in range(1, count + 1) if index not in reports]
+    fingerprints = {data["shard"]["fingerprint"] for data in reports.values()}
+    return MergeResult(count, total, report, missing_shards, missing, failed, len(fingerprints) > 1)
@@ -0,0 +1,134 @@
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from io import BytesIO
+
+from .encode import output_name
+from .sources import archive_type
+
+OUTPUT_PREFIX = "wm_"
+
+# Formats already compressed by their encoder, deflating them again only costs CPU
+STORED_FORMATS = ("JPEG", "PNG", "WEBP", "AVIF", "GIF")
+
+
+def output_path_for(folder, name, fmt=None, output_dir=None):
+    """Where the result for name (relative to folder) is written.
+
+    Without output_dir results go next to their source with the wm_ prefix,
+    otherwise output_dir mirrors the input tree with unchanged names.
+    """
+    if fmt is not None:
+        name = output_name(name, fmt)
+    if output_dir is None:
+        rel_dir, base = os.path.split(name)
+        return os.path.join(folder, rel_dir, f"{OUTPUT_PREFIX}{base}")
+    return os.path.join(output_dir, name)
+
+
+class FileSink:
+    """Writes encoded results as files, laid out as output_path_for describes.
+
+    Each file is written under a temporary name in its final directory and
+    renamed into place with os.replace, so an interrupted batch never
+    leaves a truncated output and readers never see a partial one. The
+    temporary names start with a dot and end in .part, they are never
+    mistaken for images to process.
+    """
+
+    def __init__(self, folder, output_dir=None):
+        self.folder = folder
+        self.output_dir = output_dir
+
+    def path_for(self, name, fmt):
+        return output_path_for(self.folder, name, fmt, self.output_dir)
+
+    def write(self, name, fmt, data):
+        """Store data as the output of name, returns where it went"""
+        path = self.path_for(name, fmt)
+        directory, base = os.path.split(path)
+        os.makedirs(directory or ".", exist_ok=True)
+        tmp_path = os.path.join(directory, f".{base}.{os.getpid()}-{threading.get_ident()}.part")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def close(self):
+        pass
+
+
+class ArchiveSink:
+    """Writes encoded results as members of a zip or tar archive at path.
+
+    Each result is appended to the archive as soon as it is written, so
+    only the results waiting for the write lock are held in memory. Zip
+    members of already compressed formats (JPEG, PNG, WebP...) are STORED,
+    others deflated. Tar archives are compressed as a whole when the
+    extension asks for it (.tar.gz, .tgz...). Member names mirror the input
+    tree without the wm_ prefix, like an output_dir. The archive is built
+    under a temporary name and only renamed to path by close(), abort()
+    deletes it instead.
+    """
+
+    def __init__(self, path):
+        kind = archive_type(path)
+        if kind is None:
+            raise ValueError(f"not a zip or tar archive name: {path}")
+        self.path = path
+        directory, base = os.path.split(path)
+        os.makedirs(directory or ".", exist_ok=True)
+        self._tmp_path = os.path.join(directory, f".{base}.{os.getpid()}.part")
+        self._lock = threading.Lock()
+        self._zip = self._tar = None
+        if kind[0] == "zip":
+            self._zip = zipfile.ZipFile(self._tmp_path, "w", zipfile.ZIP_DEFLATED)
+        else:
+            self._tar = tarfile.open(self._tmp_path, f"w:{kind[1]}" if kind[1] else "w")
+
+    def path_for(self, name, fmt):
+        return f"{self.path}:{self._member(name, fmt)}"
+
+    @staticmethod
+    def _member(name, fmt):
+        return output_name(name, fmt).replace(os.sep, "/")
+
+    def write(self, name, fmt, data):
+        """Append data as the output of name, returns archive:member"""
+        member = self._member(name, fmt)
+        with self._lock:
+            if self._zip is not None:
+                info = zipfile.ZipInfo(member, time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_STORED if fmt in STORED_FORMATS else zipfile.ZIP_DEFLATED
+                self._zip.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(member)
+                info.size = len(data)
+                info.mtime = time.time()
+                self._tar.addfile(info, BytesIO(data))
+        return f"{self.path}:{member}"
+
+    def _finish(self):
+        with self._lock:
+            archive = self._zip if self._zip is not None else self._tar
+            self._zip = self._tar = None
+        if archive is not None:
+            archive.close()
+            return True
+        return False
+
+    def close(self):
+        if self._finish():
+            os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._finish()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
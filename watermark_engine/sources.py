@@ -0,0 +1,309 @@
+import os
+import posixpath
+import queue
+import tarfile
+import threading
+import zipfile
+from fnmatch import fnmatch
+
+# Extensions picked up without looking at the file contents
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".jpe", ".tif", ".tiff", ".webp", ".bmp", ".gif")
+
+# Leading bytes of the formats Pillow can decode, for files without a known extension
+SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+)
+
+# Archive extensions and how to open them, (kind, compression of the whole tar)
+ARCHIVE_TYPES = {
+    ".zip": ("zip", ""),
+    ".tar": ("tar", ""),
+    ".tar.gz": ("tar", "gz"),
+    ".tgz": ("tar", "gz"),
+    ".tar.bz2": ("tar", "bz2"),
+    ".tbz2": ("tar", "bz2"),
+    ".tar.xz": ("tar", "xz"),
+    ".txz": ("tar", "xz"),
+}
+
+_DONE = object()
+
+
+def sniff_format(path):
+    """Image format guessed from the first bytes of a file, or None"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(16)
+    except OSError:
+        return None
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for signature, fmt in SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    return None
+
+
+def _matches(rel_path, patterns):
+    name = os.path.basename(rel_path)
+    rel_path = rel_path.replace(os.sep, "/")
+    return any(fnmatch(rel_path, p) or fnmatch(name, p) for p in patterns)
+
+
+def wanted(rel_path, path, include=None, exclude=None, sniff=False, skip_prefixes=()):
+    """Whether a file, given relative to the folder and as a full path, is an image to process"""
+    name = os.path.basename(rel_path)
+    if skip_prefixes and name.startswith(tuple(skip_prefixes)):
+        return False
+    if exclude and _matches(rel_path, exclude):
+        return False
+    if include:
+        return _matches(rel_path, include)
+    if name.lower().endswith(IMAGE_EXTENSIONS):
+        return True
+    return sniff and sniff_format(path) is not None
+
+
+def iter_images(folder, recursive=False, include=None, exclude=None, sniff=False, skip_dirs=(),
+                skip_prefixes=(), shard=None):
+    """Yield the paths of the images under folder, relative to it, as they are found.
+
+    Directories are walked with os.scandir one at a time, so nothing is
+    listed up front and memory does not grow with the folder size. include
+    and exclude are glob patterns matched against the relative path and the
+    file name. With sniff, files without a known image extension are kept
+    when their first bytes look like an image. skip_dirs are directories
+    not to descend into, such as an output folder inside the input tree, and
+    files whose name starts with one of skip_prefixes (the wm_ outputs
+    written next to their sources) are never yielded. With a shard (see
+    shards.Shard) only the images it owns are, without sniffing the others.
+    """
+    skip_dirs = {os.path.normcase(os.path.abspath(d)) for d in skip_dirs}
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        with os.scandir(os.path.join(folder, rel_dir)) as entries:
+            subdirs = []
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and os.path.normcase(os.path.abspath(entry.path)) not in skip_dirs:
+                        subdirs.append(rel_path)
+                    continue
+                if shard is not None and not shard.owns(rel_path):
+                    continue
+                if entry.is_file() and wanted(rel_path, entry.path, include, exclude, sniff, skip_prefixes):
+                    yield rel_path
+        # Visit subdirectories in name order, depth first
+        pending.extend(sorted(subdirs, reverse=True))
+
+
+class FolderSource:
+    """Images of a folder fed through a bounded queue by a walker thread.
+
+    Iterating starts the walk in the background, so the first image can be
+    processed while the rest of the tree is still being scanned, and at
+    most queue_size paths are held in memory. discovered counts the images
+    found so far and finished tells whether the walk is complete.
+    """
+
+    def __init__(self, folder, recursive=False, include=None, exclude=None, sniff=False,
+                 skip_dirs=(), skip_prefixes=(), queue_size=1024, shard=None):
+        self.folder = folder
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.sniff = sniff
+        self.skip_dirs = skip_dirs
+        self.skip_prefixes = skip_prefixes
+        self.queue_size = queue_size
+        self.shard = shard
+        self.discovered = 0
+        self.finished = False
+        self._stop = threading.Event()
+
+    def _put(self, paths, item):
+        """Block until there is room in the queue, False once the consumer has gone"""
+        while not self._stop.is_set():
+            try:
+                paths.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _walk(self, paths):
+        try:
+            for rel_path in iter_images(self.folder, self.recursive, self.include, self.exclude,
+                                        self.sniff, self.skip_dirs, self.skip_prefixes, self.shard):
+                self.discovered += 1
+                if not self._put(paths, rel_path):
+                    return
+        except Exception as e:
+            self._put(paths, e)
+        finally:
+            self.finished = True
+            self._put(paths, _DONE)
+
+    def __iter__(self):
+        paths = queue.Queue(maxsize=self.queue_size)
+        self._stop.clear()
+        walker = threading.Thread(target=self._walk, args=(paths,), daemon=True)
+        walker.start()
+        try:
+            while True:
+                item = paths.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Unblock the walker if the consumer stops early
+            self._stop.set()
+
+    def close(self):
+        self._stop.set()
+
+
+def archive_type(path):
+    """(kind, compression) of an archive path from its extension, None for anything else"""
+    lower = path.lower()
+    for ext in sorted(ARCHIVE_TYPES, key=len, reverse=True):
+        if lower.endswith(ext):
+            return ARCHIVE_TYPES[ext]
+    return None
+
+
+def _safe_member(name):
+    """Whether an archive member name stays inside the tree it is extracted or mirrored to"""
+    parts = name.replace("\\", "/").split("/")
+    return not name.startswith(("/", "\\")) and ".." not in parts and ":" not in parts[0]
+
+
+class ArchiveSource:
+    """Images inside a zip or tar archive, read without extracting them to disk.
+
+    Iterating yields member names, read(name) returns the bytes of a member.
+    Zip members are inflated by whichever thread reads them, straight from
+    the central directory. Tar archives, compressed ones included, can
+    only be read in order, so a reader thread streams the members into a
+    queue of queue_size and each one is held until it is read. Memory is
+    then bounded by the queue and by how far ahead the batch reads.
+    Members in subfolders are included, as with a recursive FolderSource,
+    and include, exclude, skip_prefixes and shard filter them the same way.
+    """
+
+    def __init__(self, path, include=None, exclude=None, skip_prefixes=(), queue_size=16, shard=None):
+        self.path = path
+        self.include = include
+        self.exclude = exclude
+        self.skip_prefixes = skip_prefixes
+        self.queue_size = queue_size
+        self.shard = shard
+        self.kind = "zip" if zipfile.is_zipfile(path) else "tar"
+        self.discovered = 0
+        self.finished = False
+        self._stop = threading.Event()
+        self._zip = None
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _wanted(self, name):
+        if self.shard is not None and not self.shard.owns(name):
+            return False
+        return _safe_member(name) and wanted(name, None, self.include, self.exclude, False, self.skip_prefixes)
+
+    def names(self):
+        """Yield the names iterating yields, without reading any member"""
+        if self.kind == "zip":
+            with zipfile.ZipFile(self.path) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and self._wanted(info.filename):
+                        yield info.filename
+            return
+        with tarfile.open(self.path, "r|*") as tar:
+            for member in tar:
+                name = posixpath.normpath(member.name)
+                if member.isfile() and self._wanted(name):
+                    yield name
+
+    def _put(self, items, item):
+        while not self._stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _walk(self, items):
+        try:
+            if self.kind == "zip":
+                for info in self._zip.infolist():
+                    if not info.is_dir() and self._wanted(info.filename):
+                        self.discovered += 1
+                        if not self._put(items, (info.filename, None)):
+                            return
+                return
+            with tarfile.open(self.path, "r|*") as tar:
+                for member in tar:
+                    # tar -C dir . stores ./photo.jpg, the output should not keep the ./
+                    name = posixpath.normpath(member.name)
+                    if not member.isfile() or not self._wanted(name):
+                        continue
+                    self.discovered += 1
+                    if not self._put(items, (name, tar.extractfile(member).read())):
+                        return
+        except Exception as e:
+            self._put(items, e)
+        finally:
+            self.finished = True
+            self._put(items, _DONE)
+
+    def __iter__(self):
+        if self.kind == "zip" and self._zip is None:
+            self._zip = zipfile.ZipFile(self.path)
+        items = queue.Queue(maxsize=self.queue_size)
+        self._stop.clear()
+        walker = threading.Thread(target=self._walk, args=(items,), daemon=True)
+        walker.start()
+        try:
+            while True:
+                item = items.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                name, data = item
+                if data is not None:
+                    with self._lock:
+                        self._data[name] = data
+                yield name
+        finally:
+            self._stop.set()
+
+    def read(self, name):
+        """Bytes of a member yielded by the iteration, tar members can only be read once"""
+        if self._zip is not None:
+            return self._zip.read(name)
+        with self._lock:
+            return self._data.pop(name)
+
+    def discard(self):
+        """Drop the tar members yielded but never read"""
+        with self._lock:
+            self._data.clear()
+
+    def close(self):
+        self._stop.set()
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        self.discard()
@@ -0,0 +1,264 @@
+import math
+
+from PIL import Image, ImageDraw
+
+from .cache import LRUCache
+from .fonts import load_font
+from .logos import LogoPyramid
+
+# Largest pattern tile looked for, a few MB of RGBA per cached pattern
+PATTERN_MAX_PIXELS = 1024 * 1024
+
+
+class TextMetrics:
+    """Layout of the watermark text for one font and size.
+
+    bbox is the text bounding box relative to the drawing origin as returned
+    by textbbox((0, 0), ...). glyph_boxes holds one box per character, in
+    the same coordinates, or None for multiline text.
+    """
+
+    def __init__(self, bbox, glyph_boxes=None, font_cache_hit=None, font_error=None):
+        self.bbox = bbox
+        self.glyph_boxes = glyph_boxes
+        self.font_cache_hit = font_cache_hit
+        self.font_error = font_error
+
+    @property
+    def text_size(self):
+        return self.bbox[2] - self.bbox[0], self.bbox[3] - self.bbox[1]
+
+
+class Stamp:
+    """Watermark text rasterized once, with the metrics needed to place it.
+
+    tile only covers the ink of the text, its top-left corner sits at
+    (bbox[0], bbox[1]) from the drawing origin.
+    """
+
+    def __init__(self, tile, bbox):
+        self.tile = tile
+        self.bbox = bbox
+
+    @property
+    def text_size(self):
+        return self.bbox[2] - self.bbox[0], self.bbox[3] - self.bbox[1]
+
+
+class Pattern:
+    """Watermark text rotated once into a seamless tile, repeated over a whole image.
+
+    Laid edge to edge the tile continues the pattern: text crossing one
+    edge comes back on the opposite one. The tile converted to the mode of
+    an image, with its alpha mask, is kept so that is done once per mode.
+    """
+
+    def __init__(self, tile):
+        self.tile = tile
+        self._layers = {}
+
+    def layer(self, mode):
+        """(tile in mode, alpha mask)"""
+        if mode not in self._layers:
+            self._layers[mode] = (self.tile.convert(mode), self.tile.getchannel("A"))
+        return self._layers[mode]
+
+
+def measure_text(text, font_path, font_size, font_index=0):
+    font, font_cache_hit, font_error = load_font(font_path, font_size, index=font_index)
+    draw = ImageDraw.Draw(Image.new("RGBA", (0, 0)))
+    bbox = draw.textbbox((0, 0), text, font=font)
+    glyph_boxes = None
+    if "\n" not in text:
+        glyph_boxes = [draw.textbbox((draw.textlength(text[:i], font=font), 0), char, font=font)
+                       for i, char in enumerate(text)]
+    return TextMetrics(bbox, glyph_boxes, font_cache_hit, font_error)
+
+
+def is_glyph_colors(color):
+    """True when color holds one RGBA color per character"""
+    return len(color) > 0 and isinstance(color[0], tuple)
+
+
+def make_stamp(text, font_path, font_size, color, font_index=0):
+    font = load_font(font_path, font_size, index=font_index)[0]
+    draw = ImageDraw.Draw(Image.new("RGBA", (0, 0)))
+    bbox = draw.textbbox((0, 0), text, font=font)
+    tile = Image.new("RGBA", (max(bbox[2] - bbox[0], 1), max(bbox[3] - bbox[1], 1)), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(tile)
+    if is_glyph_colors(color):
+        # Each character is drawn on its own, advancing like the full string
+        for i, char in enumerate(text):
+            x = draw.textlength(text[:i], font=font)
+            draw.text((x - bbox[0], -bbox[1]), char, font=font, fill=color[i])
+    else:
+        draw.text((-bbox[0], -bbox[1]), text, font=font, fill=color)
+    return Stamp(tile, bbox)
+
+
+def make_logo_stamp(pyramid, height, opacity):
+    """Stamp of a LogoPyramid scaled to height pixels, its alpha scaled by opacity (0-255)"""
+    tile = pyramid.scaled(pyramid.size_for(height)).convert("RGBA")
+    if opacity < 255:
+        tile.putalpha(tile.getchannel("A").point(lambda a: a * opacity // 255))
+    return Stamp(tile, (0, 0) + tile.size)
+
+
+def _composite_clipped(dst, src, dest):
+    left, top = max(dest[0], 0), max(dest[1], 0)
+    right, bottom = min(dest[0] + src.width, dst.width), min(dest[1] + src.height, dst.height)
+    if right > left and bottom > top:
+        dst.alpha_composite(src, (left, top), (left - dest[0], top - dest[1], right - dest[0], bottom - dest[1]))
+
+
+def _lattice_layouts(step, line, sin, cos):
+    """Yield (cost, pixels, (width, height, copies), (v1, v2)) of tiles holding a lattice of copies.
+
+    Copies sit on lines of direction (cos, -sin), v1 apart along a line and
+    v2 from one line to the next, so that (width, 0) and (0, height) are
+    lattice steps and the tile repeats seamlessly. The horizontal period
+    crosses q lines, the vertical one `lines` lines.
+    """
+    direction = (cos, -sin)
+    # Unit normal of the lines pointing right
+    sign = 1 if sin > 0 else -1
+    normal = (sign * sin, sign * cos)
+    for q in range(1, 4):
+        width = q * line / abs(sin)
+        for lines in range(1, 13):
+            height = lines * line / abs(cos)
+            u = lines if normal[1] > 0 else -lines
+            # (width, 0) = p * v1 + q * v2 and (0, height) = r * v1 + u * v2 with m = q * r - u * p,
+            # solved for the spacing along a line, the m closest to the requested spacing are tried
+            along_x, along_y = width * direction[0], height * direction[1]
+            span = along_y * q - u * along_x
+            most = int(abs(span) / step)
+            for p in range(q):
+                for m in range(most, max(0, most - q), -1):
+                    m = m if span > 0 else -m
+                    if (m + u * p) % q:
+                        continue
+                    spacing = span / m
+                    stagger = (along_x - p * spacing) / q
+                    shift = stagger / spacing % 1
+                    # Neighbouring lines look best shifted by half a copy, aligned gaps read as bands
+                    cost = spacing / step - 1 + 2 * max(0.0, 0.25 - min(shift, 1 - shift))
+                    copies = round(width * height / (spacing * line))
+                    v1 = (spacing * direction[0], spacing * direction[1])
+                    v2 = (line * normal[0] + stagger * direction[0], line * normal[1] + stagger * direction[1])
+                    yield cost, width * height, (width, height, copies), (v1, v2)
+
+
+def pattern_layout(text_size, angle, gap):
+    """((width, height), copy centers) of a seamless tile for a text rotated by angle.
+
+    Copies sit on parallel lines along the text, gap apart between lines
+    and about gap apart along a line, with neighbouring lines staggered so
+    the gaps do not line up.
+    """
+    step, line = text_size[0] + gap, text_size[1] + gap
+    radians = math.radians(angle)
+    sin, cos = math.sin(radians), math.cos(radians)
+    if abs(sin) < 1e-3:
+        # Horizontal text, every other line shifted by half a copy
+        return (step, 2 * line), [(step / 2, line / 2), (0, line * 3 / 2)]
+    if abs(cos) < 1e-3:
+        return (2 * line, step), [(line / 2, step / 2), (line * 3 / 2, 0)]
+    layouts = list(_lattice_layouts(step, line, sin, cos))
+    # Near horizontal or vertical text needs long tiles, the smallest one is taken when none fits
+    fitting = [layout for layout in layouts if layout[1] <= PATTERN_MAX_PIXELS]
+    if fitting:
+        layout = min(fitting, key=lambda layout: (layout[0], layout[1]))
+    else:
+        layout = min(layouts, key=lambda layout: layout[1])
+    (width, height, copies), (v1, v2) = layout[2:]
+    # Integer tile size, the copy positions are stretched along with it so the tile stays seamless
+    size = max(1, round(width)), max(1, round(height))
+    # The periods move by q and `lines` lines, so gcd(q, lines) lines hold every copy of the tile
+    line_count = math.gcd(round(width * abs(sin) / line), round(height * abs(cos) / line))
+    centers = []
+    for j in range(line_count):
+        for i in range(copies // line_count):
+            x = (i * v1[0] + j * v2[0]) % width
+            y = (i * v1[1] + j * v2[1]) % height
+            centers.append((x * size[0] / width, y * size[1] / height))
+    return size, centers
+
+
+def make_pattern(text, font_path, font_size, color, angle=30, spacing=50, font_index=0):
+    """Pattern of the text rotated by angle degrees, spacing is the gap between copies in % of the font size"""
+    stamp = make_stamp(text, font_path, font_size, color, font_index)
+    # Rotated premultiplied so the transparent surroundings do not bleed into the edges of the glyphs
+    rotated = stamp.tile.convert("RGBa").rotate(angle, Image.BICUBIC, expand=True).convert("RGBA")
+    (width, height), centers = pattern_layout(stamp.tile.size, angle, max(1, font_size * spacing // 100))
+    tile = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+    # Each copy and its repeats in the neighbouring tiles, whatever part of them reaches into this one
+    reach_x = math.ceil(rotated.width / width) + 1
+    reach_y = math.ceil(rotated.height / height) + 1
+    for cx, cy in centers:
+        # Rounded once, round() goes to even on halves and would move repeats a pixel off the period
+        left, top = round(cx - rotated.width / 2), round(cy - rotated.height / 2)
+        for i in range(-reach_x, reach_x + 1):
+            for j in range(-reach_y, reach_y + 1):
+                _composite_clipped(tile, rotated, (left + i * width, top + j * height))
+    return Pattern(tile)
+
+
+class StampCache:
+    """Rendered stamps keyed by (text, font_path, font_size, font_index, color).
+
+    Text, font, opacity and color are fixed within a batch and most photos
+    share a resolution, so after the first image a stamp is only blended.
+    Text metrics are cached separately since they do not depend on color
+    and are needed to pick it. Tiled patterns are bigger and kept apart,
+    fewer of them. Logos are decoded once into a LogoPyramid, the stamps
+    scaled from it share the cache of text stamps.
+    """
+
+    def __init__(self, maxsize=32, patterns=8, logos=4):
+        self._stamps = LRUCache(maxsize)
+        self._metrics = LRUCache(maxsize)
+        self._patterns = LRUCache(patterns)
+        self._logos = LRUCache(logos)
+
+    def metrics(self, text, font_path, font_size, font_index=0):
+        """Return (metrics, hit)"""
+        return self._metrics.fetch(
+            (text, font_path, font_size, font_index),
+            lambda: measure_text(text, font_path, font_size, font_index)
+        )
+
+    def fetch(self, text, font_path, font_size, color, font_index=0):
+        """Return (stamp, hit), color is an RGBA tuple or one per character"""
+        return self._stamps.fetch(
+            (text, font_path, font_size, font_index, tuple(color)),
+            lambda: make_stamp(text, font_path, font_size, color, font_index)
+        )
+
+    def pattern(self, text, font_path, font_size, color, angle, spacing, font_index=0):
+        """Return (pattern, hit), color is an RGBA tuple"""
+        return self._patterns.fetch(
+            (text, font_path, font_size, font_index, tuple(color), angle, spacing),
+            lambda: make_pattern(text, font_path, font_size, color, angle, spacing, font_index)
+        )
+
+    def logo(self, logo_path, height, opacity):
+        """Return (stamp, hit) of the logo file scaled to height pixels"""
+        return self._stamps.fetch(
+            ("logo", logo_path, height, opacity),
+            lambda: make_logo_stamp(self._logos.fetch(logo_path, lambda: LogoPyramid.open(logo_path))[0],
+                                    height, opacity)
+        )
+
+    def clear(self):
+        self._stamps.clear()
+        self._metrics.clear()
+        self._patterns.clear()
+        self._logos.clear()
+
+    def stats(self):
+        return self._stamps.stats()
+
+
+# Process wide cache, each pool worker gets its own copy
+default_stamp_cache = StampCache()
@@ -0,0 +1,264 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from .batch import OUTPUT_PREFIX, run_batch
+from .sources import FolderSource, wanted
+
+# inotify(7) event bits
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ATTRIB | IN_DELETE_SELF
+
+_EVENT = struct.Struct("iIII")
+
+
+def _normalized(paths):
+    return {os.path.normcase(os.path.abspath(p)) for p in paths}
+
+
+def _walk_files(folder, recursive, skip_dirs):
+    """Yield (relative path, stat) of every file under folder"""
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        try:
+            entries = list(os.scandir(os.path.join(folder, rel_dir)))
+        except OSError:
+            continue
+        for entry in entries:
+            rel_path = os.path.join(rel_dir, entry.name)
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and os.path.normcase(os.path.abspath(entry.path)) not in skip_dirs:
+                        pending.append(rel_path)
+                elif entry.is_file():
+                    yield rel_path, entry.stat()
+            except OSError:
+                continue
+
+
+class PollingWatcher:
+    """Finds new and modified files by comparing size and mtime every interval seconds.
+
+    Works everywhere, including network shares where inotify sees nothing,
+    but has to list the whole tree on every poll.
+    """
+
+    def __init__(self, folder, recursive=False, skip_dirs=(), interval=2.0):
+        self.folder = folder
+        self.recursive = recursive
+        self.skip_dirs = _normalized(skip_dirs)
+        self.interval = interval
+        self._seen = self._snapshot()
+        self._next_poll = time.monotonic() + interval
+
+    def _snapshot(self):
+        return {rel: (st.st_size, st.st_mtime_ns)
+                for rel, st in _walk_files(self.folder, self.recursive, self.skip_dirs)}
+
+    def changes(self, timeout):
+        """Relative paths created or modified since the last call, waits at most timeout seconds"""
+        wait = self._next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        if wait > 0:
+            time.sleep(wait)
+        self._next_poll = time.monotonic() + self.interval
+        seen = self._snapshot()
+        changed = [rel for rel, state in seen.items() if self._seen.get(rel) != state]
+        self._seen = seen
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Linux inotify through ctypes, only the files that changed are reported.
+
+    Subdirectories get their own watch as they appear, the files already
+    in a new directory are reported since they may have landed before the
+    watch was added. On a queue overflow the whole tree is reported and
+    the manifest sorts out what is actually new.
+    """
+
+    def __init__(self, folder, recursive=False, skip_dirs=()):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.folder = folder
+        self.recursive = recursive
+        self.skip_dirs = _normalized(skip_dirs)
+        self._dirs = {}
+        self._watch_tree("")
+        if not self._dirs:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"cannot watch {folder}")
+
+    def _watch(self, rel_dir):
+        wd = self._add_watch(self.fd, os.fsencode(os.path.join(self.folder, rel_dir)), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify watch limit reached, raise fs.inotify.max_user_watches "
+                                   "or use polling")
+            return False
+        self._dirs[wd] = rel_dir
+        return True
+
+    def _watch_tree(self, rel_dir):
+        """Watch rel_dir and, when recursive, its subdirectories, returning the files already there"""
+        if not self._watch(rel_dir):
+            return []
+        files = []
+        pending = [rel_dir]
+        while pending:
+            current = pending.pop()
+            try:
+                entries = list(os.scandir(os.path.join(self.folder, current)))
+            except OSError:
+                continue
+            for entry in entries:
+                rel_path = os.path.join(current, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if self.recursive and self._allowed(entry.path) and self._watch(rel_path):
+                        pending.append(rel_path)
+                elif entry.is_file():
+                    files.append(rel_path)
+        return files
+
+    def _allowed(self, path):
+        return os.path.normcase(os.path.abspath(path)) not in self.skip_dirs
+
+    def changes(self, timeout):
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if not readable:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                changed.extend(rel for rel, _ in _walk_files(self.folder, self.recursive, self.skip_dirs))
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            rel_dir = self._dirs.get(wd)
+            if rel_dir is None or not name:
+                continue
+            rel_path = os.path.join(rel_dir, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO) and \
+                        self._allowed(os.path.join(self.folder, rel_path)):
+                    changed.extend(self._watch_tree(rel_path))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ATTRIB):
+                changed.append(rel_path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_watcher(folder, recursive=False, skip_dirs=(), polling=False, poll_interval=2.0):
+    """inotify on Linux unless polling is asked for or inotify is unavailable"""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder, recursive, skip_dirs)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(folder, recursive, skip_dirs, poll_interval)
+
+
+class Settler:
+    """Holds back files until their size and mtime stopped changing for settle seconds.
+
+    A file still being copied keeps growing or getting a new mtime, it is
+    only released once it looks complete.
+    """
+
+    def __init__(self, folder, settle=1.0):
+        self.folder = folder
+        self.settle = settle
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, rel_path):
+        # The first stat happens on the next ready() call
+        self._pending.setdefault(rel_path, (None, 0.0))
+
+    def ready(self):
+        now = time.monotonic()
+        done = []
+        for rel_path, (state, since) in list(self._pending.items()):
+            try:
+                stat = os.stat(os.path.join(self.folder, rel_path))
+            except OSError:
+                # Deleted or renamed away before it settled
+                del self._pending[rel_path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != state:
+                self._pending[rel_path] = (current, now)
+            elif now - since >= self.settle:
+                del self._pending[rel_path]
+                done.append(rel_path)
+        return sorted(done)
+
+
+def watch(folder, job, output=None, output_dir=None, manifest=None, recursive=False, include=None,
+          exclude=None, sniff=False, settle=1.0, polling=False, poll_interval=2.0, initial=True,
+          on_result=None, should_continue=None, workers=1, memory_budget=None, skip_prefixes=(OUTPUT_PREFIX,)):
+    """Watermark images as they arrive in folder until should_continue() returns False.
+
+    With initial, the images already there are processed first. Arrivals
+    are detected with inotify (or polling, see open_watcher), held back by
+    a Settler until the writer is done, then handed to run_batch. Files
+    starting with skip_prefixes, the wm_ outputs by default, and output_dir
+    are never picked up, and with a Manifest a file is only processed again
+    when it actually changed. on_result and memory_budget are as in
+    run_batch, indices are counted per group of files.
+    """
+    skip_dirs = [output_dir] if output_dir else ()
+    keep_going = should_continue or (lambda: True)
+    # Watch before the first pass so nothing arriving during it is missed
+    watcher = open_watcher(folder, recursive, skip_dirs, polling, poll_interval)
+    settler = Settler(folder, settle)
+    try:
+        if initial:
+            existing = FolderSource(folder, recursive, include, exclude, sniff, skip_dirs, skip_prefixes)
+            run_batch(folder, job, existing, on_result, should_continue, workers, output, output_dir, manifest,
+                      memory_budget=memory_budget)
+        while keep_going():
+            for rel_path in watcher.changes(timeout=min(settle, 0.5) if len(settler) else 0.5):
+                if wanted(rel_path, os.path.join(folder, rel_path), include, exclude, sniff, skip_prefixes):
+                    settler.add(rel_path)
+            ready = settler.ready()
+            if ready:
+                run_batch(folder, job, ready, on_result, should_continue, workers, output, output_dir, manifest,
+                          memory_budget=memory_budget)
+    finally:
+        watcher.close()